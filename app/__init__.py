@@ -2,6 +2,9 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
 import os
 
 # 加载环境变量
@@ -10,6 +13,15 @@ load_dotenv()
 # 创建数据库实例
 db = SQLAlchemy()
 
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    """SQLite启用WAL，允许多个worker进程并发读、写时等待而不是立即报错"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
 def create_app():
     app = Flask(__name__)
     
@@ -32,14 +44,26 @@ def create_app():
     from .routes.content import content_bp
     from .routes.quiz import quiz_bp
     from .routes.session import session_bp
+    from .routes.search import search_bp
+    from .routes.usage import usage_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(content_bp, url_prefix='/api/content')
     app.register_blueprint(quiz_bp, url_prefix='/api/quiz')
     app.register_blueprint(session_bp, url_prefix='/api/session')
+    app.register_blueprint(search_bp, url_prefix='/api/search')
+    app.register_blueprint(usage_bp, url_prefix='/api/usage')
     
     # 注册静态文件路由
     from .routes.static import static_bp
     app.register_blueprint(static_bp)
     
+    # 注册实时通道（WebSocket）
+    from . import realtime
+    realtime.init_app(app)
+    
+    # 按出题间隔在后台预先生成候选题目
+    from . import pregeneration
+    pregeneration.init_app(app)
+    
     return app
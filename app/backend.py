@@ -0,0 +1,331 @@
+"""
+跨进程共享状态后端
+
+多进程部署时，各个worker进程之间需要共享的状态（题目缓存失效通知、
+实时事件广播、限流计数、统计计数等）都通过这里的后端完成；排行榜直接由数据库聚合，
+本身就是各进程共享的，不经过这里：
+
+- MemoryBackend: 进程内实现，适合 run.py 单进程开发服务器
+- RedisBackend:  基于Redis协议的实现，任何兼容Redis协议的服务都可以使用
+                 （redis-server、本地替身如 fakeredis 等）
+
+通过环境变量选择：
+    STATE_BACKEND=memory|redis   （默认 memory）
+    REDIS_URL=redis://localhost:6379/0
+"""
+import os
+import json
+import time
+import threading
+import uuid
+from collections import defaultdict
+
+# 可选导入 - 未安装redis时只能使用内存后端
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    redis = None
+
+
+class MemoryBackend:
+    """进程内状态后端（线程安全）"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._values = {}  # key -> (value, expire_at)
+        self._hashes = defaultdict(dict)
+        self._hash_expiry = {}  # name -> expire_at
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._leases = defaultdict(dict)  # key -> {lease_id: expire_at}
+        self._subscribers = defaultdict(list)
+
+    # ---- 键值 ----
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                return None
+            value, expire_at = item
+            if expire_at is not None and expire_at <= time.time():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (value, time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """仅当键不存在时写入，返回是否写入成功（可用作简单的分布式锁）"""
+        with self._lock:
+            if self.get(key) is not None:
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+            self._hashes.pop(key, None)
+            self._hash_expiry.pop(key, None)
+
+    def expire(self, key, ttl):
+        """设置键或哈希的过期时间（秒）"""
+        with self._lock:
+            expire_at = time.time() + ttl
+            if key in self._values:
+                self._values[key] = (self._values[key][0], expire_at)
+            if key in self._hashes:
+                self._hash_expiry[key] = expire_at
+
+    def incr(self, key, amount=1, ttl=None):
+        """原子自增，键不存在时从0开始；ttl只在首次创建时设置"""
+        with self._lock:
+            current = self.get(key)
+            if current is None:
+                self.set(key, amount, ttl)
+                return amount
+            expire_at = self._values[key][1]
+            current = int(current) + amount
+            self._values[key] = (current, expire_at)
+            return current
+
+    # ---- 哈希（计数器） ----
+    def _purge_hash(self, name):
+        expire_at = self._hash_expiry.get(name)
+        if expire_at is not None and expire_at <= time.time():
+            self._hashes.pop(name, None)
+            del self._hash_expiry[name]
+
+    def hincrby(self, name, field, amount=1):
+        with self._lock:
+            self._purge_hash(name)
+            table = self._hashes[name]
+            table[field] = table.get(field, 0) + amount
+            return table[field]
+
+    def hgetall(self, name):
+        with self._lock:
+            self._purge_hash(name)
+            return dict(self._hashes.get(name, {}))
+
+    # ---- 令牌桶（限流） ----
+    def take_tokens(self, key, capacity, rate, amount=1, consume=True):
+        """
+        从令牌桶取出 amount 个令牌（桶容量 capacity，每秒补充 rate 个）
+
+        Returns:
+            0 表示已取出；否则为令牌足够还需等待的秒数（此时不扣减）。
+            amount 为负数时把令牌退回桶中；consume=False 时只计算等待时间
+        """
+        with self._lock:
+            now = time.time()
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+            wait = 0.0
+            if amount <= 0 or amount <= tokens:
+                if consume:
+                    tokens -= amount
+            else:
+                wait = (amount - tokens) / rate
+            self._buckets[key] = (min(capacity, tokens), now)
+            return wait
+
+    # ---- 租约（跨进程的并发上限） ----
+    def acquire_lease(self, key, limit, ttl):
+        """当前有效租约少于 limit 个时新建一个并返回其ID，否则返回None；租约 ttl 秒后自动过期"""
+        with self._lock:
+            now = time.time()
+            leases = self._leases[key]
+            for lease_id in [i for i, expire_at in leases.items() if expire_at <= now]:
+                del leases[lease_id]
+            if len(leases) >= limit:
+                return None
+            lease_id = uuid.uuid4().hex
+            leases[lease_id] = now + ttl
+            return lease_id
+
+    def release_lease(self, key, lease_id):
+        with self._lock:
+            self._leases[key].pop(lease_id, None)
+
+    def lease_count(self, key):
+        with self._lock:
+            now = time.time()
+            return sum(1 for expire_at in self._leases.get(key, {}).values() if expire_at > now)
+
+    # ---- 发布/订阅 ----
+    def publish(self, channel, message):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, []))
+        for callback in callbacks:
+            try:
+                callback(message)
+            except Exception as e:
+                print(f"警告：处理频道 {channel} 的消息失败: {e}")
+        return len(callbacks)
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._subscribers[channel].append(callback)
+
+
+# 令牌桶和租约需要“读取-判断-写入”原子完成，用Lua脚本在Redis端执行；时间取Redis服务器时间
+_TAKE_TOKENS_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local consume = ARGV[4] == '1'
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if amount <= 0 or amount <= tokens then
+    if consume then tokens = tokens - amount end
+else
+    wait = (amount - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(capacity, tokens)), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+_ACQUIRE_LEASE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) * 1000))
+return 1
+"""
+
+
+class RedisBackend:
+    """基于Redis协议的状态后端，所有worker进程共享同一个Redis"""
+
+    name = 'redis'
+
+    def __init__(self, url):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("未安装redis库，无法使用Redis状态后端（pip install redis）")
+        self.url = url
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self._subscribers = defaultdict(list)
+        self._pubsub = None
+        self._listener = None
+        self._lock = threading.Lock()
+        self._take_tokens = self.client.register_script(_TAKE_TOKENS_SCRIPT)
+        self._acquire_lease = self.client.register_script(_ACQUIRE_LEASE_SCRIPT)
+
+    # ---- 键值（值以JSON存储） ----
+    def get(self, key):
+        raw = self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def expire(self, key, ttl):
+        self.client.pexpire(key, int(ttl * 1000))
+
+    def incr(self, key, amount=1, ttl=None):
+        pipe = self.client.pipeline()
+        pipe.incrby(key, amount)
+        if ttl:
+            # 只在键没有过期时间时设置，等价于“首次创建时设置”
+            pipe.pexpire(key, int(ttl * 1000), nx=True)
+        return int(pipe.execute()[0])
+
+    # ---- 哈希（计数器） ----
+    def hincrby(self, name, field, amount=1):
+        return int(self.client.hincrby(name, field, amount))
+
+    def hgetall(self, name):
+        return {k: int(v) for k, v in self.client.hgetall(name).items()}
+
+    # ---- 令牌桶（限流） ----
+    def take_tokens(self, key, capacity, rate, amount=1, consume=True):
+        return float(self._take_tokens(keys=[key], args=[capacity, rate, amount, '1' if consume else '0']))
+
+    # ---- 租约（跨进程的并发上限） ----
+    def acquire_lease(self, key, limit, ttl):
+        lease_id = uuid.uuid4().hex
+        return lease_id if self._acquire_lease(keys=[key], args=[limit, ttl, lease_id]) else None
+
+    def release_lease(self, key, lease_id):
+        self.client.zrem(key, lease_id)
+
+    def lease_count(self, key):
+        return int(self.client.zcount(key, time.time(), '+inf'))
+
+    # ---- 发布/订阅 ----
+    def publish(self, channel, message):
+        return self.client.publish(channel, json.dumps(message))
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._subscribers[channel].append(callback)
+            if self._pubsub is None:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(channel)
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='redis-pubsub', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        """后台线程：把Redis消息分发给本进程内的订阅者"""
+        while True:
+            try:
+                for item in self._pubsub.listen():
+                    if item.get('type') != 'message':
+                        continue
+                    channel = item['channel']
+                    try:
+                        message = json.loads(item['data'])
+                    except (TypeError, ValueError):
+                        continue
+                    with self._lock:
+                        callbacks = list(self._subscribers.get(channel, []))
+                    for callback in callbacks:
+                        try:
+                            callback(message)
+                        except Exception as e:
+                            print(f"警告：处理频道 {channel} 的消息失败: {e}")
+            except Exception as e:
+                print(f"警告：Redis订阅连接中断，1秒后重连: {e}")
+                time.sleep(1)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """获取当前进程的状态后端（延迟初始化）"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = os.getenv('STATE_BACKEND', 'memory').lower()
+                if kind == 'redis':
+                    _backend = RedisBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+                    print(f"✅ 使用Redis状态后端: {_backend.url}")
+                else:
+                    _backend = MemoryBackend()
+    return _backend
@@ -0,0 +1,75 @@
+"""
+压缩存储的长文本列
+
+长PDF和视频转写的提取结果每条可达数MB。CompressedText 在写入数据库前压缩、
+读取时解压，对模型代码透明（属性仍然是 str）：
+
+- 安装了 zstandard 时使用 zstd，否则使用标准库 zlib
+- 很短的文本不压缩，直接存储
+- 压缩数据带1字节格式标记，读取时按标记解压；升级前写入的旧数据（纯文本）原样返回，
+  所以已有的数据库无需转换（SQLite 的 TEXT 列可以直接存放二进制数据）
+
+环境变量：
+    TEXT_COMPRESSION=auto|zstd|zlib   （默认 auto）
+"""
+import os
+import zlib
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+
+from app.optional_deps import is_available, load
+
+ZSTD_AVAILABLE = is_available('zstandard')
+# 短于该字节数的文本直接存储
+MIN_COMPRESS_BYTES = 256
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 6
+
+RAW, ZLIB, ZSTD = b'r', b'z', b's'
+
+
+def _codec():
+    name = os.getenv('TEXT_COMPRESSION', 'auto').lower()
+    if name == 'zlib' or not ZSTD_AVAILABLE:
+        return ZLIB
+    return ZSTD
+
+
+def compress_text(text):
+    data = text.encode('utf-8')
+    if len(data) < MIN_COMPRESS_BYTES:
+        return RAW + data
+    if _codec() == ZSTD:
+        return ZSTD + load('zstandard').ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return ZLIB + zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_text(value):
+    if isinstance(value, str):
+        return value  # 旧数据：未压缩的文本
+    value = bytes(value)
+    marker, payload = value[:1], value[1:]
+    if marker == ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if marker == ZSTD:
+        return load('zstandard').ZstdDecompressor().decompress(payload).decode('utf-8')
+    if marker == RAW:
+        return payload.decode('utf-8')
+    return value.decode('utf-8')
+
+
+class CompressedText(TypeDecorator):
+    """以压缩二进制存储的文本列"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return decompress_text(value)
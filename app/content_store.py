@@ -0,0 +1,126 @@
+"""
+结构化内容读写
+
+提取结果按页/幻灯片/音频片段保存在 ContentSegment 表中（带来源类型和字符偏移），
+列表预览、出题和按幻灯片重新出题只读取需要的片段，不再加载整段 extracted_text。
+
+在片段表出现之前上传的内容没有片段，读取时回退到 Content.extracted_text。
+文本本身压缩存储（见 app/compressed_text.py），列表只读 text_length / text_preview 小列。
+"""
+from sqlalchemy import func
+
+from app import db
+from app.models import Content, ContentSegment
+from app.search import remove_content_segments
+
+SEGMENT_SEPARATOR = '\n'
+CONTENT_SEPARATOR = '\n\n'
+
+
+def save_segments(content, segments):
+    """
+    写入内容的片段并更新完整文本（调用方负责提交）
+
+    Args:
+        segments: [{'text', 'source_kind', 'page_number'}, ...]，见 file_processor.make_segment
+    """
+    # 批量删除不触发ORM事件，先删除旧片段的全文索引
+    remove_content_segments(content.id)
+    ContentSegment.query.filter_by(content_id=content.id).delete(synchronize_session=False)
+    offset = 0
+    for seq, segment in enumerate(segments):
+        text = segment['text']
+        db.session.add(ContentSegment(
+            content_id=content.id,
+            seq=seq,
+            page_number=segment.get('page_number'),
+            source_kind=segment['source_kind'],
+            char_start=offset,
+            char_end=offset + len(text),
+            text=text
+        ))
+        offset += len(text) + len(SEGMENT_SEPARATOR)
+    content.extracted_text = SEGMENT_SEPARATOR.join(segment['text'] for segment in segments)
+
+
+def _has_segments():
+    return db.session.query(ContentSegment.id).filter(ContentSegment.content_id == Content.id).exists()
+
+
+def content_summaries(content_ids):
+    """
+    批量获取内容的文本长度、片段数和预览，不读取（也不解压）完整文本
+
+    Returns:
+        {content_id: {'text_length', 'segment_count', 'text_preview'}}
+    """
+    if not content_ids:
+        return {}
+
+    rows = db.session.query(Content.id, Content.text_length, Content.text_preview).filter(
+        Content.id.in_(content_ids)
+    ).all()
+    # 旧内容的长度和预览在启动时由 upgrade_schema 补算，这里不再写入
+    summaries = {
+        content_id: {'text_length': text_length or 0, 'segment_count': 0, 'text_preview': preview}
+        for content_id, text_length, preview in rows
+    }
+
+    counts = db.session.query(ContentSegment.content_id, func.count(ContentSegment.id)).filter(
+        ContentSegment.content_id.in_(content_ids)
+    ).group_by(ContentSegment.content_id).all()
+    for content_id, segment_count in counts:
+        summaries[content_id]['segment_count'] = segment_count
+    return summaries
+
+
+def session_text(session_id, content_ids=None, pages=None, source_kinds=None, max_chars=None):
+    """
+    拼接会话中选定片段的文本，用于出题
+
+    Args:
+        content_ids: 只使用这些内容
+        pages: 只使用这些页码/幻灯片序号（旧内容没有页码信息，指定时会被跳过）
+        source_kinds: 只使用这些来源类型，如 ['text', 'ocr']
+        max_chars: 文本长度上限，达到后停止读取后续片段
+
+    Returns:
+        拼接后的文本
+    """
+    query = db.session.query(ContentSegment.content_id, ContentSegment.text).join(
+        Content, Content.id == ContentSegment.content_id
+    ).filter(Content.session_id == session_id)
+    if content_ids:
+        query = query.filter(ContentSegment.content_id.in_(content_ids))
+    if pages:
+        query = query.filter(ContentSegment.page_number.in_(pages))
+    if source_kinds:
+        query = query.filter(ContentSegment.source_kind.in_(source_kinds))
+    query = query.order_by(Content.upload_time, Content.id, ContentSegment.seq)
+
+    parts = []
+    length = 0
+    last_content_id = None
+    for content_id, text in query.yield_per(100):
+        separator = '' if last_content_id is None else (
+            SEGMENT_SEPARATOR if content_id == last_content_id else CONTENT_SEPARATOR)
+        parts.append(separator + text)
+        length += len(separator) + len(text)
+        last_content_id = content_id
+        if max_chars and length >= max_chars:
+            return ''.join(parts)[:max_chars]
+
+    if not pages and not source_kinds:
+        legacy = Content.query.with_entities(Content.extracted_text).filter(
+            Content.session_id == session_id, Content.extracted_text.isnot(None), ~_has_segments()
+        )
+        if content_ids:
+            legacy = legacy.filter(Content.id.in_(content_ids))
+        for (text,) in legacy.order_by(Content.upload_time, Content.id):
+            parts.append(('' if not parts else CONTENT_SEPARATOR) + text)
+            length += len(parts[-1])
+            if max_chars and length >= max_chars:
+                break
+
+    text = ''.join(parts)
+    return text[:max_chars] if max_chars else text
@@ -0,0 +1,216 @@
+"""
+生成题目时的近似重复检测
+
+对同一份资料反复出题、或 upload-multiple 按文件分别出题时，模型经常给出几乎相同的题目。
+这里在写入数据库前把新题目与会话中已有的题目（以及同一批中的其他题目）比较：
+
+- 题干 + 选项（与选项顺序无关）去掉空白和标点后切成字符 3-gram，用 NumPy 计算 MinHash 签名
+- 签名分段做 LSH 分桶，只对落在同一桶里的候选题目估算相似度，
+  会话有上千道题时单次检查仍然只比较少量候选
+- 每个会话的签名和分桶按LRU缓存在进程内；题目新增后按最大ID增量补充，题目减少时重建
+
+环境变量：
+    DEDUP_MODE=drop          drop 丢弃重复题目，flag 保留并标出，off 不检测
+    DEDUP_THRESHOLD=0.8      估算的 Jaccard 相似度达到该值视为重复
+"""
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+from sqlalchemy import func
+
+from app import db
+from app.models import Quiz
+from app.optional_deps import load
+
+MODES = ('drop', 'flag', 'off')
+NUM_PERM = 64
+BANDS = 16  # 每段 4 行，相似度约 0.5 以上的题目才会成为候选
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+MAX_SESSIONS = 64
+
+_NOISE_RE = re.compile(r'[\W_]+')
+
+
+def _threshold():
+    return float(os.getenv('DEDUP_THRESHOLD', 0.8))
+
+
+def default_mode():
+    mode = os.getenv('DEDUP_MODE', 'drop').lower()
+    return mode if mode in MODES else 'drop'
+
+
+def quiz_text(quiz):
+    """参与比较的文本：题干加排序后的选项（quiz 为字典或 Quiz 对象）"""
+    get = quiz.get if isinstance(quiz, dict) else lambda name, default=None: getattr(quiz, name, default)
+    options = sorted(get(f'option_{letter}') or '' for letter in 'abcd')
+    return '\n'.join([get('question') or ''] + options)
+
+
+@lru_cache(maxsize=1)
+def _hash_params():
+    """通用哈希 (a * x + b) mod P 的参数，x 为32位哈希值；a、b 小于 2^31，乘积不会溢出 uint64"""
+    np = load('numpy')  # 首次比较题目时才导入
+    rng = np.random.RandomState(20240611)
+    return (np.uint64(4294967311), rng.randint(1, 2 ** 31, size=NUM_PERM).astype(np.uint64),
+            rng.randint(0, 2 ** 31, size=NUM_PERM).astype(np.uint64))
+
+
+def signature(value):
+    """文本的 MinHash 签名（uint64 数组）"""
+    normalized = _NOISE_RE.sub('', value.lower())
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    np = load('numpy')
+    prime, a, b = _hash_params()
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % prime).min(axis=1)
+
+
+def _band_keys(sig):
+    return [(band, sig[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+
+
+def similarity(sig_a, sig_b):
+    """两个签名估算的 Jaccard 相似度"""
+    return float((sig_a == sig_b).sum()) / NUM_PERM
+
+
+class SignatureIndex:
+    """一组签名及其 LSH 分桶"""
+
+    def __init__(self):
+        self.signatures = {}  # key -> 签名
+        self.buckets = {}  # (段号, 段内容) -> [key]
+
+    def add(self, key, sig):
+        self.signatures[key] = sig
+        for band_key in _band_keys(sig):
+            self.buckets.setdefault(band_key, []).append(key)
+
+    def most_similar(self, sig):
+        """返回 (key, 相似度)，没有候选时返回 (None, 0.0)"""
+        candidates = set()
+        for band_key in _band_keys(sig):
+            candidates.update(self.buckets.get(band_key, ()))
+        best, best_score = None, 0.0
+        for key in candidates:
+            score = similarity(sig, self.signatures[key])
+            if score > best_score:
+                best, best_score = key, score
+        return best, best_score
+
+
+class _SessionEntry:
+    __slots__ = ('index', 'count', 'max_id')
+
+    def __init__(self):
+        self.index = SignatureIndex()
+        self.count = 0
+        self.max_id = 0
+
+
+class DuplicateDetector:
+    """按会话缓存已有题目签名的重复检测器（线程安全）"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session_index(self, session_id):
+        """获取会话已有题目的签名索引，与数据库中的题目同步"""
+        count, max_id = db.session.query(func.count(Quiz.id), func.max(Quiz.id)).filter(
+            Quiz.session_id == session_id).one()
+        max_id = max_id or 0
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or count < entry.count:
+                entry = _SessionEntry()  # 首次使用或有题目被删除：重建
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            if count == entry.count and max_id == entry.max_id:
+                return entry.index
+            since = entry.max_id
+
+        rows = Quiz.query.with_entities(
+            Quiz.id, Quiz.question, Quiz.option_a, Quiz.option_b, Quiz.option_c, Quiz.option_d
+        ).filter(Quiz.session_id == session_id, Quiz.id > since).order_by(Quiz.id).all()
+        new_signatures = [(row.id, signature(quiz_text(row._asdict()))) for row in rows]
+
+        with self._lock:
+            if entry.max_id == since:  # 其他线程可能已经补充过
+                for quiz_id, sig in new_signatures:
+                    entry.index.add(quiz_id, sig)
+                entry.count = count
+                entry.max_id = max_id
+            return entry.index
+
+    def check(self, session_id, quizzes):
+        """
+        检查一批新题目
+
+        Returns:
+            与 quizzes 一一对应的列表：不重复为 None，重复时为
+            {'quiz_id': 已有题目ID, 'similarity': ...} 或 {'batch_index': 同批题目下标, 'similarity': ...}
+        """
+        threshold = _threshold()
+        existing = self._session_index(session_id)
+        batch = SignatureIndex()
+        results = []
+        for i, quiz in enumerate(quizzes):
+            sig = signature(quiz_text(quiz))
+            quiz_id, score = existing.most_similar(sig)
+            match = {'quiz_id': quiz_id, 'similarity': round(score, 3)} if score >= threshold else None
+            if match is None:
+                index, score = batch.most_similar(sig)
+                if score >= threshold:
+                    match = {'batch_index': index, 'similarity': round(score, 3)}
+            if match is None:
+                batch.add(i, sig)  # 只有保留下来的题目参与同批比较
+            results.append(match)
+        return results
+
+
+duplicate_detector = DuplicateDetector()
+
+
+def filter_duplicates(session_id, quizzes, mode=None):
+    """
+    按模式处理生成的题目中的近似重复
+
+    Args:
+        quizzes: 题目字典列表（question, option_a..option_d, ...）
+        mode: drop / flag / off，默认取 DEDUP_MODE
+
+    Returns:
+        (保留的题目, 重复题目列表)；flag 模式下重复题目也保留，并带 duplicate_of 字段
+    """
+    mode = mode if mode in MODES else default_mode()
+    if mode == 'off' or not quizzes:
+        return list(quizzes), []
+
+    session_id = int(session_id)  # 表单提交的会话ID是字符串
+    kept, duplicates = [], []
+    for quiz, match in zip(quizzes, duplicate_detector.check(session_id, quizzes)):
+        if match is None:
+            kept.append(quiz)
+            continue
+        quiz['duplicate_of'] = match
+        duplicates.append(quiz)
+        if mode == 'flag':
+            kept.append(quiz)
+    if duplicates:
+        print(f"会话 {session_id} 新生成的 {len(quizzes)} 道题目中有 {len(duplicates)} 道与已有题目近似重复（{mode}）")
+    return kept, duplicates
@@ -0,0 +1,124 @@
+"""
+后台内容提取
+
+上传接口保存文件、写入一条 status=pending 的 Content 记录后立即返回，
+文本提取（解析、OCR、语音转写）在这里的线程池中执行，不再占用请求线程。
+处理过程中更新 Content.status / Content.stage，前端通过
+GET /api/content/<id>/status 轮询，或通过实时通道接收 content_status 事件。
+
+处理期间内容可能被删除：每次写入前在同一事务中先对该行执行一次更新，
+SQLite 由此取得写锁（其他数据库锁定该行），删除要等本事务提交；行已不存在时丢弃结果，
+不会为已删除的内容写入片段和全文索引。
+
+环境变量：
+    EXTRACTION_WORKERS=2   每个进程同时处理的文件数
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import db
+from app.models import Content
+from app.content_store import save_segments
+
+MAX_WORKERS = int(os.getenv('EXTRACTION_WORKERS', 2))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS),
+                                               thread_name_prefix='extraction')
+    return _executor
+
+
+def status_info(content):
+    """Content 的状态信息（状态接口和实时事件共用）"""
+    return {
+        'id': content.id,
+        'status': content.status,
+        'stage': content.stage,
+        'error': content.error
+    }
+
+
+class ContentDeleted(Exception):
+    """处理期间内容已被删除"""
+
+
+def _lock_row(content_id):
+    """在当前事务中锁定内容行，行已被删除时抛出 ContentDeleted"""
+    matched = db.session.execute(
+        db.update(Content).where(Content.id == content_id).values(status=Content.status),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    if not matched:
+        db.session.rollback()
+        raise ContentDeleted(content_id)
+
+
+def _update(content, **fields):
+    _lock_row(content.id)
+    for name, value in fields.items():
+        setattr(content, name, value)
+    db.session.commit()
+    # 延迟导入，避免与实时通道模块循环导入
+    from app import realtime
+    realtime.notify_content_status(content.session_id, status_info(content))
+
+
+def submit(app, content_id):
+    """提交一个提取任务"""
+    _get_executor().submit(_run, app, content_id)
+
+
+def _run(app, content_id):
+    with app.app_context():
+        try:
+            content = Content.query.get(content_id)
+            if content is None:
+                return
+            _update(content, status='processing', stage='parse')
+
+            from app.routes.content import get_file_processor
+            file_processor = get_file_processor()
+            if file_processor is None:
+                text = f"[文件上传成功，但文件处理器不可用 - 文件类型: {content.content_type}]"
+                segments = [{'text': text, 'source_kind': 'text', 'page_number': None}]
+            else:
+                segments = file_processor.extract_segments(
+                    content.file_path, content.content_type,
+                    progress=lambda stage: _update(content, stage=stage)
+                )
+            _lock_row(content.id)
+            save_segments(content, segments)
+            _update(content, status='ready', stage=None)
+        except ContentDeleted:
+            print(f"内容 {content_id} 在提取期间已被删除，丢弃提取结果")
+        except Exception as e:
+            db.session.rollback()
+            print(f"提取内容 {content_id} 失败: {e}")
+            try:
+                content = Content.query.get(content_id)
+                if content is not None:
+                    _update(content, status='failed', error=str(e))
+            except Exception:
+                db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+def mark_interrupted():
+    """服务启动时调用：上次退出时尚未完成的任务标记为失败，需要在应用上下文中调用"""
+    count = Content.query.filter(Content.status.in_(['pending', 'processing'])).update(
+        {'status': 'failed', 'stage': None, 'error': '服务重启，处理被中断，请重新上传'},
+        synchronize_session=False
+    )
+    db.session.commit()
+    if count:
+        print(f"{count} 个未完成的内容提取任务已标记为失败")
@@ -1,78 +1,97 @@
 import os
 import io
-from PIL import Image
-from pptx import Presentation
-import PyPDF2
-from docx import Document
 import tempfile
+from app.optional_deps import is_available, load
+from app.ocr_engine import get_ocr_engine
+from app.keyframes import OPENCV_AVAILABLE, extract_keyframes
+from app.pdf_ocr import pdf_page_ocr
+from app.transcriber import PYDUB_AVAILABLE, SAMPLE_RATE, get_recognizer, transcribe_segments, format_timestamp
 
-# 可选导入 - 如果依赖包不可用，功能会被禁用
-try:
-    import cv2
-    OPENCV_AVAILABLE = True
-except ImportError:
-    OPENCV_AVAILABLE = False
-    cv2 = None
+# 各类文件的解析库都在首次处理该类型文件时才导入（见 app/optional_deps.py），
+# 这里只探测是否安装，如果依赖包不可用，功能会被禁用
+MOVIEPY_AVAILABLE = is_available('moviepy')
 
-try:
-    import easyocr
-    EASYOCR_AVAILABLE = True
-except ImportError:
-    EASYOCR_AVAILABLE = False
-    easyocr = None
+# 文本文件按段落切分时每个片段的最大字符数
+TEXT_SEGMENT_CHARS = 2000
 
-try:
-    import speech_recognition as sr
-    SPEECH_RECOGNITION_AVAILABLE = True
-except ImportError:
-    SPEECH_RECOGNITION_AVAILABLE = False
-    sr = None
 
-try:
-    from moviepy.editor import VideoFileClip
-    MOVIEPY_AVAILABLE = True
-except ImportError:
-    MOVIEPY_AVAILABLE = False
-    VideoFileClip = None
+def make_segment(text, source_kind, page_number=None):
+    """
+    提取结果的一个片段
+    
+    Args:
+        source_kind: text（文字层/文本框）、ocr（图片/画面识别）、transcript（语音转写）
+        page_number: PDF页码或幻灯片序号（从1开始），音视频为None
+    """
+    return {'text': text, 'source_kind': source_kind, 'page_number': page_number}
+
+
+def join_segments(segments):
+    """把片段拼接为完整文本（片段之间以换行分隔，与 ContentSegment 的字符偏移一致）"""
+    return '\n'.join(segment['text'] for segment in segments)
+
+
+def split_text_segments(text, max_chars=TEXT_SEGMENT_CHARS):
+    """纯文本按段落（空行）合并为不超过 max_chars 的片段，超长段落直接切开"""
+    segments = []
+    current = []
+    current_len = 0
+    for paragraph in text.split('\n\n'):
+        while len(paragraph) > max_chars:
+            segments.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and current_len + 2 + len(paragraph) > max_chars:
+            segments.append('\n\n'.join(current))
+            current, current_len = [], 0
+        current.append(paragraph)
+        current_len += len(paragraph) + (2 if current_len else 0)
+    if current:
+        segments.append('\n\n'.join(current))
+    return [make_segment(segment, 'text') for segment in segments if segment.strip()]
 
-try:
-    from pydub import AudioSegment
-    PYDUB_AVAILABLE = True
-except ImportError:
-    PYDUB_AVAILABLE = False
-    AudioSegment = None
 
 class FileProcessor:
     def __init__(self):
-        self.ocr_reader = None
-        if EASYOCR_AVAILABLE:
-            try:
-                self.ocr_reader = easyocr.Reader(['ch_sim', 'en'])
-            except Exception as e:
-                print(f"警告：EasyOCR 初始化失败: {e}")
-                self.ocr_reader = None
+        # OCR引擎在进程内共享，首次识别图片时才加载模型
+        self.ocr = get_ocr_engine()
         
-    def process_file(self, file_path, content_type):
+    def process_file(self, file_path, content_type, progress=None, raise_errors=False):
         """
         根据文件类型处理文件并提取文本内容
+        
+        Args:
+            progress: 可选回调 progress(stage)，进入 ocr / transcribe 阶段时调用
+            raise_errors: 为True时出错直接抛出异常（后台任务需要记录失败原因），否则返回空字符串
         """
         try:
-            if content_type == 'text':
-                return self.extract_text_from_txt(file_path)
-            elif content_type == 'ppt':
-                return self.extract_text_from_ppt(file_path)
-            elif content_type == 'pdf':
-                return self.extract_text_from_pdf(file_path)
-            elif content_type == 'audio':
-                return self.extract_text_from_audio(file_path)
-            elif content_type == 'video':
-                return self.extract_text_from_video(file_path)
-            else:
-                raise ValueError(f"不支持的文件类型: {content_type}")
+            return join_segments(self.extract_segments(file_path, content_type, progress=progress))
         except Exception as e:
             print(f"处理文件时出错: {str(e)}")
+            if raise_errors:
+                raise
             return ""
     
+    def extract_segments(self, file_path, content_type, progress=None):
+        """
+        按页/幻灯片/音频片段提取结构化内容，出错时抛出异常
+        
+        Returns:
+            按顺序排列的片段列表，见 make_segment
+        """
+        if content_type == 'text':
+            return self._text_segments(file_path)
+        elif content_type == 'ppt':
+            return self._ppt_segments(file_path, progress)
+        elif content_type == 'pdf':
+            with open(file_path, 'rb') as file:
+                return self._pdf_segments(file.read(), progress)
+        elif content_type == 'audio':
+            return self._audio_segments(file_path, progress)
+        elif content_type == 'video':
+            return self._video_segments(file_path, progress)
+        else:
+            raise ValueError(f"不支持的文件类型: {content_type}")
+    
     def extract_text_from_txt(self, file_path):
         """从文本文件提取内容"""
         try:
@@ -83,167 +102,176 @@ class FileProcessor:
             with open(file_path, 'r', encoding='gbk') as file:
                 return file.read()
     
-    def extract_text_from_ppt(self, file_path):
+    def _text_segments(self, file_path):
+        """文本文件按段落合并为不超过 TEXT_SEGMENT_CHARS 的片段"""
+        return split_text_segments(self.extract_text_from_txt(file_path))
+    
+    def extract_text_from_ppt(self, file_path, progress=None):
         """从PowerPoint文件提取文本内容"""
-        text_content = []
-        presentation = Presentation(file_path)
+        return join_segments(self._ppt_segments(file_path, progress))
+    
+    def _ppt_segments(self, file_path, progress=None):
+        presentation = load('pptx').Presentation(file_path)
         
-        for slide in presentation.slides:
+        slides = []  # [(幻灯片序号, 文本, 图片字节列表)]
+        for slide_num, slide in enumerate(presentation.slides, start=1):
             # 提取文本框内容
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text_content.append(shape.text)
+            texts = [shape.text for shape in slide.shapes if hasattr(shape, "text")]
             
-            # 提取图片中的文字（OCR）
+            # 收集图片，稍后整个文档一起OCR
+            images = []
             for shape in slide.shapes:
                 if shape.shape_type == 13:  # Picture
                     try:
-                        image = shape.image
-                        image_bytes = image.blob
-                        pil_image = Image.open(io.BytesIO(image_bytes))
-                        
-                        # 使用OCR提取图片中的文字（如果可用）
-                        if self.ocr_reader is not None:
-                            ocr_result = self.ocr_reader.readtext(image_bytes)
-                            for detection in ocr_result:
-                                text_content.append(detection[1])
-                        else:
-                            text_content.append("[图片内容 - OCR不可用]")
+                        images.append(shape.image.blob)
                     except Exception as e:
-                        print(f"OCR处理图片时出错: {str(e)}")
+                        print(f"读取幻灯片图片时出错: {str(e)}")
                         continue
+            slides.append((slide_num, '\n'.join(texts), images))
+        
+        # 提取图片中的文字（OCR）
+        all_images = [blob for _, _, images in slides for blob in images]
+        ocr_results = []
+        if all_images:
+            if progress:
+                progress('ocr')
+            ocr_results = self.ocr.recognize_many(all_images)
+            if ocr_results is None:
+                ocr_results = [["[图片内容 - OCR不可用]"]] * len(all_images)
         
-        return '\n'.join(text_content)
+        segments = []
+        position = 0
+        for slide_num, text, images in slides:
+            if text.strip():
+                segments.append(make_segment(text, 'text', slide_num))
+            slide_ocr = [line for texts in ocr_results[position:position + len(images)] for line in texts]
+            position += len(images)
+            if slide_ocr:
+                segments.append(make_segment('\n'.join(slide_ocr), 'ocr', slide_num))
+        return segments
     
-    def extract_text_from_pdf(self, file_path):
+    def extract_text_from_pdf(self, file_path, progress=None):
         """从PDF文件提取文本内容"""
-        text_content = []
-        
         try:
             with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    if text.strip():
-                        text_content.append(text)
-                    
-                    # 如果文本提取失败，尝试OCR
-                    if not text.strip():
-                        try:
-                            # 这里需要将PDF页面转换为图片然后OCR
-                            # 暂时跳过，需要额外的库如pdf2image
-                            pass
-                        except Exception as e:
-                            print(f"OCR处理PDF页面时出错: {str(e)}")
-                            continue
+                return join_segments(self._pdf_segments(file.read(), progress))
         except Exception as e:
             print(f"读取PDF文件时出错: {str(e)}")
-        
-        return '\n'.join(text_content)
+            return ""
     
-    def extract_text_from_audio(self, file_path):
-        """从音频文件提取文本内容（语音识别）"""
-        if not SPEECH_RECOGNITION_AVAILABLE or not PYDUB_AVAILABLE:
-            return "[音频文字 - 语音识别库不可用]"
-            
-        recognizer = sr.Recognizer()
+    def _pdf_segments(self, pdf_bytes, progress=None):
+        """逐页提取文字层，没有文字层的页面（扫描页）统一光栅化后OCR，每页一个片段"""
+        pages = []
+        pdf_reader = load('PyPDF2').PdfReader(io.BytesIO(pdf_bytes))
+        print(f"PDF文件包含 {len(pdf_reader.pages)} 页")
         
+        for page_num in range(len(pdf_reader.pages)):
+            try:
+                text = pdf_reader.pages[page_num].extract_text() or ''
+            except Exception as e:
+                print(f"处理第{page_num+1}页时出错: {e}")
+                text = ''
+            pages.append(make_segment(text, 'text', page_num + 1))
+        
+        # 如果文本提取失败，尝试OCR
+        empty_pages = [i for i, page in enumerate(pages) if not page['text'].strip()]
+        if empty_pages:
+            if pdf_page_ocr.available:
+                if progress:
+                    progress('ocr')
+                print(f"{len(empty_pages)} 页没有文字层，进行OCR识别")
+                for page_num, text in pdf_page_ocr.ocr_pages(pdf_bytes, empty_pages).items():
+                    pages[page_num] = make_segment(text, 'ocr', page_num + 1)
+            else:
+                print("存在扫描页，但pypdfium2或OCR不可用，跳过这些页面")
+        
+        return [page for page in pages if page['text'].strip()]
+    
+    def extract_text_from_audio(self, file_path, progress=None):
+        """从音频文件提取文本内容（分段并行语音识别，见 app/transcriber.py）"""
         try:
-            # 将音频文件转换为wav格式
-            audio = AudioSegment.from_file(file_path)
-            
-            # 创建临时wav文件
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-                audio.export(temp_wav.name, format="wav")
-                
-                # 使用语音识别
-                with sr.AudioFile(temp_wav.name) as source:
-                    audio_data = recognizer.record(source)
-                    
-                # 尝试识别（中文和英文）
-                try:
-                    text = recognizer.recognize_google(audio_data, language='zh-CN')
-                except sr.UnknownValueError:
-                    try:
-                        text = recognizer.recognize_google(audio_data, language='en-US')
-                    except sr.UnknownValueError:
-                        text = ""
-                
-                # 清理临时文件
-                os.unlink(temp_wav.name)
-                
-                return text
-                
+            return join_segments(self._audio_segments(file_path, progress))
         except Exception as e:
             print(f"音频识别时出错: {str(e)}")
             return ""
     
-    def extract_text_from_video(self, file_path):
+    def _audio_segments(self, file_path, progress=None, prefix=''):
+        if not PYDUB_AVAILABLE:
+            return [make_segment(f"{prefix}[音频文字 - 语音识别库不可用]", 'transcript')]
+        if get_recognizer() is None:
+            return [make_segment(f"{prefix}[音频文字 - 没有可用的语音识别后端]", 'transcript')]
+        
+        if progress:
+            progress('transcribe')
+        return [make_segment(f"{prefix}[{format_timestamp(start)}] {text}", 'transcript')
+                for start, text in transcribe_segments(file_path)]
+    
+    def extract_text_from_video(self, file_path, progress=None):
         """从视频文件提取文本内容（音频转文字 + OCR画面文字）"""
-        if not MOVIEPY_AVAILABLE:
-            return "[视频文字 - MoviePy库不可用]"
+        return join_segments(self._video_segments(file_path, progress))
+    
+    def _video_segments(self, file_path, progress=None):
+        if not MOVIEPY_AVAILABLE and not OPENCV_AVAILABLE:
+            return [make_segment("[视频文字 - MoviePy/OpenCV库不可用]", 'text')]
             
-        text_content = []
+        segments = []
         
+        # 提取音频并转换为文字
+        if MOVIEPY_AVAILABLE:
+            try:
+                video = load('moviepy.editor').VideoFileClip(file_path)
+                if video.audio:
+                    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
+                        temp_path = temp_audio.name
+                    try:
+                        # 直接写出识别用的 16kHz 单声道PCM，转写时无需再次转码
+                        video.audio.write_audiofile(temp_path, fps=SAMPLE_RATE, nbytes=2,
+                                                    ffmpeg_params=['-ac', '1'], logger=None)
+                        segments.extend(self._audio_segments(temp_path, progress, prefix='音频内容: '))
+                    finally:
+                        os.unlink(temp_path)
+                video.close()
+            except Exception as e:
+                print(f"处理视频音频时出错: {str(e)}")
+        
+        # 提取关键帧并OCR识别文字
+        if progress:
+            progress('ocr')
         try:
-            # 加载视频
-            video = VideoFileClip(file_path)
+            keyframes = self._extract_video_frames(file_path)
+            # 帧直接以数组交给OCR引擎，不再编码为PNG
+            ocr_results = self.ocr.recognize_many([frame for _, frame in keyframes], min_confidence=0.5)  # 置信度阈值
+            if ocr_results is None:
+                ocr_results = [["[视频帧文字 - OCR不可用]"]] * len(keyframes)
             
-            # 提取音频并转换为文字
-            if video.audio:
-                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-                    video.audio.write_audiofile(temp_audio.name)
-                    audio_text = self.extract_text_from_audio(temp_audio.name)
-                    if audio_text:
-                        text_content.append(f"音频内容: {audio_text}")
-                    os.unlink(temp_audio.name)
-            
-            # 提取关键帧并OCR识别文字
+            for (timestamp, _), frame_text in zip(keyframes, ocr_results):
+                if frame_text:
+                    segments.append(make_segment(f"画面文字 ({timestamp:.1f}s): {' '.join(frame_text)}", 'ocr'))
+        except Exception as e:
+            print(f"处理视频画面时出错: {str(e)}")
+        
+        return segments
+    
+    def _extract_video_frames(self, file_path):
+        """返回 [(时间戳, RGB帧)]：有OpenCV时按画面变化取关键帧，否则均匀取最多10帧"""
+        if OPENCV_AVAILABLE:
+            keyframes = extract_keyframes(file_path)
+            print(f"视频共检测到 {len(keyframes)} 个关键帧")
+            return keyframes
+        
+        video = load('moviepy.editor').VideoFileClip(file_path)
+        try:
             duration = video.duration
             num_frames = min(10, int(duration))  # 最多提取10帧
-            
-            for i in range(num_frames):
-                timestamp = (duration / num_frames) * i
-                frame = video.get_frame(timestamp)
-                
-                # 将帧转换为PIL图像
-                pil_image = Image.fromarray(frame)
-                
-                # 将PIL图像转换为字节
-                img_byte_arr = io.BytesIO()
-                pil_image.save(img_byte_arr, format='PNG')
-                img_byte_arr = img_byte_arr.getvalue()
-                
-                # OCR识别（如果可用）
-                try:
-                    if self.ocr_reader is not None:
-                        ocr_result = self.ocr_reader.readtext(img_byte_arr)
-                        frame_text = []
-                        for detection in ocr_result:
-                            if detection[2] > 0.5:  # 置信度阈值
-                                frame_text.append(detection[1])
-                    else:
-                        frame_text = ["[视频帧文字 - OCR不可用]"]
-                    
-                    if frame_text:
-                        text_content.append(f"画面文字 ({timestamp:.1f}s): {' '.join(frame_text)}")
-                except Exception as e:
-                    print(f"OCR处理视频帧时出错: {str(e)}")
-                    continue
-            
+            timestamps = [(duration / num_frames) * i for i in range(num_frames)]
+            return [(timestamp, video.get_frame(timestamp)) for timestamp in timestamps]
+        finally:
             video.close()
-            
-        except Exception as e:
-            print(f"处理视频文件时出错: {str(e)}")
-        
-        return '\n'.join(text_content)
     
     def extract_text_from_docx(self, file_path):
         """从Word文档提取文本内容"""
         try:
-            doc = Document(file_path)
+            doc = load('docx').Document(file_path)
             text_content = []
             
             for paragraph in doc.paragraphs:
@@ -257,27 +285,8 @@ class FileProcessor:
     
     def extract_text_from_pdf_bytes(self, pdf_bytes):
         """从PDF字节流提取文本内容"""
-        text_content = []
-        
         try:
-            pdf_file = io.BytesIO(pdf_bytes)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            print(f"PDF文件包含 {len(pdf_reader.pages)} 页")
-            
-            for page_num in range(len(pdf_reader.pages)):
-                try:
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    if text.strip():
-                        text_content.append(text)
-                        print(f"第{page_num+1}页提取到 {len(text)} 字符")
-                    else:
-                        print(f"第{page_num+1}页未能提取到文本")
-                except Exception as e:
-                    print(f"处理第{page_num+1}页时出错: {e}")
-                    continue
-                    
+            text_content = [segment['text'] for segment in self._pdf_segments(pdf_bytes)]
         except Exception as e:
             print(f"从PDF字节流读取文本时出错: {str(e)}")
             return f"PDF文件处理失败: {str(e)}"
@@ -314,7 +323,7 @@ class FileProcessor:
             if header[:2] == b'PK':
                 # 这是 .pptx 文件 (ZIP格式)
                 try:
-                    presentation = Presentation(ppt_file)
+                    presentation = load('pptx').Presentation(ppt_file)
                     slide_count = len(presentation.slides)
                     print(f"PPTX文件包含 {slide_count} 张幻灯片")
                     
@@ -0,0 +1,113 @@
+"""
+邀请码池
+
+原来的做法是随机生成6位数字后逐个查询数据库判断是否重复，邀请码用得越多
+重试次数越多；听众通过邀请码加入时也要每次查询会话表。这里改为：
+
+- 预先生成一批打乱顺序的空闲邀请码，创建会话时直接取用，用完时再补充；
+  补充前重新从数据库读取仍被会话占用的邀请码，已删除会话的邀请码随之回到可用范围，
+  其他worker进程新用掉的邀请码也不会再被取到。会话停用后仍保留自己的邀请码
+  （可以重新激活），不会被回收
+- 进程内维护 邀请码 -> 会话ID 的映射，加入会话时直接查表，
+  未命中（如其他worker进程新建的会话）再回退到数据库查询
+
+多进程部署时各worker的空闲池可能取到同一个邀请码，由数据库唯一约束兜底，
+调用方遇到 IntegrityError 时重新取码即可。
+"""
+import os
+import random
+import threading
+from array import array
+
+from app import db
+from app.models import Session
+
+CODE_SPACE = 10 ** 6
+DEFAULT_POOL_SIZE = 4096
+
+
+def format_code(value):
+    return f'{value:06d}'
+
+
+class InviteCodePool:
+    """空闲邀请码池及邀请码索引（线程安全）"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._free = array('I')  # 打乱顺序的空闲邀请码，从末尾取
+        self._code_to_session = {}  # '123456' -> session_id
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _load_used():
+        """从数据库读取仍被会话占用的邀请码"""
+        rows = db.session.query(Session.invite_code, Session.id).all()
+        return {code: session_id for code, session_id in rows}
+
+    def _ensure_loaded(self):
+        """首次使用时从数据库加载已使用的邀请码"""
+        if self._loaded:
+            return
+        used = self._load_used()
+        with self._lock:
+            if self._loaded:
+                return
+            self._code_to_session = used
+            self._loaded = True
+
+    def _refill(self):
+        """按当前已使用的邀请码补充空闲池（调用方持有锁）"""
+        used = self._code_to_session
+        if len(used) >= CODE_SPACE:
+            raise RuntimeError('邀请码已全部用完')
+        wanted = min(self.pool_size, CODE_SPACE - len(used))
+        pending = set(self._free)
+        # 随机抽样后剔除已使用的邀请码；空间快满时逐步放大抽样数量
+        sample_size = wanted
+        while True:
+            candidates = [
+                value for value in random.sample(range(CODE_SPACE), min(sample_size, CODE_SPACE))
+                if value not in pending and format_code(value) not in used
+            ]
+            if len(candidates) >= wanted or sample_size >= CODE_SPACE:
+                break
+            sample_size *= 2
+        self._free.extend(candidates[:wanted])
+
+    def acquire(self):
+        """取一个空闲邀请码"""
+        self._ensure_loaded()
+        while True:
+            with self._lock:
+                while self._free:
+                    code = format_code(self._free.pop())
+                    # 其他进程创建的会话可能已经用掉了这个码
+                    if code not in self._code_to_session:
+                        return code
+            # 空闲池已用完：重新读取已使用的邀请码后补充（不持锁查询数据库）
+            used = self._load_used()
+            with self._lock:
+                if not self._free:
+                    self._code_to_session = used
+                    self._refill()
+
+    def register(self, code, session_id):
+        """会话创建成功后登记邀请码"""
+        with self._lock:
+            self._code_to_session[code] = session_id
+
+    def lookup(self, code):
+        """按邀请码查找会话ID，不存在时返回None"""
+        self._ensure_loaded()
+        session_id = self._code_to_session.get(code)
+        if session_id is not None:
+            return session_id
+        session_id = db.session.query(Session.id).filter_by(invite_code=code).scalar()
+        if session_id is not None:
+            self.register(code, session_id)
+        return session_id
+
+
+invite_code_pool = InviteCodePool(pool_size=int(os.getenv('INVITE_CODE_POOL_SIZE', DEFAULT_POOL_SIZE)))
@@ -0,0 +1,101 @@
+"""
+视频关键帧提取
+
+讲座视频的画面大部分时间是静止的幻灯片，只有翻页时才变化。这里用OpenCV
+顺序解码一遍视频，按固定间隔取样并缩成很小的灰度图做帧差：
+
+- 与上一关键帧差异超过阈值，说明幻灯片/场景发生了变化
+- 再等画面稳定（与上一个取样几乎相同）后才取该帧，避免截到翻页动画的中间帧
+
+只有被选中的关键帧才会保留原始分辨率并交给OCR，后续OCR的开销
+与翻页次数成正比，而不是与视频时长成正比。
+
+环境变量：
+    KEYFRAME_SAMPLE_INTERVAL=0.5   取样间隔（秒）
+    KEYFRAME_CHANGE_THRESHOLD=12   判定为新画面的平均像素差（0-255）
+    KEYFRAME_MAX_FRAMES=300        单个视频最多提取的关键帧数
+"""
+import os
+
+from app.optional_deps import is_available, load
+
+# 可选依赖 - 未安装opencv时由调用方回退为均匀取帧；首次提取关键帧时才导入
+OPENCV_AVAILABLE = is_available('cv2')
+
+SAMPLE_INTERVAL = float(os.getenv('KEYFRAME_SAMPLE_INTERVAL', 0.5))
+CHANGE_THRESHOLD = float(os.getenv('KEYFRAME_CHANGE_THRESHOLD', 12))
+MAX_KEYFRAMES = int(os.getenv('KEYFRAME_MAX_FRAMES', 300))
+# 帧差使用的缩略图尺寸
+THUMB_SIZE = (64, 36)
+# 相邻取样的差异低于该值视为画面已稳定
+STABLE_THRESHOLD = CHANGE_THRESHOLD / 3
+
+
+def _thumbnail(frame):
+    cv2, np = load('cv2'), load('numpy')
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def _difference(a, b):
+    np = load('numpy')
+    return float(np.mean(np.abs(a - b)))
+
+
+def extract_keyframes(file_path, sample_interval=SAMPLE_INTERVAL,
+                      change_threshold=CHANGE_THRESHOLD, max_frames=MAX_KEYFRAMES):
+    """
+    单次顺序解码视频，返回画面发生变化后的稳定帧
+
+    Returns:
+        [(时间戳秒, RGB数组), ...]
+    """
+    if not OPENCV_AVAILABLE:
+        raise RuntimeError("未安装opencv-python，无法提取关键帧")
+    cv2 = load('cv2')
+
+    capture = cv2.VideoCapture(file_path)
+    if not capture.isOpened():
+        raise RuntimeError(f"无法打开视频文件: {file_path}")
+
+    keyframes = []
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, int(round(fps * sample_interval)))
+        last_key_thumb = None
+        previous_thumb = None
+        pending_change = False
+        last_sample = None
+        frame_index = -1
+
+        while len(keyframes) < max_frames:
+            # grab 只解码不转换，取样帧才 retrieve
+            if not capture.grab():
+                break
+            frame_index += 1
+            if frame_index % step:
+                continue
+            ok, frame = capture.retrieve()
+            if not ok:
+                break
+
+            thumb = _thumbnail(frame)
+            if last_key_thumb is None or _difference(thumb, last_key_thumb) > change_threshold:
+                pending_change = True
+            if pending_change and (previous_thumb is None or
+                                   _difference(thumb, previous_thumb) <= STABLE_THRESHOLD):
+                timestamp = frame_index / fps
+                keyframes.append((timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+                last_key_thumb = thumb
+                pending_change = False
+            previous_thumb = thumb
+            last_sample = (frame_index / fps, frame)
+
+        # 视频在画面稳定前结束时，保留最后一个取样
+        if pending_change and len(keyframes) < max_frames:
+            timestamp, frame = last_sample
+            keyframes.append((timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+    finally:
+        capture.release()
+
+    return keyframes
@@ -0,0 +1,126 @@
+"""
+实时选项分布（直方图）
+
+答题进行中，演讲者希望实时看到 A/B/C/D 的分布变化。这里为每道题维护一个
+计数直方图，每个答案只做一次 O(1) 的计数累加，不再重新查询整道题的全部答案；
+广播由后台线程按最大频率合并发送：同一时间窗口内无论到达多少答案，
+每道题最多只广播一次。
+
+未答题（跳过/超时，答案为 'X'）也单独计数：广播的 total_responses 与
+/api/quiz/session/<id>/published 一样包含未答题的记录，两处的百分比使用同一个分母。
+
+计数存放在共享状态后端（app/backend.py）中，多个worker进程看到的是同一份数据。
+每道题第一次收到答案时从数据库初始化：只统计ID不大于该答案的记录，之后的答案各自累加，
+ID更小的答案已包含在初始值中，不再重复累加。计数在 LIVE_STATS_TTL 秒无人答题后过期。
+
+环境变量：
+    LIVE_STATS_MAX_RATE=2       每道题每秒最多广播的次数
+    LIVE_STATS_TTL=21600        计数的保留时间（秒）
+"""
+import os
+import time
+import threading
+
+from app import db
+from app.backend import get_backend
+from app.models import QuizResponse
+
+OPTIONS = ('A', 'B', 'C', 'D')
+# 计数的答案：四个选项和未答题
+COUNTED = OPTIONS + ('X',)
+# 每道题每秒最多广播的次数
+DEFAULT_MAX_RATE = float(os.getenv('LIVE_STATS_MAX_RATE', 2))
+# 计数的保留时间，每次写入时刷新
+HISTOGRAM_TTL = float(os.getenv('LIVE_STATS_TTL', 6 * 3600))
+
+
+class LiveHistogram:
+    """每道题的选项计数"""
+
+    def _key(self, quiz_id):
+        return f'live_hist:{quiz_id}'
+
+    def _seed_key(self, quiz_id):
+        return f'live_hist_seed:{quiz_id}'
+
+    def record(self, quiz_id, answer, response_id):
+        """记录一个已提交（已写入数据库）的答案，response_id 为该答案的 QuizResponse.id"""
+        backend = get_backend()
+        key, seed_key = self._key(quiz_id), self._seed_key(quiz_id)
+        # 第一次出现的题目从数据库初始化一次：统计到本次答案为止（包含本次答案）
+        if backend.add(seed_key, response_id, ttl=HISTOGRAM_TTL):
+            self._seed(backend, key, quiz_id, response_id)
+        else:
+            seeded_upto = backend.get(seed_key)
+            # 初始化时已统计过的答案不再累加
+            if answer in COUNTED and (seeded_upto is None or response_id > seeded_upto):
+                backend.hincrby(key, answer, 1)
+            backend.expire(seed_key, HISTOGRAM_TTL)
+        backend.expire(key, HISTOGRAM_TTL)
+
+    def counts(self, quiz_id):
+        """返回 {'A': n, 'B': n, 'C': n, 'D': n, 'X': 未答题数}"""
+        table = get_backend().hgetall(self._key(quiz_id))
+        return {answer: int(table.get(answer, 0)) for answer in COUNTED}
+
+    def reset(self, quiz_id):
+        get_backend().delete(self._key(quiz_id))
+        get_backend().delete(self._seed_key(quiz_id))
+
+    def _seed(self, backend, key, quiz_id, upto_id):
+        rows = db.session.query(
+            QuizResponse.answer, db.func.count(QuizResponse.id)
+        ).filter(QuizResponse.quiz_id == quiz_id, QuizResponse.id <= upto_id).group_by(QuizResponse.answer).all()
+        for answer, count in rows:
+            if answer in COUNTED and count:
+                backend.hincrby(key, answer, count)
+
+
+class HistogramBroadcaster:
+    """
+    合并广播：答案到达时只把题目标记为“有变化”，后台线程每隔 1/max_rate 秒
+    取走所有有变化的题目，读取计数并广播一次
+    """
+
+    def __init__(self, histogram, publish, max_rate=DEFAULT_MAX_RATE):
+        self.histogram = histogram
+        self.publish = publish  # publish(session_id, event)
+        self.interval = 1.0 / max_rate if max_rate > 0 else 1.0
+        self._dirty = {}  # quiz_id -> session_id
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def mark(self, session_id, quiz_id):
+        with self._lock:
+            self._dirty[quiz_id] = session_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-histogram', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                batch, self._dirty = self._dirty, {}
+            for quiz_id, session_id in batch.items():
+                try:
+                    self._flush(session_id, quiz_id)
+                except Exception as e:
+                    print(f"警告：广播题目 {quiz_id} 的实时统计失败: {e}")
+
+    def _flush(self, session_id, quiz_id):
+        # 多进程时用共享的时间闸门保证每道题全局仍然不超过 max_rate
+        if not get_backend().add(f'live_hist_gate:{quiz_id}', 1, ttl=self.interval):
+            with self._lock:
+                self._dirty.setdefault(quiz_id, session_id)
+            return
+        counts = self.histogram.counts(quiz_id)
+        self.publish(session_id, {
+            'type': 'stats',
+            'quiz_id': quiz_id,
+            'option_distribution': {option: counts[option] for option in OPTIONS},
+            'total_responses': sum(counts.values())  # 包含未答题，与 /published 一致
+        })
+
+
+live_histogram = LiveHistogram()
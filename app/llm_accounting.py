@@ -0,0 +1,169 @@
+"""
+大模型调用的用量记录与会话配额
+
+每次出题调用（包括补发请求）写入一条 LLMCallRecord：会话、用户、用途、提供方、模型、输入/输出token数、
+耗时（包括重试）、重试次数和结果。记录用独立的事务写入，请求本身回滚时记录仍然保留。
+多个请求合并的调用（见 app/quiz_batcher.py）为每个请求各写一条记录，token数按 BatchContext 中的比例分摊，
+batch_size 为合并的请求数。
+
+调用发出之前按会话检查token配额：会话已用的token数加上本次调用的上限（输入 + 最大输出）
+超过配额时抛出 TokenQuotaExceeded，不会发出请求。配额优先取 Session.llm_token_quota，
+为空时取 LLM_SESSION_TOKEN_QUOTA，0 表示不限制。多个调用同时通过检查时可能略微超出配额。
+
+环境变量：
+    LLM_SESSION_TOKEN_QUOTA=0    每个会话默认的token配额
+"""
+import os
+
+from sqlalchemy import case, func
+
+from app import db
+from app.models import LLMCallRecord, Session as PQSession
+
+ERROR_MAX_CHARS = 500
+
+
+class CallContext:
+    """调用的来源：用途（generate / upload / pregenerate）、会话和发起的用户"""
+
+    def __init__(self, purpose, session_id=None, user_id=None):
+        self.purpose = purpose
+        self.session_id = int(session_id) if session_id is not None else None  # 表单提交的会话ID是字符串
+        self.user_id = user_id
+
+
+class BatchContext:
+    """合并调用的各个来源，weights 为各来源分摊token的权重"""
+
+    def __init__(self, contexts, weights):
+        total = sum(weights) or 1
+        self.members = [(context or CallContext('generate'), weight / total)
+                        for context, weight in zip(contexts, weights)]
+
+
+class TokenQuotaExceeded(Exception):
+    """会话的token配额不足以发出本次调用"""
+
+    status = 429
+
+    def __init__(self, session_id, used, quota):
+        self.session_id = session_id
+        self.used = used
+        self.quota = quota
+        super().__init__(f"会话的AI出题token配额已用完（已用 {used:,} / 配额 {quota:,}）")
+
+
+def default_quota():
+    return int(os.getenv('LLM_SESSION_TOKEN_QUOTA', 0))
+
+
+def session_quota(session_id):
+    """会话的token配额，0 表示不限制"""
+    quota = db.session.query(PQSession.llm_token_quota).filter(PQSession.id == session_id).scalar()
+    return default_quota() if quota is None else quota
+
+
+def session_usage(session_id, purpose=None):
+    """会话已消耗的token数（可只统计某种用途）"""
+    query = db.session.query(func.coalesce(func.sum(LLMCallRecord.total_tokens), 0)).filter(
+        LLMCallRecord.session_id == session_id)
+    if purpose:
+        query = query.filter(LLMCallRecord.purpose == purpose)
+    return query.scalar()
+
+
+def check_quota(context, tokens):
+    """
+    发出调用前检查会话配额
+
+    Raises:
+        TokenQuotaExceeded: 已用token数加上本次调用的上限超过配额
+    """
+    if context is None or context.session_id is None:
+        return
+    quota = session_quota(context.session_id)
+    if not quota:
+        return
+    used = session_usage(context.session_id)
+    if used + tokens > quota:
+        raise TokenQuotaExceeded(context.session_id, used, quota)
+
+
+def record_call(context, model, latency, outcome, permit=None, followup=False, error=None):
+    """写入调用记录（合并调用每个来源一条；失败时只打印警告，不影响出题）"""
+    if isinstance(context, BatchContext):
+        members = context.members
+    else:
+        members = [(context or CallContext('generate'), 1.0)]
+    shared = {
+        'followup': followup,
+        'provider': getattr(permit, 'provider', None),
+        'model': getattr(permit, 'model', None) or model,
+        'latency': round(latency, 3),
+        'retries': getattr(permit, 'retries', 0),
+        'outcome': outcome,
+        'error': str(error)[:ERROR_MAX_CHARS] if error else None,
+        'batch_size': len(members)
+    }
+    rows = [
+        {
+            **shared,
+            'session_id': member.session_id,
+            'user_id': member.user_id,
+            'purpose': member.purpose,
+            'prompt_tokens': _share(getattr(permit, 'prompt_tokens', None), share),
+            'completion_tokens': _share(getattr(permit, 'completion_tokens', None), share),
+            'total_tokens': _share(getattr(permit, 'actual_tokens', None), share) or 0
+        }
+        for member, share in members
+    ]
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(LLMCallRecord.__table__.insert(), rows)
+    except Exception as e:
+        print(f"警告：记录大模型调用失败: {e}")
+
+
+def _share(tokens, share):
+    return round(tokens * share) if tokens is not None else None
+
+
+def aggregate(filters, group_by=None):
+    """
+    按条件汇总调用记录
+
+    Returns:
+        不分组时为一个字典；分组时为 {分组值: 字典}
+    """
+    columns = [
+        func.count(LLMCallRecord.id),
+        func.sum(case((LLMCallRecord.outcome == 'success', 1), else_=0)),
+        func.sum(LLMCallRecord.prompt_tokens),
+        func.sum(LLMCallRecord.completion_tokens),
+        func.sum(LLMCallRecord.total_tokens),
+        func.avg(LLMCallRecord.latency),
+        func.max(LLMCallRecord.latency),
+        func.sum(LLMCallRecord.retries),
+    ]
+    query = db.session.query(*([group_by] if group_by is not None else []), *columns).filter(*filters)
+    if group_by is None:
+        return _summary_row(query.one())
+    return {row[0]: _summary_row(row[1:]) for row in query.group_by(group_by)}
+
+
+def empty_summary():
+    return _summary_row((0, 0, 0, 0, 0, None, None, 0))
+
+
+def _summary_row(row):
+    calls, successes, prompt, completion, total, avg_latency, max_latency, retries = row
+    return {
+        'calls': calls or 0,
+        'successes': successes or 0,
+        'prompt_tokens': prompt or 0,
+        'completion_tokens': completion or 0,
+        'total_tokens': total or 0,
+        'avg_latency': round(avg_latency, 2) if avg_latency is not None else None,
+        'max_latency': round(max_latency, 2) if max_latency is not None else None,
+        'retries': retries or 0
+    }
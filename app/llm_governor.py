@@ -0,0 +1,233 @@
+"""
+大模型调用的限流与并发控制
+
+所有出题请求共用一个 QuizGenerator，但多个线程、多个worker进程仍会同时调用 Qwen。
+会议开场时大家同时出题，很容易触发服务商的限流，导致所有人的生成一起失败。
+这里在调用前统一排队：
+
+- 每分钟请求数（RPM）和每分钟token数（TPM）两个令牌桶，调用前按估算的token数扣减，
+  调用完成后按实际用量退回多扣的部分；同一许可下的重试、切换提供方和对冲请求
+  每次都再扣一个请求令牌和同样的token数，避免重试把实际请求速率放大到限额之外
+- 同时进行中的调用数上限（租约实现，进程崩溃时租约到期自动释放）
+- 状态保存在共享状态后端（app/backend.py），STATE_BACKEND=redis 时对所有worker进程生效
+
+排队等待超过 LLM_MAX_WAIT 秒的调用不再等待，直接抛出 RateLimitExceeded，
+其中带有预计还需等待的秒数，接口据此返回 429 和 Retry-After。
+
+环境变量：
+    LLM_RPM=60               每分钟最多请求数
+    LLM_TPM=300000           每分钟最多token数
+    LLM_MAX_IN_FLIGHT=4      同时进行中的调用数
+    LLM_MAX_WAIT=20          最长排队秒数
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app.backend import get_backend
+
+RPM_KEY = 'llm:bucket:requests'
+TPM_KEY = 'llm:bucket:tokens'
+LEASE_KEY = 'llm:in_flight'
+WAITING_KEY = 'llm:waiting'
+
+# 租约有效期需长于最长的单次调用（quiz_generator 的超时上限为300秒）
+LEASE_TTL = 330
+SLOT_POLL_INTERVAL = 0.25
+# 没有历史数据时假定的单次调用耗时
+DEFAULT_CALL_SECONDS = 30.0
+DURATION_SMOOTHING = 0.2
+
+
+class RateLimitExceeded(Exception):
+    """排队时间超过上限，retry_after 为预计还需等待的秒数"""
+
+    status = 429
+
+    def __init__(self, retry_after, reason):
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.reason = reason
+        super().__init__(f"{reason}，预计 {self.retry_after} 秒后可用")
+
+
+class LLMPermit:
+    """一次已获准的调用，调用方可以回报实际token用量和重试次数"""
+
+    def __init__(self, tokens, waited):
+        self.tokens = tokens
+        self.waited = waited
+        self.actual_tokens = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.retries = 0
+        self.attempts = 0  # 已扣过令牌的请求次数（见 LLMGovernor.charge_attempt）
+        self.provider = None  # 实际响应的提供方和模型（见 app/llm_providers.py）
+        self.model = None
+
+    def record_usage(self, total_tokens, prompt_tokens=None, completion_tokens=None):
+        self.actual_tokens = total_tokens
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMGovernor:
+    """跨线程/进程的大模型调用限流器"""
+
+    def __init__(self, rpm=None, tpm=None, max_in_flight=None, max_wait=None):
+        self.rpm = rpm or int(os.getenv('LLM_RPM', 60))
+        self.tpm = tpm or int(os.getenv('LLM_TPM', 300000))
+        self.max_in_flight = max_in_flight or int(os.getenv('LLM_MAX_IN_FLIGHT', 4))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('LLM_MAX_WAIT', 20))
+        self._avg_call_seconds = DEFAULT_CALL_SECONDS
+        self._lock = threading.Lock()
+
+    def _bucket_wait(self, tokens, consume):
+        """从两个令牌桶取令牌，返回还需等待的秒数（0 表示已取出）"""
+        backend = get_backend()
+        wait = backend.take_tokens(RPM_KEY, self.rpm, self.rpm / 60.0, 1, consume)
+        if wait > 0:
+            return wait
+        token_wait = backend.take_tokens(TPM_KEY, self.tpm, self.tpm / 60.0, tokens, consume)
+        if token_wait > 0 and consume:
+            backend.take_tokens(RPM_KEY, self.rpm, self.rpm / 60.0, -1)  # 退回请求令牌
+        return token_wait
+
+    def _slot_wait(self):
+        """估算排到空闲调用位置的秒数"""
+        waiting = max(0, get_backend().get(WAITING_KEY) or 0)
+        return self._avg_call_seconds * (1 + waiting // self.max_in_flight)
+
+    def estimate_wait(self, tokens):
+        """按当前状态估算一次调用需要排队的秒数（不扣减令牌）"""
+        tokens = min(tokens, self.tpm)
+        wait = self._bucket_wait(tokens, consume=False)
+        if get_backend().lease_count(LEASE_KEY) >= self.max_in_flight:
+            wait = max(wait, self._slot_wait())
+        return wait
+
+    def status(self, tokens):
+        backend = get_backend()
+        return {
+            'in_flight': backend.lease_count(LEASE_KEY),
+            'max_in_flight': self.max_in_flight,
+            'waiting': max(0, backend.get(WAITING_KEY) or 0),
+            'rpm': self.rpm,
+            'tpm': self.tpm,
+            'estimated_wait': round(self.estimate_wait(tokens), 1)
+        }
+
+    def _refund(self, tokens):
+        backend = get_backend()
+        backend.take_tokens(RPM_KEY, self.rpm, self.rpm / 60.0, -1)
+        backend.take_tokens(TPM_KEY, self.tpm, self.tpm / 60.0, -tokens)
+
+    def charge_attempt(self, permit, deadline):
+        """
+        同一许可下每发出一次请求前调用：第一次请求已在 acquire 时扣过令牌，
+        之后的每次（重试、切换提供方）再扣一个请求令牌和 permit.tokens 个token，令牌不足时最多等到 deadline
+
+        Raises:
+            RateLimitExceeded: 到 deadline 时令牌仍不足
+        """
+        if permit is None:
+            return
+        permit.attempts += 1
+        if permit.attempts == 1:
+            return
+        while True:
+            wait = self._bucket_wait(permit.tokens, consume=True)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                permit.attempts -= 1
+                raise RateLimitExceeded(wait, 'AI服务请求过于频繁')
+            time.sleep(wait)
+
+    def refund_attempt(self, permit):
+        """charge_attempt 之后请求没有发出（如熔断）时退回令牌"""
+        if permit is None or permit.attempts == 0:
+            return
+        permit.attempts -= 1
+        if permit.attempts >= 1:
+            self._refund(permit.tokens)
+
+    def try_extra_slot(self, permit=None):
+        """
+        不排队地占用一个调用位置（对冲请求使用），同时按 permit 扣减令牌；
+        没有空闲位置或令牌不足时返回None
+        """
+        if permit is not None and self._bucket_wait(permit.tokens, consume=True) > 0:
+            return None
+        lease_id = get_backend().acquire_lease(LEASE_KEY, self.max_in_flight, LEASE_TTL)
+        if lease_id is None and permit is not None:
+            self._refund(permit.tokens)
+        return lease_id
+
+    def release_extra_slot(self, lease_id):
+        get_backend().release_lease(LEASE_KEY, lease_id)
+
+    @contextmanager
+    def acquire(self, tokens):
+        """
+        排队获取一次调用许可
+
+        Args:
+            tokens: 估算的本次调用token数（输入+输出上限）
+
+        Raises:
+            RateLimitExceeded: 预计或实际排队时间超过 max_wait
+        """
+        backend = get_backend()
+        tokens = min(int(tokens), self.tpm)  # 超过桶容量的请求等桶满后独占
+        start = time.monotonic()
+        deadline = start + self.max_wait
+
+        while True:
+            wait = self._bucket_wait(tokens, consume=True)
+            if wait <= 0:
+                break
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(wait, 'AI服务请求过于频繁')
+            time.sleep(wait)
+
+        backend.incr(WAITING_KEY, 1, ttl=LEASE_TTL)
+        try:
+            while True:
+                lease_id = backend.acquire_lease(LEASE_KEY, self.max_in_flight, LEASE_TTL)
+                if lease_id:
+                    break
+                if time.monotonic() + SLOT_POLL_INTERVAL > deadline:
+                    # 没能开始调用：退回已扣的令牌
+                    self._refund(tokens)
+                    raise RateLimitExceeded(self._slot_wait(), 'AI服务繁忙，排队人数过多')
+                time.sleep(SLOT_POLL_INTERVAL)
+        finally:
+            backend.incr(WAITING_KEY, -1, ttl=LEASE_TTL)
+
+        permit = LLMPermit(tokens, time.monotonic() - start)
+        call_start = time.monotonic()
+        try:
+            yield permit
+        finally:
+            backend.release_lease(LEASE_KEY, lease_id)
+            elapsed = time.monotonic() - call_start
+            with self._lock:
+                self._avg_call_seconds += DURATION_SMOOTHING * (elapsed - self._avg_call_seconds)
+            if permit.actual_tokens is not None and permit.actual_tokens < tokens:
+                backend.take_tokens(TPM_KEY, self.tpm, self.tpm / 60.0, permit.actual_tokens - tokens)
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_llm_governor():
+    """获取进程内的限流器实例（限流状态本身在共享状态后端中）"""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = LLMGovernor()
+    return _governor
@@ -0,0 +1,402 @@
+"""
+AI服务提供方注册表与故障切换
+
+出题原来只能调用 DashScope 上的 Qwen：未配置 QWEN_API_KEY 时生成器直接初始化失败，
+Qwen 服务降级时所有出题一起失败。这里把"发出一次补全请求"抽象为提供方：
+
+- openai：任何 OpenAI 兼容的接口（DashScope、其他云服务，或本地的 vLLM/Ollama 等替身服务）
+- template：基于模板的模拟出题（app/quiz_generator_mock.py），不调用网络，质量有限，只作最后的兜底
+
+每次调用按权重随机选择一个健康的提供方，失败（重试用尽、熔断打开、超过该提供方的 max_latency）
+时在剩余的时间预算内依次切换到下一个：健康的按权重随机排序，之后是降级的，最后是权重为0的
+备用提供方。每个提供方有独立的重试/熔断（app/llm_resilience.py）和健康统计：成功率与耗时的
+指数滑动平均，成功率低于 MIN_SUCCESS_RATE 或平均耗时超过 max_latency 视为降级。
+
+配置为 JSON 文件（LLM_PROVIDERS_CONFIG），修改后按文件修改时间自动重新加载；文件不存在时按环境变量生成：
+QWEN_API_KEY 配置 DashScope，LOCAL_LLM_BASE_URL 配置本地替身服务（权重0，仅故障时使用），
+LLM_TEMPLATE_FALLBACK=1 启用模板兜底。格式：
+
+    {
+        "providers": [
+            {"name": "qwen", "type": "openai", "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+             "api_key_env": "QWEN_API_KEY", "weight": 3, "max_latency": 120},
+            {"name": "backup", "type": "openai", "base_url": "https://api.example.com/v1",
+             "api_key_env": "BACKUP_API_KEY", "weight": 1, "models": {"qwen-plus": "some-model"}},
+            {"name": "local", "type": "openai", "base_url": "http://localhost:8000/v1",
+             "default_model": "qwen2.5-7b-instruct", "weight": 0},
+            {"name": "template", "type": "template"}
+        ]
+    }
+
+models 把路由选出的模型名（见 app/model_router.py）映射为该提供方的模型名，未列出时使用
+default_model，都没有时使用原模型名。
+
+环境变量：
+    LLM_PROVIDERS_CONFIG=llm_providers.json   提供方配置文件路径
+    LOCAL_LLM_BASE_URL=                       本地 OpenAI 兼容服务地址
+    LOCAL_LLM_MODEL=                          本地服务的模型名
+    LLM_TEMPLATE_FALLBACK=0                   所有提供方都失败时使用模板出题
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from openai import OpenAI
+
+from app.backend import get_backend
+from app.llm_governor import RateLimitExceeded
+from app.llm_resilience import ResilientCaller, METRICS_KEY
+from app.quiz_parser import IncrementalQuestionParser
+
+DASHSCOPE_BASE_URL = 'https://dashscope.aliyuncs.com/compatible-mode/v1'
+DEFAULT_MAX_LATENCY = 120.0
+SMOOTHING = 0.2
+MIN_SUCCESS_RATE = 0.5
+# 健康统计至少有这么多次调用后才判断是否降级
+MIN_SAMPLES = 3
+# 剩余时间预算少于该秒数时不再切换
+MIN_FAILOVER_BUDGET = 5.0
+# 合并出题提示词中的每段题目数（“- 内容1：2 道”）和内容段标题（“【内容1】”）
+MERGED_COUNT_RE = re.compile(r'^- 内容(\d+)：(\d+) 道$', re.M)
+MERGED_SECTION_RE = re.compile(r'^【内容(\d+)】$', re.M)
+
+
+class ProviderUnavailable(Exception):
+    """所有提供方都调用失败"""
+
+
+class ProviderHealth:
+    """提供方的成功率和耗时（指数滑动平均）"""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.success_rate = 1.0
+        self.latency = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def record(self, success, seconds, error=None):
+        with self._lock:
+            self.calls += 1
+            self.success_rate += SMOOTHING * ((1.0 if success else 0.0) - self.success_rate)
+            if success:
+                self.latency = seconds if self.latency is None else self.latency + SMOOTHING * (seconds - self.latency)
+            else:
+                self.failures += 1
+                self.last_error = str(error)[:200] if error else None
+
+    def degraded(self, max_latency):
+        if self.calls < MIN_SAMPLES:
+            return False
+        return self.success_rate < MIN_SUCCESS_RATE or (self.latency is not None and self.latency > max_latency)
+
+
+class Provider:
+    """一个AI服务提供方"""
+
+    kind = None
+
+    def __init__(self, name, weight=1.0, max_latency=DEFAULT_MAX_LATENCY, caller=None, health=None):
+        self.name = name
+        self.weight = float(weight)
+        self.max_latency = float(max_latency)
+        self.caller = caller or ResilientCaller(name)
+        self.health = health or ProviderHealth()
+
+    def model_for(self, model):
+        return model
+
+    def complete(self, system, prompt, model, temperature, max_tokens, num_questions, timeout):
+        """
+        发出一次补全请求
+
+        Returns:
+            (增量解析器, usage)，usage 可为 None
+        """
+        raise NotImplementedError
+
+    def available(self):
+        """熔断未打开且未降级"""
+        return self.caller.breaker.state != 'open' and not self.health.degraded(self.max_latency)
+
+    def info(self):
+        return {
+            'type': self.kind,
+            'weight': self.weight,
+            'max_latency': self.max_latency,
+            'available': self.available(),
+            'calls': self.health.calls,
+            'failures': self.health.failures,
+            'success_rate': round(self.health.success_rate, 3),
+            'avg_latency': round(self.health.latency, 2) if self.health.latency is not None else None,
+            'last_error': self.health.last_error,
+            **self.caller.metrics()
+        }
+
+
+class OpenAICompatibleProvider(Provider):
+    """OpenAI 兼容接口（流式调用，边接收边解析题目）"""
+
+    kind = 'openai'
+
+    def __init__(self, name, base_url, api_key, models=None, default_model=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.base_url = base_url
+        self.models = models or {}
+        self.default_model = default_model
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,  # 重试由 app/llm_resilience.py 统一处理
+        )
+
+    def model_for(self, model):
+        return self.models.get(model) or self.default_model or model
+
+    def complete(self, system, prompt, model, temperature, max_tokens, num_questions, timeout):
+        stream = self.client.chat.completions.create(
+            model=self.model_for(model),
+            messages=[
+                {'role': 'system', 'content': system},
+                {'role': 'user', 'content': prompt}
+            ],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        parser = IncrementalQuestionParser()
+        usage = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                parser.feed(chunk.choices[0].delta.content)
+        return parser, usage
+
+
+class TemplateProvider(Provider):
+    """模板出题，不调用网络"""
+
+    kind = 'template'
+
+    def __init__(self, name, **kwargs):
+        kwargs.setdefault('weight', 0)
+        super().__init__(name, **kwargs)
+        from app.quiz_generator_mock import MockQuizGenerator
+        self.generator = MockQuizGenerator()
+
+    def model_for(self, model):
+        return 'template'
+
+    def _questions(self, content, num_questions, source=None):
+        questions = []
+        for quiz in self.generator.generate_quiz(content, num_questions):
+            question = {
+                'question': quiz['question'],
+                'options': [quiz['options'][letter] for letter in 'ABCD'],
+                'correct_answer': quiz['correct_answer'],
+                'explanation': '（模板生成的题目，AI服务暂时不可用）'
+            }
+            if source is not None:
+                question['source'] = source
+            questions.append(question)
+        return questions
+
+    def complete(self, system, prompt, model, temperature, max_tokens, num_questions, timeout):
+        # 合并出题的提示词（见 QuizGenerator._build_merged_prompt）按内容段分别出题并标明 source，
+        # 否则合并调用切换到模板时所有题目都会因缺少 source 被丢弃
+        counts = {int(i): int(n) for i, n in MERGED_COUNT_RE.findall(prompt)}
+        sections = MERGED_SECTION_RE.split(prompt)
+        if counts and len(sections) > 1:
+            questions = []
+            # split 结果为 [前言, 编号1, 内容1, 编号2, 内容2, ...]
+            for number, content in zip(sections[1::2], sections[2::2]):
+                questions.extend(self._questions(content, counts.get(int(number), 0), int(number)))
+        else:
+            # 模板只需要从提示词（含出题内容）中找关键词
+            questions = self._questions(prompt, num_questions)
+        parser = IncrementalQuestionParser()
+        parser.feed(json.dumps({'questions': questions}, ensure_ascii=False))
+        return parser, None
+
+
+PROVIDER_TYPES = {
+    'openai': OpenAICompatibleProvider,
+    'template': TemplateProvider,
+}
+
+
+def default_config():
+    """未提供配置文件时按环境变量生成"""
+    providers = []
+    if os.getenv('QWEN_API_KEY'):
+        providers.append({'name': 'qwen', 'type': 'openai', 'base_url': DASHSCOPE_BASE_URL,
+                          'api_key_env': 'QWEN_API_KEY', 'weight': 1})
+    if os.getenv('LOCAL_LLM_BASE_URL'):
+        providers.append({'name': 'local', 'type': 'openai', 'base_url': os.getenv('LOCAL_LLM_BASE_URL'),
+                          'default_model': os.getenv('LOCAL_LLM_MODEL') or None,
+                          'weight': 0 if providers else 1})
+    if os.getenv('LLM_TEMPLATE_FALLBACK', '0').lower() in ('1', 'true', 'yes'):
+        providers.append({'name': 'template', 'type': 'template'})
+    return {'providers': providers}
+
+
+class ProviderRegistry:
+    """按配置创建提供方，按权重和健康状况选择，失败时切换"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('LLM_PROVIDERS_CONFIG', 'llm_providers.json')
+        self._mtime = False  # 尚未加载
+        self._providers = []
+        # 重新加载配置时保留同名提供方的熔断状态和健康统计
+        self._callers = {}
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def providers(self):
+        """当前的提供方列表；配置文件修改时间变化时重新加载"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._providers = self._build(self._load() if mtime is not None else default_config())
+                    self._mtime = mtime
+        return self._providers
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                config = json.load(f)
+            if not isinstance(config.get('providers'), list):
+                raise ValueError('缺少 providers 列表')
+            return config
+        except Exception as e:
+            print(f"警告：AI服务提供方配置 {self.path} 无效，使用环境变量配置: {e}")
+            return default_config()
+
+    def _build(self, config):
+        providers = []
+        for spec in config['providers']:
+            name = spec.get('name') or spec.get('type')
+            kind = spec.get('type', 'openai')
+            try:
+                if kind not in PROVIDER_TYPES:
+                    raise ValueError(f'未知类型 {kind}')
+                options = {
+                    'weight': spec.get('weight', 0 if kind == 'template' else 1),
+                    'max_latency': spec.get('max_latency', DEFAULT_MAX_LATENCY),
+                    'caller': self._callers.setdefault(name, ResilientCaller(name)),
+                    'health': self._health.setdefault(name, ProviderHealth()),
+                }
+                if kind == 'openai':
+                    api_key = os.getenv(spec['api_key_env']) if spec.get('api_key_env') else 'EMPTY'
+                    if not api_key:
+                        raise ValueError(f"未设置环境变量 {spec['api_key_env']}")
+                    provider = OpenAICompatibleProvider(
+                        name, spec['base_url'], api_key, models=spec.get('models'),
+                        default_model=spec.get('default_model'), **options)
+                else:
+                    provider = TemplateProvider(name, **options)
+            except Exception as e:
+                print(f"警告：AI服务提供方 {name} 配置失败，已跳过: {e}")
+                continue
+            providers.append(provider)
+        print(f"AI服务提供方: {[(p.name, p.weight) for p in providers] or '无'}")
+        return providers
+
+    def ordered(self):
+        """本次调用尝试的顺序：健康的按权重随机，之后是降级的，最后是权重为0的备用提供方和模板"""
+        healthy, degraded, standby, templates = [], [], [], []
+        for provider in self.providers():
+            if provider.kind == 'template':
+                templates.append(provider)
+            elif provider.weight <= 0:
+                standby.append(provider)
+            elif provider.available():
+                healthy.append(provider)
+            else:
+                degraded.append(provider)
+        # 加权随机排序：权重越大越可能排在前面
+        healthy.sort(key=lambda p: random.random() ** (1.0 / p.weight), reverse=True)
+        degraded.sort(key=lambda p: p.health.success_rate, reverse=True)
+        return healthy + degraded + standby + templates
+
+    def complete(self, system, prompt, model, temperature, max_tokens, num_questions, budget, permit=None):
+        """
+        调用一个提供方，失败时在时间预算内切换到下一个
+
+        Returns:
+            (增量解析器, usage)；permit 上记录实际使用的提供方和模型
+
+        Raises:
+            RateLimitExceeded: 所有提供方都处于熔断状态（CircuitOpenError）或等不到限流令牌
+            ProviderUnavailable: 所有提供方都调用失败
+        """
+        deadline = time.monotonic() + budget
+        errors = []
+        for provider in self.ordered():
+            remaining = deadline - time.monotonic()
+            if errors and remaining < MIN_FAILOVER_BUDGET:
+                break
+            if errors:
+                _count_failover()
+                print(f"🔀 切换到AI服务提供方 {provider.name}")
+            start = time.monotonic()
+            try:
+                # 超过该提供方的耗时上限视为故障，把剩余时间留给下一个提供方
+                # 模板不调用网络，不占用限流令牌
+                parser, usage = provider.caller.call(
+                    lambda timeout, provider=provider: provider.complete(
+                        system, prompt, model, temperature, max_tokens, num_questions, timeout),
+                    min(remaining, provider.max_latency),
+                    permit if provider.kind != 'template' else None
+                )
+            except Exception as e:
+                # 熔断和限流令牌不足都不是提供方本身的故障
+                if not isinstance(e, RateLimitExceeded):
+                    provider.health.record(False, time.monotonic() - start, e)
+                errors.append((provider.name, e))
+                print(f"⚠️ AI服务提供方 {provider.name} 调用失败: {e}")
+                continue
+            provider.health.record(True, time.monotonic() - start)
+            if permit is not None:
+                permit.provider = provider.name
+                permit.model = provider.model_for(model)
+            return parser, usage
+
+        if errors and all(isinstance(e, RateLimitExceeded) for _, e in errors):
+            raise min((e for _, e in errors), key=lambda e: e.retry_after)
+        raise ProviderUnavailable('所有AI服务提供方均不可用：' + '；'.join(f'{name}: {e}' for name, e in errors))
+
+    def metrics(self):
+        return {provider.name: provider.info() for provider in self.providers()}
+
+
+def _count_failover():
+    try:
+        get_backend().hincrby(METRICS_KEY, 'failovers', 1)
+    except Exception as e:
+        print(f"警告：记录调用指标失败: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_provider_registry():
+    """获取进程内的提供方注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ProviderRegistry()
+    return _registry
@@ -0,0 +1,273 @@
+"""
+大模型调用的重试、对冲请求和熔断
+
+单次调用遇到偶发的 5xx 或超时，不应直接变成用户看到的"AI生成题目失败"：
+
+- 重试：可重试的错误（超时、连接错误、429、5xx）按指数退避加随机抖动（full jitter）重试，
+  总耗时不超过调用方给出的时间预算；每次重试都向限流器（app/llm_governor.py）重新扣减令牌
+- 对冲：开启 LLM_HEDGE 后，若请求超过近期耗时的 p95 仍未返回，且限流器还有空闲的调用位置和令牌，
+  再发一个相同的请求，取先成功的结果，以削减长尾延迟（会多消耗token，默认关闭）
+- 熔断：连续失败达到阈值后进入打开状态，冷却期内直接失败（CircuitOpenError），
+  冷却结束后放行一个探测请求，成功则恢复
+
+每个AI服务提供方（见 app/llm_providers.py）各有一个 ResilientCaller，熔断和耗时分位数按提供方分别统计；
+重试、对冲、熔断的计数写入共享状态后端（各worker进程累加），耗时分位数和熔断状态为本进程数据。
+OpenAI 客户端自带的重试需关闭（max_retries=0），避免两层重试叠加。
+
+环境变量：
+    LLM_RETRY_ATTEMPTS=3          每次调用最多尝试次数
+    LLM_RETRY_BASE_DELAY=1.0      退避基数（秒）
+    LLM_RETRY_MAX_DELAY=10        单次退避上限（秒）
+    LLM_HEDGE=0                   是否启用对冲请求
+    LLM_BREAKER_FAILURES=5        连续失败多少次后熔断
+    LLM_BREAKER_COOLDOWN=30       熔断后的冷却时间（秒）
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from app.backend import get_backend
+from app.llm_governor import get_llm_governor, RateLimitExceeded
+
+METRICS_KEY = 'llm:metrics'
+# 单次请求的超时上限（秒）
+ATTEMPT_TIMEOUT = 60.0
+# 估算 p95 的最近样本数，以及开始对冲所需的最少样本数
+LATENCY_WINDOW = 200
+MIN_HEDGE_SAMPLES = 20
+MIN_HEDGE_DELAY = 2.0
+
+RETRYABLE_STATUS = {408, 409, 429}
+RETRYABLE_ERRORS = ('APITimeoutError', 'APIConnectionError')
+
+
+class CircuitOpenError(RateLimitExceeded):
+    """熔断打开期间的调用直接失败"""
+
+    status = 503
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after, 'AI服务暂时不可用')
+
+
+def is_retryable(error):
+    """超时、连接错误、429 和 5xx 可以重试；参数错误、鉴权失败等不重试"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+class CircuitBreaker:
+    """连续失败计数的熔断器（closed -> open -> half_open -> closed）"""
+
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'open':
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(remaining)
+                self.state = 'half_open'
+            if self.state == 'half_open':
+                if self._probing:
+                    raise CircuitOpenError(1)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """返回本次失败是否使熔断器打开"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                opened = self.state != 'open'
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                return opened
+            return False
+
+    def info(self):
+        with self._lock:
+            info = {'state': self.state, 'consecutive_failures': self.failures}
+            if self.state == 'open':
+                info['retry_after'] = round(max(0.0, self.opened_at + self.cooldown - time.monotonic()), 1)
+            return info
+
+
+class ResilientCaller:
+    """带重试、对冲和熔断的调用包装（每个提供方一个实例）"""
+
+    def __init__(self, name='default'):
+        self.name = name
+        self.attempts = max(1, int(os.getenv('LLM_RETRY_ATTEMPTS', 3)))
+        self.base_delay = float(os.getenv('LLM_RETRY_BASE_DELAY', 1.0))
+        self.max_delay = float(os.getenv('LLM_RETRY_MAX_DELAY', 10))
+        self.hedge = os.getenv('LLM_HEDGE', '0').lower() in ('1', 'true', 'yes')
+        self.breaker = CircuitBreaker(int(os.getenv('LLM_BREAKER_FAILURES', 5)),
+                                      float(os.getenv('LLM_BREAKER_COOLDOWN', 30)))
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _count(self, field, amount=1):
+        try:
+            get_backend().hincrby(METRICS_KEY, field, amount)
+        except Exception as e:
+            print(f"警告：记录调用指标失败: {e}")
+
+    def _record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def latency_percentile(self, percentile):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, request, budget, permit=None):
+        """
+        调用 request(timeout)，失败时按策略重试
+
+        Args:
+            request: 发起一次请求的函数，参数为本次请求的超时秒数
+            budget: 总时间预算（秒），包括重试间隔
+            permit: 限流器的调用许可，重试次数累加到 permit.retries；每次请求都按许可扣减令牌
+
+        Raises:
+            CircuitOpenError: 熔断打开
+            RateLimitExceeded: 重试所需的令牌在时间预算内等不到
+            最后一次尝试的异常
+        """
+        governor = get_llm_governor()
+        deadline = time.monotonic() + budget
+        # 切换提供方后的第一次请求同样要扣令牌（许可的第一次请求除外）
+        governor.charge_attempt(permit, deadline)
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            governor.refund_attempt(permit)
+            raise
+        self._count('calls')
+        for attempt in range(self.attempts):
+            timeout = min(ATTEMPT_TIMEOUT, deadline - time.monotonic())
+            try:
+                result = self._attempt(request, timeout, permit)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if not retryable:
+                    self.breaker.record_success()  # 服务商有响应（如参数错误），不计入熔断
+                elif self.breaker.record_failure():
+                    self._count('breaker_opened')
+                    print(f"⚠️ {self.name} 连续失败，熔断 {self.breaker.cooldown:.0f} 秒")
+                delay = self._backoff(attempt)
+                if (not retryable or attempt == self.attempts - 1 or self.breaker.state == 'open'
+                        or time.monotonic() + delay >= deadline):
+                    self._count('failures')
+                    raise
+                self._count('retries')
+                if permit is not None:
+                    permit.retries += 1
+                print(f"🔁 {self.name} 调用失败（{e}），{delay:.1f} 秒后第 {attempt + 2} 次尝试")
+                time.sleep(delay)
+                governor.charge_attempt(permit, deadline)
+                continue
+            self.breaker.record_success()
+            self._count('successes')
+            return result
+
+    def _timed(self, request, timeout):
+        start = time.monotonic()
+        result = request(timeout)
+        self._record_latency(time.monotonic() - start)
+        return result
+
+    def _hedge_delay(self):
+        with self._lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+        return max(MIN_HEDGE_DELAY, self.latency_percentile(0.95))
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                workers = get_llm_governor().max_in_flight * 2
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='llm-hedge')
+            return self._executor
+
+    def _attempt(self, request, timeout, permit=None):
+        """一次尝试；启用对冲时，超过 p95 未返回则再发一个请求"""
+        hedge_delay = self._hedge_delay() if self.hedge else None
+        if hedge_delay is None or hedge_delay >= timeout:
+            return self._timed(request, timeout)
+
+        executor = self._get_executor()
+        start = time.monotonic()
+        pending = {executor.submit(self._timed, request, timeout)}
+        done, pending = wait(pending, timeout=hedge_delay)
+        if not done:
+            governor = get_llm_governor()
+            lease_id = governor.try_extra_slot(permit)
+            if lease_id:
+                self._count('hedges')
+                hedge = executor.submit(self._timed, request, timeout - (time.monotonic() - start))
+                hedge.is_hedge = True
+                hedge.add_done_callback(lambda _: governor.release_extra_slot(lease_id))
+                pending.add(hedge)
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    if getattr(future, 'is_hedge', False):
+                        self._count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                raise TimeoutError(f"请求超时（{timeout:.0f}秒）")
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+    def metrics(self):
+        p50, p95 = self.latency_percentile(0.5), self.latency_percentile(0.95)
+        return {
+            'latency': {
+                'samples': len(self._latencies),
+                'p50': round(p50, 2) if p50 is not None else None,
+                'p95': round(p95, 2) if p95 is not None else None
+            },
+            'breaker': self.breaker.info(),
+            'hedge_enabled': self.hedge
+        }
+
+
+def call_counters():
+    """所有提供方合计的调用、重试、对冲、熔断次数"""
+    counters = get_backend().hgetall(METRICS_KEY)
+    return {field: counters.get(field, 0) for field in (
+        'calls', 'successes', 'failures', 'retries', 'hedges', 'hedge_wins', 'breaker_opened', 'failovers')}
@@ -0,0 +1,206 @@
+"""
+按请求规模选择出题模型
+
+原来所有请求都用 qwen-plus、temperature=0.9：一段话出一道题和十万字的讲义出二十道题走的是同一个模型。
+这里按请求的内容token数和题目数量在若干档模型中选择，并根据实际调用情况调整：
+
+- 配置中的 tiers 按顺序排列（通常从快到大），请求落在某一档的 max_input_tokens / max_questions
+  以内、且装得进该模型的上下文窗口时，优先使用这一档
+- 每个模型记录调用耗时（按每道题的耗时做指数滑动平均）和成功率；首选模型预计耗时超过
+  延迟目标（latency_slo_seconds，可按请求覆盖）或成功率低于 min_success_rate 时，
+  依次改用后面满足条件的模型；都不满足时选成功率最高、预计最快的一档
+- 被降级的模型在 probe_after_seconds 秒未被使用后重新参与选择，恢复后自动回到首选
+- 耗时和成功率为本进程数据
+
+配置为 JSON 文件（MODEL_ROUTING_CONFIG），修改后按文件修改时间自动重新加载，无需改代码或重启；
+文件不存在或格式错误时使用内置的默认配置。格式：
+
+    {
+        "latency_slo_seconds": 60,
+        "min_success_rate": 0.8,
+        "probe_after_seconds": 120,
+        "tiers": [
+            {"model": "qwen-turbo", "max_input_tokens": 8000, "max_questions": 3, "temperature": 0.9},
+            {"model": "qwen-plus", "max_input_tokens": 120000, "max_questions": 20, "temperature": 0.9},
+            {"model": "qwen-long", "temperature": 0.8}
+        ]
+    }
+
+环境变量：
+    MODEL_ROUTING_CONFIG=model_routing.json   路由配置文件路径
+"""
+import json
+import os
+import threading
+import time
+
+from app import token_counter
+
+DEFAULT_CONFIG = {
+    'latency_slo_seconds': 60,
+    'min_success_rate': 0.8,
+    'probe_after_seconds': 120,
+    'tiers': [
+        {'model': 'qwen-turbo', 'max_input_tokens': 8000, 'max_questions': 3, 'temperature': 0.9},
+        {'model': 'qwen-plus', 'max_input_tokens': 120000, 'max_questions': 20, 'temperature': 0.9},
+        {'model': 'qwen-long', 'temperature': 0.8},
+    ]
+}
+DEFAULT_TEMPERATURE = 0.9
+SMOOTHING = 0.2
+# 成功率和耗时至少有这么多次调用后才参与降级判断
+MIN_SAMPLES = 5
+
+
+class Route:
+    """一次请求选中的模型"""
+
+    def __init__(self, model, temperature, reason):
+        self.model = model
+        self.temperature = temperature
+        self.reason = reason
+
+
+class _ModelStats:
+    __slots__ = ('calls', 'successes', 'success_rate', 'seconds_per_question', 'last_used')
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.success_rate = 1.0
+        self.seconds_per_question = None
+        self.last_used = 0.0
+
+
+class ModelRouter:
+    """按内容规模、题目数和延迟目标选择模型"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('MODEL_ROUTING_CONFIG', 'model_routing.json')
+        self._config = DEFAULT_CONFIG
+        self._mtime = None
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def config(self):
+        """当前配置；文件修改时间变化时重新加载"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._config = self._load() if mtime is not None else DEFAULT_CONFIG
+                    self._mtime = mtime
+        return self._config
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                config = json.load(f)
+            if not config.get('tiers') or not all(tier.get('model') for tier in config['tiers']):
+                raise ValueError('tiers 不能为空，且每一档都需要 model')
+            print(f"已加载模型路由配置 {self.path}: {[tier['model'] for tier in config['tiers']]}")
+            return {**DEFAULT_CONFIG, **config}
+        except Exception as e:
+            print(f"警告：模型路由配置 {self.path} 无效，使用默认配置: {e}")
+            return DEFAULT_CONFIG
+
+    def _stats_for(self, model):
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = _ModelStats()
+        return stats
+
+    def _healthy(self, model, num_questions, slo, config, now):
+        """模型近期的成功率和预计耗时是否满足要求，返回 (是否满足, 预计耗时)"""
+        stats = self._stats_for(model)
+        predicted = stats.seconds_per_question * num_questions if stats.seconds_per_question else None
+        if stats.calls < MIN_SAMPLES or now - stats.last_used > config['probe_after_seconds']:
+            return True, predicted  # 数据不足或长时间未使用：重新尝试
+        ok = stats.success_rate >= config['min_success_rate'] and (predicted is None or predicted <= slo)
+        return ok, predicted
+
+    def choose(self, input_tokens, num_questions, latency_slo=None):
+        """
+        选择模型
+
+        Args:
+            input_tokens: 内容的token数
+            num_questions: 题目数量
+            latency_slo: 本次请求的延迟目标（秒），默认取配置
+
+        Returns:
+            Route
+        """
+        config = self.config()
+        slo = latency_slo or config['latency_slo_seconds']
+        tiers = [
+            tier for tier in config['tiers']
+            if input_tokens <= tier.get('max_input_tokens', float('inf'))
+            and num_questions <= tier.get('max_questions', float('inf'))
+            and input_tokens <= token_counter.model_limits(tier['model'])[0]
+        ] or config['tiers'][-1:]  # 超出所有档位时交给最后一档（摘要会压缩内容）
+
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for tier in tiers:
+                ok, predicted = self._healthy(tier['model'], num_questions, slo, config, now)
+                if ok:
+                    return Route(tier['model'], tier.get('temperature', DEFAULT_TEMPERATURE),
+                                 'preferred' if tier is tiers[0] else 'fallback')
+                candidates.append((-self._stats_for(tier['model']).success_rate,
+                                   predicted if predicted is not None else float('inf'), tier))
+        tier = min(candidates, key=lambda item: item[:2])[2]
+        return Route(tier['model'], tier.get('temperature', DEFAULT_TEMPERATURE), 'degraded')
+
+    def record(self, model, seconds, num_questions, success):
+        """记录一次调用的耗时和结果"""
+        with self._lock:
+            stats = self._stats_for(model)
+            stats.calls += 1
+            stats.successes += 1 if success else 0
+            stats.success_rate += SMOOTHING * ((1.0 if success else 0.0) - stats.success_rate)
+            stats.last_used = time.monotonic()
+            if success:
+                per_question = seconds / max(1, num_questions)
+                if stats.seconds_per_question is None:
+                    stats.seconds_per_question = per_question
+                else:
+                    stats.seconds_per_question += SMOOTHING * (per_question - stats.seconds_per_question)
+
+    def metrics(self):
+        config = self.config()
+        with self._lock:
+            return {
+                'config_path': self.path,
+                'config_loaded': self._mtime is not None,
+                'latency_slo_seconds': config['latency_slo_seconds'],
+                'tiers': [tier['model'] for tier in config['tiers']],
+                'models': {
+                    model: {
+                        'calls': stats.calls,
+                        'successes': stats.successes,
+                        'success_rate': round(stats.success_rate, 3),
+                        'seconds_per_question': (round(stats.seconds_per_question, 2)
+                                                 if stats.seconds_per_question is not None else None)
+                    }
+                    for model, stats in self._stats.items()
+                }
+            }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    """获取进程内的模型路由实例"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter()
+    return _router
@@ -1,9 +1,9 @@
 from app import db
+from app.compressed_text import CompressedText
+from sqlalchemy.orm import validates, deferred
 from datetime import datetime
 from enum import Enum
 from werkzeug.security import generate_password_hash, check_password_hash
-import random
-import string
 
 class UserRole(Enum):
     ORGANIZER = "organizer"
@@ -45,6 +45,7 @@ class Session(db.Model):
     invite_code = db.Column(db.String(6), unique=True, nullable=False)  # 6位邀请码
     is_active = db.Column(db.Boolean, default=False)
     quiz_interval = db.Column(db.Integer, default=10)  # 分钟
+    llm_token_quota = db.Column(db.Integer)  # AI出题token配额，为空时使用 LLM_SESSION_TOKEN_QUOTA
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 关系
@@ -54,13 +55,9 @@ class Session(db.Model):
     
     @staticmethod
     def generate_unique_invite_code():
-        """生成唯一的6位数字邀请码"""
-        while True:
-            # 生成6位数字码
-            invite_code = ''.join(random.choices(string.digits, k=6))
-            # 检查是否已存在
-            if not Session.query.filter_by(invite_code=invite_code).first():
-                return invite_code
+        """从预生成的邀请码池中取一个空闲的6位数字邀请码"""
+        from app.invite_codes import invite_code_pool
+        return invite_code_pool.acquire()
     
 class SessionParticipant(db.Model):
     __tablename__ = 'session_participants'
@@ -81,8 +78,45 @@ class Content(db.Model):
     content_type = db.Column(db.String(50), nullable=False)  # text, ppt, pdf, audio, video
     original_filename = db.Column(db.String(255))
     file_path = db.Column(db.String(500))
-    extracted_text = db.Column(db.Text)
+    # 完整文本压缩存储，且默认不随列表查询加载；长度和预览单独存为小列
+    extracted_text = deferred(db.Column(CompressedText))
+    text_length = db.Column(db.Integer, default=0)  # 提取完成前为0，旧数据在 upgrade_schema 中补算
+    text_preview = db.Column(db.String(210))
     upload_time = db.Column(db.DateTime, default=datetime.utcnow)
+    # 后台提取状态：pending, processing, ready, failed
+    status = db.Column(db.String(20), default='ready', nullable=False)
+    stage = db.Column(db.String(20))  # 当前阶段：parse, ocr, transcribe
+    error = db.Column(db.Text)
+    
+    # 按页/幻灯片/音频片段存储的结构化内容
+    segments = db.relationship('ContentSegment', backref='content', lazy='dynamic',
+                               cascade='all, delete-orphan', order_by='ContentSegment.seq')
+    
+    PREVIEW_CHARS = 200
+    
+    @validates('extracted_text')
+    def _update_text_summary(self, key, value):
+        """写入完整文本时同步更新长度和预览"""
+        self.text_length = len(value) if value else 0
+        if value and len(value) > self.PREVIEW_CHARS:
+            self.text_preview = value[:self.PREVIEW_CHARS] + '...'
+        else:
+            self.text_preview = value
+        return value
+
+class ContentSegment(db.Model):
+    __tablename__ = 'content_segments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('contents.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # 片段在内容中的顺序
+    page_number = db.Column(db.Integer)  # PDF页码/幻灯片序号，音视频为空
+    source_kind = db.Column(db.String(20), nullable=False)  # text, ocr, transcript
+    char_start = db.Column(db.Integer, nullable=False)  # 在完整文本中的字符偏移
+    char_end = db.Column(db.Integer, nullable=False)
+    text = db.Column(CompressedText, nullable=False)
+    
+    __table_args__ = (db.UniqueConstraint('content_id', 'seq'),)
 
 class Quiz(db.Model):
     __tablename__ = 'quizzes'
@@ -104,6 +138,47 @@ class Quiz(db.Model):
     responses = db.relationship('QuizResponse', backref='quiz')
     discussions = db.relationship('QuizDiscussion', backref='quiz')
 
+class QuizDraft(db.Model):
+    """后台预先生成、尚未发布的候选题目（见 app/pregeneration.py）"""
+    __tablename__ = 'quiz_drafts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False, index=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('contents.id'))  # 出题所用的内容
+    question = db.Column(db.Text, nullable=False)
+    option_a = db.Column(db.String(500), nullable=False)
+    option_b = db.Column(db.String(500), nullable=False)
+    option_c = db.Column(db.String(500), nullable=False)
+    option_d = db.Column(db.String(500), nullable=False)
+    correct_answer = db.Column(db.String(1), nullable=False)
+    explanation = db.Column(db.Text)
+    time_limit = db.Column(db.Integer, default=30)
+    # ready 待发布，published 已发布，discarded 已丢弃
+    status = db.Column(db.String(20), default='ready', nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'))  # 发布后对应的题目
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class LLMCallRecord(db.Model):
+    """每次大模型调用的用量、耗时和结果（见 app/llm_accounting.py）"""
+    __tablename__ = 'llm_call_records'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    purpose = db.Column(db.String(20), nullable=False)  # generate, upload, pregenerate
+    followup = db.Column(db.Boolean, default=False, nullable=False)  # 补发缺少题目的请求
+    provider = db.Column(db.String(50))  # 实际响应的提供方（见 app/llm_providers.py）
+    model = db.Column(db.String(50), nullable=False)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    total_tokens = db.Column(db.Integer, default=0, nullable=False)
+    latency = db.Column(db.Float, nullable=False)  # 秒，包括重试
+    retries = db.Column(db.Integer, default=0, nullable=False)
+    batch_size = db.Column(db.Integer, default=1, nullable=False)  # 合并调用的请求数，token按比例分摊
+    outcome = db.Column(db.String(20), nullable=False)  # success, timeout, error
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
 class QuizResponse(db.Model):
     __tablename__ = 'quiz_responses'
     
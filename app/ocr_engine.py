@@ -0,0 +1,186 @@
+"""
+共享OCR引擎
+
+EasyOCR的Reader加载一次需要数秒并占用数百MB内存，原来每个 FileProcessor
+都会各自创建一个，并且对每张图片单独调用 readtext。这里提供一个进程内共享的
+OCR引擎，一次处理一个文档的全部图片：
+
+- 按字节哈希去掉完全相同的图片，按感知哈希（dHash）去掉几乎相同的图片
+- 过大的图片先缩小再识别
+- 尺寸相同的图片（如同一视频的帧）合并为批次调用 readtext_batched，
+  批大小默认等于CPU线程数
+
+环境变量：
+    OCR_MAX_SIDE=1600       图片最长边超过该值时缩小
+    OCR_BATCH_SIZE=<CPU数>  每批识别的数量
+    OCR_DEDUP_DISTANCE=2    感知哈希的汉明距离不超过该值视为重复图片
+"""
+import io
+import os
+import hashlib
+import threading
+
+from app.optional_deps import is_available, load
+
+# 可选依赖 - 未安装easyocr时OCR不可用；easyocr 会连带导入torch，首次识别时才导入
+EASYOCR_AVAILABLE = is_available('easyocr')
+
+OCR_LANGUAGES = ['ch_sim', 'en']
+DEFAULT_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', 1600))
+DEFAULT_BATCH_SIZE = int(os.getenv('OCR_BATCH_SIZE', os.cpu_count() or 1))
+DEFAULT_DEDUP_DISTANCE = int(os.getenv('OCR_DEDUP_DISTANCE', 2))
+# dHash 的网格大小，16x16 = 256位，比常见的8x8更不容易把版式相同、文字不同的幻灯片误判为重复
+HASH_SIZE = 16
+
+
+def _dhash(pil_image):
+    """差值感知哈希"""
+    Image, np = load('PIL.Image'), load('numpy')
+    gray = pil_image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+class OCREngine:
+    """进程内共享的OCR引擎（线程安全，识别调用串行执行）"""
+
+    def __init__(self, languages=None, max_side=DEFAULT_MAX_SIDE,
+                 batch_size=DEFAULT_BATCH_SIZE, dedup_distance=DEFAULT_DEDUP_DISTANCE):
+        self.languages = languages or OCR_LANGUAGES
+        self.max_side = max_side
+        self.batch_size = max(1, batch_size)
+        self.dedup_distance = dedup_distance
+        self._reader = None
+        self._reader_failed = False
+        self._init_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+    @property
+    def reader(self):
+        """延迟创建EasyOCR Reader，失败后不再重试"""
+        if self._reader is None and not self._reader_failed and EASYOCR_AVAILABLE:
+            with self._init_lock:
+                if self._reader is None and not self._reader_failed:
+                    try:
+                        self._reader = load('easyocr').Reader(self.languages, gpu=False)
+                    except Exception as e:
+                        print(f"警告：EasyOCR 初始化失败: {e}")
+                        self._reader_failed = True
+        return self._reader
+
+    @property
+    def available(self):
+        return self.reader is not None
+
+    def recognize(self, image, min_confidence=0.0):
+        """识别单张图片，返回文字列表；OCR不可用时返回None"""
+        results = self.recognize_many([image], min_confidence)
+        return results[0] if results is not None else None
+
+    def recognize_many(self, images, min_confidence=0.0, perceptual_dedup=True, mark_failures=False):
+        """
+        批量识别一个文档中的全部图片
+
+        Args:
+            images: 图片列表，元素可以是图片文件字节、PIL图像或RGB数组
+            min_confidence: 置信度阈值
+            perceptual_dedup: 是否按感知哈希去掉几乎相同的图片（整页文字的扫描件应关闭）
+            mark_failures: 为True时预处理或识别出错的图片对应None，以便与没有文字的图片（[]）区分
+
+        Returns:
+            与 images 一一对应的文字列表 [[text, ...], ...]；OCR不可用时返回None
+        """
+        if not images:
+            return []
+        reader = self.reader
+        if reader is None:
+            return None
+
+        # 去重：owner[i] 为第 i 张图片实际识别时使用的图片下标
+        owner = [None] * len(images)
+        prepared = {}  # 下标 -> 缩放后的数组
+        byte_hashes = {}
+        perceptual_hashes = []  # [(hash, 下标)]
+        for i, image in enumerate(images):
+            try:
+                if isinstance(image, (bytes, bytearray)):
+                    digest = hashlib.sha1(image).digest()
+                    if digest in byte_hashes:
+                        owner[i] = byte_hashes[digest]
+                        continue
+                    byte_hashes[digest] = i
+                pil_image = self._to_pil(image)
+                if perceptual_dedup:
+                    phash = _dhash(pil_image)
+                    duplicate = next((j for h, j in perceptual_hashes
+                                      if bin(h ^ phash).count('1') <= self.dedup_distance), None)
+                    if duplicate is not None:
+                        owner[i] = duplicate
+                        continue
+                    perceptual_hashes.append((phash, i))
+                prepared[i] = self._downscale(pil_image)
+                owner[i] = i
+            except Exception as e:
+                print(f"OCR预处理第{i+1}张图片时出错: {e}")
+
+        texts = self._run(reader, prepared, min_confidence)
+        failed = None if mark_failures else []
+        return [texts.get(j, failed) if j is not None else failed for j in owner]
+
+    def _run(self, reader, prepared, min_confidence):
+        """按尺寸分组后批量识别，返回 {下标: [text, ...]}"""
+        groups = {}
+        for i, array in prepared.items():
+            groups.setdefault(array.shape, []).append(i)
+
+        texts = {}
+        with self._run_lock:
+            for indices in groups.values():
+                for start in range(0, len(indices), self.batch_size):
+                    chunk = indices[start:start + self.batch_size]
+                    try:
+                        if len(chunk) == 1:
+                            outputs = [reader.readtext(prepared[chunk[0]], batch_size=self.batch_size)]
+                        else:
+                            outputs = reader.readtext_batched([prepared[i] for i in chunk],
+                                                              batch_size=self.batch_size)
+                    except Exception as e:
+                        print(f"OCR识别时出错: {e}")
+                        continue
+                    for i, detections in zip(chunk, outputs):
+                        texts[i] = [d[1] for d in detections if d[2] >= min_confidence]
+        return texts
+
+    @staticmethod
+    def _to_pil(image):
+        Image, np = load('PIL.Image'), load('numpy')
+        if isinstance(image, (bytes, bytearray)):
+            image = Image.open(io.BytesIO(image))
+        elif not isinstance(image, Image.Image):
+            image = Image.fromarray(np.asarray(image))
+        return image.convert('RGB')
+
+    def _downscale(self, pil_image):
+        Image, np = load('PIL.Image'), load('numpy')
+        width, height = pil_image.size
+        longest = max(width, height)
+        if self.max_side and longest > self.max_side:
+            scale = self.max_side / longest
+            pil_image = pil_image.resize((max(1, int(width * scale)), max(1, int(height * scale))),
+                                         Image.BILINEAR)
+        return np.asarray(pil_image)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine():
+    """获取进程内共享的OCR引擎（延迟初始化）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = OCREngine()
+    return _engine
@@ -0,0 +1,143 @@
+"""
+扫描版PDF页面的OCR
+
+PyPDF2 只能读取PDF的文字层，扫描版讲义的页面提取结果为空。对这些空白页：
+
+- 用 pypdfium2 光栅化为图片；pdfium 本身不是线程安全的，
+  所以放在有上限的进程池中并行渲染（spawn 方式启动，避免在多线程服务进程中 fork）
+- 每次渲染 PDF_OCR_BATCH 页，交给共享OCR引擎（app/ocr_engine.py）批量识别并缓存结果后
+  再渲染下一批：一页200dpi的A4图片约10MB，内存占用不随页数增长
+- 识别结果按 (文件哈希, 页码) 缓存，同一份讲义重复上传时不再重新识别；
+  渲染或识别失败的页面不缓存、不出现在结果中，下次上传时重新识别
+
+有文字层的页面不会进入这里，普通PDF没有额外开销。
+
+环境变量：
+    PDF_OCR_WORKERS=<min(4, CPU数)>  渲染进程数
+    PDF_OCR_DPI=200                  渲染分辨率
+    PDF_OCR_BATCH=8                  每批渲染和识别的页数
+    PDF_OCR_CACHE_PAGES=512          缓存的页面数
+"""
+import os
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from app.ocr_engine import get_ocr_engine
+from app.optional_deps import is_available, load
+
+# 可选依赖 - 未安装pypdfium2时扫描页无法OCR
+PDFIUM_AVAILABLE = is_available('pypdfium2')
+
+RENDER_WORKERS = int(os.getenv('PDF_OCR_WORKERS', min(4, os.cpu_count() or 1)))
+RENDER_DPI = int(os.getenv('PDF_OCR_DPI', 200))
+BATCH_PAGES = int(os.getenv('PDF_OCR_BATCH', 8))
+CACHE_PAGES = int(os.getenv('PDF_OCR_CACHE_PAGES', 512))
+
+
+def _render_page(pdf_path, page_index, scale):
+    """在渲染进程中把一页渲染为RGB数组"""
+    pdfium, np = load('pypdfium2'), load('numpy')
+    document = pdfium.PdfDocument(pdf_path)
+    try:
+        page = document[page_index]
+        image = page.render(scale=scale).to_pil().convert('RGB')
+        page.close()
+        return np.asarray(image)
+    finally:
+        document.close()
+
+
+class PdfPageOCR:
+    """空白页光栅化 + OCR，带按页缓存"""
+
+    def __init__(self, workers=RENDER_WORKERS, dpi=RENDER_DPI, cache_pages=CACHE_PAGES, batch_pages=BATCH_PAGES):
+        self.workers = max(1, workers)
+        self.batch_pages = max(1, batch_pages)
+        self.scale = dpi / 72
+        self.cache_pages = cache_pages
+        self._cache = OrderedDict()  # (文件哈希, 页码) -> 文本
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def available(self):
+        return PDFIUM_AVAILABLE and get_ocr_engine().available
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def ocr_pages(self, pdf_bytes, page_indices):
+        """
+        识别指定页面
+
+        Returns:
+            {页码(从0开始): 文本}，不可用或渲染/识别失败的页面不在结果中（没有文字的页面为空字符串）
+        """
+        if not page_indices or not self.available:
+            return {}
+
+        digest = hashlib.sha1(pdf_bytes).hexdigest()
+        results = {}
+        missing = []
+        with self._lock:
+            for index in page_indices:
+                text = self._cache.get((digest, index))
+                if text is None:
+                    missing.append(index)
+                else:
+                    self._cache.move_to_end((digest, index))
+                    results[index] = text
+        if not missing:
+            return results
+
+        # 渲染进程按路径打开文件，只需写一次临时文件
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temp_pdf:
+            temp_pdf.write(pdf_bytes)
+        failed = []
+        try:
+            executor = self._get_executor()
+            for start in range(0, len(missing), self.batch_pages):
+                self._ocr_batch(executor, temp_pdf.name, digest, missing[start:start + self.batch_pages],
+                                results, failed)
+        finally:
+            os.unlink(temp_pdf.name)
+        if failed:
+            print(f"警告：PDF第 {', '.join(str(index + 1) for index in sorted(failed))} 页OCR失败，已跳过（未缓存）")
+        return results
+
+    def _ocr_batch(self, executor, pdf_path, digest, indices, results, failed):
+        """渲染并识别一批页面，成功的写入缓存和 results，失败的页码加入 failed（图片在返回后即释放）"""
+        futures = [(index, executor.submit(_render_page, pdf_path, index, self.scale)) for index in indices]
+        rendered = []
+        for index, future in futures:
+            try:
+                rendered.append((index, future.result()))
+            except Exception as e:
+                print(f"渲染PDF第{index+1}页时出错: {e}")
+                failed.append(index)
+
+        texts = get_ocr_engine().recognize_many([image for _, image in rendered], perceptual_dedup=False,
+                                                mark_failures=True)
+        if texts is None:  # OCR引擎不可用
+            texts = [None] * len(rendered)
+        with self._lock:
+            for (index, _), lines in zip(rendered, texts):
+                if lines is None:
+                    failed.append(index)
+                    continue
+                text = '\n'.join(lines)
+                results[index] = text
+                self._cache[(digest, index)] = text
+            while len(self._cache) > self.cache_pages:
+                self._cache.popitem(last=False)
+
+
+pdf_page_ocr = PdfPageOCR()
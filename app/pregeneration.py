@@ -0,0 +1,241 @@
+"""
+按出题间隔预先生成候选题目
+
+Session.quiz_interval（分钟）记录了演讲者计划的出题间隔，但题目原来只在演讲者点击时才开始生成，
+听众要一直等到大模型返回。这里在后台为进行中的会话提前准备题目：
+
+- 调度线程每隔 PREGEN_POLL_SECONDS 秒检查一次 is_active 的会话；距离下一次出题
+  （最近一道题的创建时间 + quiz_interval）不到 PREGEN_LEAD_SECONDS 秒、
+  且待发布的候选题少于 PREGEN_BUFFER 道时，用最近上传的内容补足
+- 候选题存入 QuizDraft 表，演讲者通过 send-to-audience 传入 draft_id 即可立即发布
+- 每个会话预生成已消耗的token数（按调用记录统计，见 app/llm_accounting.py）加上本次调用的上限
+  不超过 PREGEN_TOKEN_CAP，预生成同时计入会话的token配额；
+  限流器需要排队时不做预生成，让位于演讲者的即时请求
+- 与已有题目和待发布候选题近似重复的题目直接丢弃（见 app/dedup.py）
+
+调度线程在每个worker进程收到第一个请求时启动。多进程时用共享状态后端里的锁保证
+每轮检查只由一个进程执行、同一会话同时只有一个补充任务（STATE_BACKEND=redis 时跨进程生效）。
+
+环境变量：
+    PREGEN_ENABLED=1            是否启用预生成
+    PREGEN_BUFFER=3             每个会话保持的候选题数量
+    PREGEN_LEAD_SECONDS=120     提前多少秒开始准备
+    PREGEN_POLL_SECONDS=30      检查间隔
+    PREGEN_TOKEN_CAP=60000      每个会话预生成最多消耗的token数
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app import db
+from app.backend import get_backend
+from app.content_store import session_text
+from app.dedup import duplicate_detector
+from app.llm_accounting import CallContext, TokenQuotaExceeded, session_usage
+from app.llm_governor import RateLimitExceeded
+from app.models import Content, Quiz, QuizDraft, Session as PQSession
+from app.token_counter import PromptTooLarge
+
+TICK_KEY = 'pregen:tick'
+LOCK_KEY = 'pregen:lock:{}'
+# 补充任务锁的有效期需长于一次出题调用（quiz_generator 的超时上限为300秒）
+LOCK_TTL = 330
+
+
+def enabled():
+    return os.getenv('PREGEN_ENABLED', '1').lower() in ('1', 'true', 'yes')
+
+
+def buffer_size():
+    return int(os.getenv('PREGEN_BUFFER', 3))
+
+
+def token_cap():
+    return int(os.getenv('PREGEN_TOKEN_CAP', 60000))
+
+
+def draft_info(draft):
+    return {
+        'id': draft.id,
+        'content_id': draft.content_id,
+        'question': draft.question,
+        'option_a': draft.option_a,
+        'option_b': draft.option_b,
+        'option_c': draft.option_c,
+        'option_d': draft.option_d,
+        'correct_answer': draft.correct_answer,
+        'explanation': draft.explanation,
+        'time_limit': draft.time_limit,
+        'created_at': draft.created_at.isoformat()
+    }
+
+
+def ready_drafts(session_id):
+    return QuizDraft.query.filter_by(session_id=session_id, status='ready').order_by(QuizDraft.id).all()
+
+
+def spend_info(session_id):
+    """会话的预生成token消耗"""
+    return {'spent_tokens': session_usage(session_id, 'pregenerate'), 'token_cap': token_cap()}
+
+
+def publish_draft(draft_id, session_id):
+    """
+    把一道候选题发布为题目（调用方负责提交和通知）
+
+    Returns:
+        新建的 Quiz（已 flush，带ID）；候选题不存在或已被发布/丢弃时返回None
+    """
+    # 条件更新保证同一道候选题只能被发布一次
+    claimed = QuizDraft.query.filter_by(id=draft_id, session_id=session_id, status='ready').update(
+        {'status': 'published'}, synchronize_session=False)
+    if not claimed:
+        return None
+    draft = QuizDraft.query.get(draft_id)
+    quiz = Quiz(
+        session_id=session_id,
+        question=draft.question,
+        option_a=draft.option_a,
+        option_b=draft.option_b,
+        option_c=draft.option_c,
+        option_d=draft.option_d,
+        correct_answer=draft.correct_answer,
+        explanation=draft.explanation,
+        time_limit=draft.time_limit,
+        is_active=True
+    )
+    db.session.add(quiz)
+    db.session.flush()
+    draft.quiz_id = quiz.id
+    return quiz
+
+
+class PregenerationScheduler:
+    """后台预生成调度"""
+
+    def __init__(self, app):
+        self.app = app
+        self.poll_seconds = float(os.getenv('PREGEN_POLL_SECONDS', 30))
+        self.lead = timedelta(seconds=float(os.getenv('PREGEN_LEAD_SECONDS', 120)))
+        # 预生成是投机性的工作，单线程执行即可
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pregen')
+        self._thread = threading.Thread(target=self._run, name='pregen-scheduler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            if not get_backend().add(TICK_KEY, 1, ttl=self.poll_seconds):
+                continue  # 本轮已由其他进程检查
+            with self.app.app_context():
+                try:
+                    self.tick()
+                except Exception as e:
+                    print(f"警告：预生成调度检查失败: {e}")
+                finally:
+                    db.session.remove()
+
+    def tick(self):
+        """检查进行中的会话，为需要补充候选题的会话提交任务"""
+        now = datetime.utcnow()
+        ready_counts = dict(db.session.query(QuizDraft.session_id, func.count(QuizDraft.id)).filter(
+            QuizDraft.status == 'ready').group_by(QuizDraft.session_id).all())
+        last_quiz_times = dict(db.session.query(Quiz.session_id, func.max(Quiz.created_at)).group_by(
+            Quiz.session_id).all())
+
+        for session_id, interval, created_at in db.session.query(
+                PQSession.id, PQSession.quiz_interval, PQSession.created_at).filter(PQSession.is_active.is_(True)):
+            missing = buffer_size() - ready_counts.get(session_id, 0)
+            if missing <= 0:
+                continue
+            next_quiz_at = (last_quiz_times.get(session_id) or created_at) + timedelta(minutes=interval or 10)
+            if now < next_quiz_at - self.lead:
+                continue
+            if get_backend().add(LOCK_KEY.format(session_id), 1, ttl=LOCK_TTL):
+                self._executor.submit(self._fill_safely, session_id, missing)
+
+    def _fill_safely(self, session_id, count):
+        with self.app.app_context():
+            try:
+                self.fill(session_id, count)
+            except Exception as e:
+                db.session.rollback()
+                print(f"警告：会话 {session_id} 预生成题目失败: {e}")
+            finally:
+                get_backend().delete(LOCK_KEY.format(session_id))
+                db.session.remove()
+
+    def fill(self, session_id, count):
+        """用会话最近上传的内容生成 count 道候选题"""
+        # 延迟导入，避免与路由模块循环导入
+        from app.routes.quiz import get_quiz_generator
+        from app.quiz_generator import estimate_tokens
+        from app.llm_governor import get_llm_governor
+
+        quiz_generator = get_quiz_generator()
+        if not quiz_generator:
+            return
+        content_id = db.session.query(Content.id).filter_by(session_id=session_id, status='ready').order_by(
+            Content.upload_time.desc(), Content.id.desc()).limit(1).scalar()
+        if content_id is None:
+            return
+        text = session_text(session_id, content_ids=[content_id])
+        if not text.strip():
+            return
+
+        tokens = estimate_tokens(len(text), count)
+        if get_llm_governor().estimate_wait(tokens) > 0:
+            return  # AI服务正忙，不与即时请求抢占
+        if session_usage(session_id, 'pregenerate') + tokens > token_cap():
+            return
+
+        try:
+            quizzes = quiz_generator.generate_quiz(text, count, context=CallContext('pregenerate', session_id))
+        except (RateLimitExceeded, PromptTooLarge, TokenQuotaExceeded) as e:
+            print(f"会话 {session_id} 本轮跳过预生成: {e}")
+            return
+        if not quizzes:
+            return
+
+        # 与已有题目、待发布的候选题以及同批题目比较，重复的丢弃
+        pool = [draft_info(draft) for draft in ready_drafts(session_id)]
+        matches = duplicate_detector.check(session_id, pool + quizzes)[len(pool):]
+        kept = [quiz for quiz, match in zip(quizzes, matches) if match is None]
+
+        for quiz_info in kept:
+            db.session.add(QuizDraft(
+                session_id=session_id,
+                content_id=content_id,
+                question=quiz_info['question'],
+                option_a=quiz_info['option_a'],
+                option_b=quiz_info['option_b'],
+                option_c=quiz_info['option_c'],
+                option_d=quiz_info['option_d'],
+                correct_answer=quiz_info['correct_answer'],
+                explanation=quiz_info.get('explanation', ''),
+                time_limit=quiz_info.get('time_estimate', 30)
+            ))
+        db.session.commit()
+        print(f"会话 {session_id} 预生成 {len(kept)} 道候选题（丢弃重复 {len(quizzes) - len(kept)} 道）")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def init_app(app):
+    """在 create_app 中调用：worker进程收到第一个请求时启动调度线程（不在gunicorn主进程中启动）"""
+    if not enabled():
+        return
+
+    @app.before_request
+    def _start_pregeneration():
+        global _scheduler
+        if _scheduler is None:
+            with _scheduler_lock:
+                if _scheduler is None:
+                    _scheduler = PregenerationScheduler(app)
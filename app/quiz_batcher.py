@@ -0,0 +1,162 @@
+"""
+合并同时到达的小规模出题请求
+
+每次出题调用都带着很长的系统消息和出题要求（见 app/quiz_generator.py），一段短内容出一两道题时，
+这部分固定开销往往比内容本身还多。多位演讲者同时出题、或多文件上传为每个文件分别出题时，
+这里把短时间内到达的小请求合并成一次调用：
+
+- 题目数不超过 LLM_BATCH_MAX_QUESTIONS、内容不超过 LLM_BATCH_MAX_CONTENT_TOKENS 且没有指定
+  延迟目标的请求参与合并；其他请求直接单独调用
+- 第一个到达的请求等待 LLM_BATCH_WINDOW_MS 毫秒（请求数达到 LLM_BATCH_MAX_SOURCES 或题目总数达到
+  LLM_BATCH_MAX_TOTAL_QUESTIONS 时提前结束），然后由它所在的线程发出合并调用，其余请求等待结果
+- 合并调用的提示词把各请求的内容分段列出，要求每道题标明所属的内容段（source），
+  返回后按段拆分给各请求；某个请求缺少的题目由它自己补发请求
+- 窗口内只有一个请求、合并后超出单次调用的输出/上下文上限、或合并调用失败（超时、服务故障等）时，
+  各请求照常单独调用；只有限流排队超时（RateLimitExceeded）直接返回给所有请求
+- 合并调用的token和耗时按各请求的内容和题目数分摊到各自的调用记录（见 app/llm_accounting.py）
+
+合并只在同一进程内进行。
+
+环境变量：
+    LLM_BATCH_WINDOW_MS=200                合并窗口（毫秒），0 表示不合并
+    LLM_BATCH_MAX_SOURCES=4                一次调用最多合并的请求数
+    LLM_BATCH_MAX_QUESTIONS=3              题目数不超过该值的请求才参与合并
+    LLM_BATCH_MAX_CONTENT_TOKENS=4000      内容token数不超过该值的请求才参与合并
+    LLM_BATCH_MAX_TOTAL_QUESTIONS=10       一次合并调用最多的题目数
+"""
+import os
+import threading
+
+from app.backend import get_backend
+from app.llm_governor import RateLimitExceeded
+from app.llm_resilience import METRICS_KEY
+
+
+class BatchRequest:
+    """等待合并的一个出题请求；合并调用结束后设置 questions（及所用的 route）或 error"""
+
+    def __init__(self, content_text, num_questions, content_tokens, context):
+        self.content_text = content_text
+        self.num_questions = num_questions
+        self.content_tokens = content_tokens
+        self.context = context
+        self.questions = None  # 仍为None表示未合并，由请求方单独调用
+        self.route = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Batch:
+    def __init__(self):
+        self.requests = []
+        self.questions = 0
+        self.full = threading.Event()
+
+
+class QuizBatcher:
+    """进程内的出题请求合并"""
+
+    def __init__(self):
+        self.window = float(os.getenv('LLM_BATCH_WINDOW_MS', 200)) / 1000
+        self.max_sources = int(os.getenv('LLM_BATCH_MAX_SOURCES', 4))
+        self.max_questions = int(os.getenv('LLM_BATCH_MAX_QUESTIONS', 3))
+        self.max_content_tokens = int(os.getenv('LLM_BATCH_MAX_CONTENT_TOKENS', 4000))
+        self.max_total_questions = int(os.getenv('LLM_BATCH_MAX_TOTAL_QUESTIONS', 10))
+        self._open = None  # 正在接收请求的批次
+        self._lock = threading.Lock()
+
+    def eligible(self, content_tokens, num_questions, latency_slo=None):
+        """请求是否参与合并（指定了延迟目标的请求不等待）"""
+        return (self.window > 0 and self.max_sources > 1 and latency_slo is None
+                and num_questions <= self.max_questions and content_tokens <= self.max_content_tokens)
+
+    def submit(self, generator, content_text, num_questions, content_tokens, context=None):
+        """
+        加入当前批次并等待合并调用结束
+
+        Returns:
+            BatchRequest：questions 为合并调用中分到的题目，为None时由调用方单独生成
+
+        Raises:
+            RateLimitExceeded: 合并调用排队超时
+            TokenQuotaExceeded: 本请求所属会话的token配额不足
+        """
+        request = BatchRequest(content_text, num_questions, content_tokens, context)
+        with self._lock:
+            batch = self._open
+            if batch is not None and batch.questions + num_questions > self.max_total_questions:
+                self._close(batch)
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            batch.requests.append(request)
+            batch.questions += num_questions
+            if len(batch.requests) >= self.max_sources or batch.questions >= self.max_total_questions:
+                self._close(batch)
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                self._close(batch)
+            self._run(generator, batch.requests)
+        else:
+            request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request
+
+    def _close(self, batch):
+        """停止接收新请求（需持有锁）"""
+        if self._open is batch:
+            self._open = None
+        batch.full.set()
+
+    def _run(self, generator, requests):
+        try:
+            if len(requests) > 1:
+                generator._generate_merged(requests)
+                merged = sum(1 for request in requests if request.questions is not None)
+                if merged:
+                    _count('batched_calls', 1)
+                    _count('batched_requests', merged)
+        except RateLimitExceeded as e:
+            # 单独调用同样需要排队，不再重试
+            for request in requests:
+                if request.questions is None and request.error is None:
+                    request.error = e
+        except Exception as e:
+            # 一次合并调用失败不应连累同批的请求：各自单独调用
+            print(f"⚠️ 合并调用失败，{len(requests)} 个请求改为单独调用: {e}")
+            for request in requests:
+                request.questions = None
+                request.route = None
+        finally:
+            for request in requests:
+                request.done.set()
+
+
+def _count(field, amount):
+    try:
+        get_backend().hincrby(METRICS_KEY, field, amount)
+    except Exception as e:
+        print(f"警告：记录调用指标失败: {e}")
+
+
+def batch_metrics():
+    counters = get_backend().hgetall(METRICS_KEY)
+    return {field: counters.get(field, 0) for field in ('batched_calls', 'batched_requests')}
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_quiz_batcher():
+    """获取进程内的请求合并实例"""
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = QuizBatcher()
+    return _batcher
@@ -0,0 +1,185 @@
+"""
+会话题目缓存
+
+题目创建后基本不会再修改，但听众每次轮询当前题目、提交答案或跳过题目时
+都会按会话重新查询 Quiz 表。这里为每个会话缓存一份按创建时间排序的题目
+快照（纯字典，不持有ORM对象），在题目创建、发布、激活状态变化和删除时
+由调用方显式失效。缓存按会话做LRU淘汰。
+
+多进程部署时每个worker各有一份缓存，失效消息通过共享状态后端
+（app/backend.py）的发布/订阅广播给所有进程。
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from app import db
+from app.backend import get_backend
+from app.models import Quiz
+
+DEFAULT_MAX_SESSIONS = 256
+INVALIDATE_CHANNEL = 'quiz_cache:invalidate'
+
+
+def _snapshot(quiz):
+    """把Quiz对象转换为只读的字典快照"""
+    return {
+        'id': quiz.id,
+        'session_id': quiz.session_id,
+        'question': quiz.question,
+        'option_a': quiz.option_a,
+        'option_b': quiz.option_b,
+        'option_c': quiz.option_c,
+        'option_d': quiz.option_d,
+        'correct_answer': quiz.correct_answer,
+        'explanation': quiz.explanation,
+        'time_limit': quiz.time_limit,
+        'is_active': quiz.is_active,
+        'created_at': quiz.created_at
+    }
+
+
+class SessionQuizzes:
+    """某个会话的有序题目列表及 quiz_id -> 下标 的索引"""
+    __slots__ = ('quizzes', 'positions')
+
+    def __init__(self, quizzes):
+        self.quizzes = quizzes
+        self.positions = {q['id']: i for i, q in enumerate(quizzes)}
+
+    def __len__(self):
+        return len(self.quizzes)
+
+
+class QuizCache:
+    """按会话缓存题目列表的LRU缓存（线程安全）"""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> SessionQuizzes
+        self._quiz_index = {}  # quiz_id -> session_id
+        self._lock = threading.Lock()
+        # 每次失效都会递增，用于丢弃加载期间已经过期的结果
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self._subscribed = False
+
+    def _ensure_subscribed(self):
+        """订阅其他进程发出的失效消息（首次使用缓存时）"""
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        get_backend().subscribe(INVALIDATE_CHANNEL, self._on_invalidate_message)
+
+    def _on_invalidate_message(self, message):
+        session_id = message.get('session_id') if isinstance(message, dict) else None
+        if session_id is None:
+            self.clear()
+        else:
+            self.invalidate(session_id)
+
+    def get_session_quizzes(self, session_id):
+        """获取会话的题目列表（按创建时间升序）"""
+        self._ensure_subscribed()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            epoch = self._epoch
+
+        # 在锁外查询数据库，避免阻塞其他会话的读取
+        quizzes = Quiz.query.filter_by(session_id=session_id).order_by(Quiz.created_at.asc()).all()
+        entry = SessionQuizzes(tuple(_snapshot(q) for q in quizzes))
+
+        with self._lock:
+            # 加载期间发生过失效，结果可能已过期，不写入缓存
+            if epoch == self._epoch:
+                self._store(session_id, entry)
+        return entry
+
+    def get_quiz(self, quiz_id):
+        """
+        按题目ID获取题目快照及其在会话中的位置
+
+        Returns:
+            (quiz, index, entry)，题目不存在时返回 (None, -1, None)
+        """
+        with self._lock:
+            session_id = self._quiz_index.get(quiz_id)
+
+        if session_id is None:
+            session_id = db.session.query(Quiz.session_id).filter_by(id=quiz_id).scalar()
+            if session_id is None:
+                return None, -1, None
+
+        entry = self.get_session_quizzes(session_id)
+        index = entry.positions.get(quiz_id, -1)
+        if index < 0:
+            return None, -1, entry
+        return entry.quizzes[index], index, entry
+
+    def invalidate(self, session_id):
+        """使某个会话的题目缓存失效"""
+        with self._lock:
+            self._epoch += 1
+            self._evict(session_id)
+
+    def clear(self):
+        """清空全部缓存"""
+        with self._lock:
+            self._epoch += 1
+            self._sessions.clear()
+            self._quiz_index.clear()
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def _store(self, session_id, entry):
+        self._evict(session_id)
+        self._sessions[session_id] = entry
+        for quiz_id in entry.positions:
+            self._quiz_index[quiz_id] = session_id
+        while len(self._sessions) > self.max_sessions:
+            oldest_id = next(iter(self._sessions))
+            self._evict(oldest_id)
+
+    def _evict(self, session_id):
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            for quiz_id in entry.positions:
+                self._quiz_index.pop(quiz_id, None)
+
+
+quiz_cache = QuizCache(max_sessions=int(os.getenv('QUIZ_CACHE_MAX_SESSIONS', DEFAULT_MAX_SESSIONS)))
+
+
+def invalidate_session_quizzes(session_id):
+    """题目发生变化后调用：创建、发布、激活/停用、删除"""
+    try:
+        session_id = int(session_id)
+    except (TypeError, ValueError):
+        session_id = None
+
+    # 先失效本进程，再通知其他进程
+    if session_id is None:
+        quiz_cache.clear()
+    else:
+        quiz_cache.invalidate(session_id)
+    try:
+        get_backend().publish(INVALIDATE_CHANNEL, {'session_id': session_id})
+    except Exception as e:
+        print(f"警告：广播题目缓存失效消息失败: {e}")
@@ -1,147 +1,96 @@
 import os
-import json
 import logging
 import asyncio
 import time
-import re
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
+from app.llm_governor import get_llm_governor, RateLimitExceeded
+from app.llm_providers import get_provider_registry
+from app.quiz_batcher import get_quiz_batcher
+from app import summarizer
+from app import token_counter
+from app.token_counter import get_token_counter
+from app.model_router import get_model_router
+from app import quiz_parser
+from app import llm_accounting
 
 # 加载环境变量
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
-class MockQuizGenerator:
-    """
-    模拟题目生成器，用于测试和备用
-    """
-    def __init__(self):
-        pass
-    
-    def generate_quiz(self, text_content: str, num_questions: int = 5) -> List[Dict]:
-        """
-        生成高质量模拟题目
-        """
-        
-        try:
-            # 基于文本内容生成更有深度的模拟题目
-            mock_questions = []
-            
-            # 预设一些极具挑战性的题目模板
-            question_templates = [
-                {
-                    "question": "假设你是一个跨国企业的战略顾问，需要将提供内容中的核心理念整合到一个正面临数字化转型、监管政策变化和全球供应链重构三重挑战的传统制造企业中。在有限的资源预算和18个月的时间窗口内，你如何设计一个既能保持现有业务稳定性，又能实现长期竞争优势的转型策略？考虑到不同利益相关者（股东、员工、客户、监管机构）的期望冲突，你的策略重点应该放在哪个维度？",
-                    "options": [
-                        "优先建立敏捷的组织架构和跨部门协作机制，通过内部能力建设驱动渐进式创新，同时建立风险管控体系应对外部不确定性",
-                        "集中资源进行核心技术突破和产品创新，通过差异化竞争优势抵御市场冲击，延后组织变革以避免内部动荡",
-                        "加快外部合作伙伴关系建设，通过生态系统整合获得快速转型能力，同时保持现有运营模式的稳定性",
-                        "全面推进数字化基础设施建设，以技术升级带动业务流程重组，通过数据驱动决策实现精益运营"
-                    ],
-                    "correct_answer": 0,
-                    "explanation": "在多重挑战和资源约束下，建立敏捷组织架构是最可持续的选择。选项A考虑了内外部平衡、短期稳定与长期发展的权衡，以及风险管控的重要性。选项B过于激进，可能导致资源分散和内部不稳定；选项C依赖外部资源存在控制风险；选项D技术导向忽略了人文因素和组织适应性。"
-                },
-                {
-                    "question": "在一个由多个自主团队组成的复杂项目中，你发现团队间存在信息孤岛、目标冲突和资源竞争问题。基于提供内容的管理理念，如果你需要设计一套既能保持各团队创新活力和自主性，又能确保整体协调和目标一致的治理机制，你会如何平衡集中控制与分散决策之间的张力？特别是当面临紧急情况需要快速响应时，这套机制应该如何动态调整以确保效率和质量？",
-                    "options": [
-                        "建立分层决策矩阵和动态授权机制，通过共享KPI体系和定期协调会议实现软性整合，紧急情况下启动临时指挥结构",
-                        "实施严格的中央集权管理，通过统一的流程标准和绩效考核确保一致性，设立专门的协调部门处理团队间冲突",
-                        "采用完全分散的市场化机制，让团队间通过内部竞争和协商解决冲突，管理层仅提供资源支持和最终仲裁",
-                        "构建基于价值观和文化认同的自组织系统，通过培训和激励机制促进自发协作，减少正式的管理干预"
-                    ],
-                    "correct_answer": 0,
-                    "explanation": "选项A提供了灵活性与控制的最佳平衡。分层决策矩阵保证了不同层级的适当授权，共享KPI确保目标一致，定期协调维持信息流通，临时指挥结构应对紧急情况。选项B过于僵化，抑制创新；选项C可能导致混乱和低效；选项D理想化，缺乏必要的结构支撑。"
-                },
-                {
-                    "question": "考虑一个需要在技术创新、用户体验、商业可持续性和社会责任四个维度间寻求平衡的产品决策场景。基于提供内容的核心观点，当这四个目标之间出现根本性冲突时（例如，最具创新性的技术方案可能损害用户隐私，最佳用户体验可能降低商业盈利，最大社会效益可能增加成本负担），你如何构建一个动态权衡框架来指导决策过程？这个框架应该如何处理不同时间尺度上的价值权衡（短期收益vs长期影响）？",
-                    "options": [
-                        "建立多维价值评估矩阵，结合利益相关者影响分析和时间折现模型，通过情景规划和风险评估确定各维度的动态权重",
-                        "采用层次化决策树，以商业可持续性为核心约束条件，在此基础上优化其他三个维度的组合方案",
-                        "运用德尔菲法收集专家意见，建立固定的权重体系，然后通过标准化评分方法对不同方案进行量化比较",
-                        "实施敏捷试错方法，通过小规模实验快速测试不同权衡方案的效果，根据反馈动态调整优先级"
-                    ],
-                    "correct_answer": 0,
-                    "explanation": "选项A提供了最全面和系统的框架。多维评估矩阵考虑了复杂性，利益相关者分析确保公平性，时间折现处理长短期权衡，情景规划应对不确定性，动态权重保持灵活性。选项B过于简化，可能忽视重要价值；选项C缺乏动态性和情境适应性；选项D虽然灵活但可能缺乏系统性思考。"
-                },
-                {
-                    "question": "在一个快速变化的行业环境中，你负责领导一个跨文化、跨专业的虚拟团队执行一个具有高度不确定性的创新项目。团队成员分布在不同时区，具有不同的工作习惯、沟通风格和风险偏好。基于提供内容的领导力理念，当项目遭遇重大挫折或方向调整时，你如何在维持团队凝聚力和士气的同时，确保快速适应和高质量决策？特别是如何处理团队内部可能出现的文化冲突和专业分歧？",
-                    "options": [
-                        "建立多元化的沟通渠道和文化桥梁机制，通过共同愿景构建和适应性领导风格来统一团队，结合数据驱动决策和集体智慧整合处理分歧",
-                        "实施强势的变革管理，通过明确的指令和严格的执行监控确保团队聚焦，将文化和专业差异视为需要克服的障碍",
-                        "采用完全民主化的决策过程，让所有团队成员平等参与讨论和投票，通过多数原则解决冲突和分歧",
-                        "建立小组轮岗制度，让团队成员体验不同的角色和文化环境，通过相互理解自然化解冲突"
-                    ],
-                    "correct_answer": 0,
-                    "explanation": "选项A体现了复杂环境下的适应性领导。多元化沟通渠道适应虚拟团队特点，文化桥梁机制处理跨文化挑战，共同愿景提供凝聚力，适应性领导应对不确定性，数据驱动确保决策质量。选项B忽视了多元化的价值；选项C可能导致决策低效和质量下降；选项D虽有价值但在紧急情况下不够实用。"
-                }
-            ]
-            
-            for i in range(min(num_questions, len(question_templates))):
-                mock_questions.append(question_templates[i])
-            
-            # 如果需要更多题目，生成额外的超高难度题目
-            if num_questions > len(question_templates):
-                for i in range(num_questions - len(question_templates)):
-                    additional_question = {
-                        "question": f"作为一个面临行业颠覆性变革的组织的高级决策者，你需要基于提供内容的第{i+5}个核心概念，设计一个能够在资源约束、时间压力和利益相关者期望冲突的环境下，既保持组织稳定性又推动战略转型的综合方案。考虑到市场不确定性、技术演进速度和组织变革阻力，你如何构建一个动态适应的实施路径？这个路径应该如何在短期生存需求和长期发展愿景之间找到平衡点，同时应对可能出现的连锁反应和意外挑战？",
-                        "options": [
-                            f"建立双轨并行的组织架构，通过核心业务维稳和创新业务探索的组合，配合渐进式变革管理和持续的风险监控机制",
-                            f"集中资源进行关键能力突破，通过概念{i+5}的深度应用获得竞争优势，延缓非核心领域的变革以控制风险",
-                            f"采用生态系统整合策略，通过外部合作伙伴网络分散风险，同时保持内部组织架构的相对稳定",
-                            f"实施全面数字化转型，以技术创新驱动业务模式重构，通过数据分析和人工智能优化决策过程"
-                        ],
-                        "correct_answer": 0,
-                        "explanation": f"在复杂多变的环境中，双轨并行架构是最能平衡风险与机遇的策略。它既保证了现有业务的稳定现金流，又为未来发展开辟了探索空间。这种方法考虑了组织的适应能力、资源的合理配置、变革的可控性以及对不确定性的应对。其他选项或过于保守、或风险过高、或过度依赖外部因素。"
-                    }
-                    mock_questions.append(additional_question)
-            
-            return mock_questions
-            
-        except Exception as e:
-            logger.error(f"高质量模拟题目生成失败: {e}")
-            return []
+# 部分题目无效或输出被截断时，为缺少的题目补发请求的次数
+FOLLOWUP_ATTEMPTS = 1
+# 补发请求中列出已有题干的长度（避免重复出题）
+EXISTING_STEM_CHARS = 60
+
+# 未经路由时（如估算排队时间）使用的模型，实际调用的模型见 app/model_router.py
+MODEL_NAME = "qwen-plus"
+# 提示词模板和系统消息的大致token数（用于未构建提示词时的估算）
+PROMPT_OVERHEAD_TOKENS = 1500
+
+SYSTEM_MESSAGE = 'You are a world-class expert in advanced educational assessment, specializing in creating extremely challenging questions that test the highest levels of cognitive ability. Your questions require deep analytical thinking, complex reasoning, strategic decision-making, and synthesis of multiple concepts. You create questions that even experts in the field would need to carefully consider. Focus on scenarios that involve multiple competing priorities, ethical dilemmas, strategic trade-offs, and complex real-world applications. Always respond with valid JSON format. IMPORTANT: In explanations, always refer to options using letters (选项A, 选项B, 选项C, 选项D) never use numbers (选项0, 选项1, 选项2, 选项3).'
+
+
+# 出题要求（单独出题和合并出题共用）
+QUESTION_REQUIREMENTS = """高难度出题要求（必须严格遵守）：
+1. 题目必须基于内容进行深度分析和多层推理，挖掘隐含的逻辑关系和深层含义
+2. 题目长度至少4-5句话，包含复杂的背景设定、多重条件限制和层次化的问题陈述
+3. 绝对禁止任何形式的原文摘录，所有选项必须经过复杂推理和综合分析才能得出
+4. 每个选项都要具有高度迷惑性，基于真实的相关概念但存在细微的逻辑错误或适用范围差异
+5. 正确答案序号从0开始（0=选项A，1=选项B，2=选项C，3=选项D），但答案不能过于明显，需要深入思考才能确定
+6. 解释必须详细分析每个选项的逻辑，说明正确答案的深层原因和其他选项的具体错误所在
+7. 题目必须测试高阶认知能力：批判性思维、创新应用、系统分析、战略评估等
+8. 避免所有简单直接的表述，使用复杂的情境假设、多变量分析、跨领域应用等场景
+9. 选项要体现不同的思维路径和解决方案，每个都有其合理性但只有一个最优
+10. 题目应该让即使理解了内容的人也需要仔细思考和分析才能作答
+
+**解释格式要求（重要）：**
+- 在解释中必须使用选项字母标识：选项A、选项B、选项C、选项D
+- 禁止在解释中使用数字序号如选项0、选项1、选项2、选项3
+- 正确的解释格式："选项A提供了最全面的解决方案...选项B虽然考虑了X因素，但忽略了Y...选项C的方法过于激进...选项D缺乏实用性..."
+
+严格要求的题目类型（必须选择）：
+- 多维决策分析题：给出复杂的现实场景，要求权衡多个相互冲突的因素做出最优决策
+- 系统性思维题：分析复杂系统中的相互作用关系，预测干预措施的连锁反应
+- 创新应用题：将理论概念创新性地应用到全新的、跨领域的实际问题中
+- 批判性评估题：深入分析某种方法或理论的适用边界、潜在风险和改进方向
+- 策略优化题：在资源约束和多重目标冲突的情况下设计最优策略
+- 因果链分析题：分析复杂因果关系网络中的关键节点和杠杆点
+- 价值判断题：在价值观冲突的情境下进行道德推理和利益权衡
+
+出题示例思路：
+- 不要问"什么是X"，而要问"在Y情况下，如何运用X原理解决Z问题，同时兼顾A、B、C三个约束条件"
+- 不要问"X有什么特点"，而要问"当X方法在特定环境下失效时，应该如何调整策略以达到预期目标"
+- 不要问"X和Y的区别"，而要问"在面临P问题时，选择X还是Y方法更合适，需要考虑哪些深层因素"
+
+只返回JSON，不要其他文字。确保每道题都需要深度思考和多步推理才能解答。
+"""
+
+
+def estimate_tokens(content_chars: int, num_questions: int = 1) -> int:
+    """按内容字符数估算一次出题调用的token上限（输入 + 最大输出），用于展示排队时间"""
+    max_tokens = token_counter.output_tokens(num_questions, MODEL_NAME)
+    content_tokens = min(int(content_chars * 0.7), token_counter.input_budget(MODEL_NAME, max_tokens))
+    return content_tokens + PROMPT_OVERHEAD_TOKENS + max_tokens
 
 class QuizGenerator:
     def __init__(self):
         # 加载环境变量
         load_dotenv()
         
-        # 配置 Qwen API
-        self.api_key = os.getenv('QWEN_API_KEY')
-        self.use_mock = False
-        self.client = None
-        self.mock_generator = MockQuizGenerator()  # 保留用于内部测试，但不在generate_quiz中使用
-        
-        if not self.api_key:
-            error_msg = "错误: 未找到QWEN_API_KEY环境变量，无法使用AI出题功能。请配置正确的API密钥。"
+        # AI服务提供方（Qwen、备用服务、本地替身服务等）见 app/llm_providers.py
+        providers = get_provider_registry().providers()
+        if not providers:
+            error_msg = "错误: 未配置可用的AI服务提供方，无法使用AI出题功能。请配置 QWEN_API_KEY 或 LLM_PROVIDERS_CONFIG。"
             print(error_msg)
-            self.use_mock = True
             raise Exception(error_msg)
-        else:
-            try:
-                # 使用 OpenAI 兼容的 Qwen API
-                self.client = OpenAI(
-                    api_key=self.api_key,
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                )
-                print("✅ Qwen API 配置成功，已启用高难度AI出题功能")
-            except Exception as e:
-                error_msg = f"错误: Qwen API 配置失败: {e}"
-                print(error_msg)
-                self.use_mock = True
-                self.client = None
-                raise Exception(error_msg)
+        print(f"✅ AI服务提供方配置成功: {[provider.name for provider in providers]}")
     
     
-    async def _generate_with_qwen_async(self, content_text: str, num_questions: int = 1) -> List[Dict]:
-        """
-        使用 Qwen API 异步生成题目（动态超时：75-300秒）
-        """
-        if not self.client:
-            raise Exception("Qwen API 客户端未初始化")
-        
-        # 构建提示词
+    def _build_prompt(self, content_text: str, num_questions: int,
+                      existing_questions: Optional[List[str]] = None) -> str:
+        """构建出题提示词（existing_questions 为补发请求时已有的题干，要求不要重复）"""
         # 对于超长内容，给AI一些处理建议
         content_length = len(content_text)
         content_hint = ""
@@ -153,6 +102,9 @@ class QuizGenerator:
             content_hint = f"\n\n注意：内容非常长（{content_length}字符），请仔细分析全文后，重点关注核心概念、关键定义和重要信息生成高质量题目。"
         elif content_length > 15000:
             content_hint = f"\n\n注意：内容较长（{content_length}字符），请重点关注核心概念和关键信息生成题目。"
+        if existing_questions:
+            content_hint += "\n\n以下题目已经生成，请从不同角度出题，不要重复：\n" + "\n".join(
+                f"- {stem[:EXISTING_STEM_CHARS]}" for stem in existing_questions)
         
         prompt = f"""
 基于以下内容生成 {num_questions} 道高难度、深层思维的选择题。每道题有4个选项，请标明正确答案序号（0-3）和详细解释。
@@ -169,89 +121,74 @@ class QuizGenerator:
     ]
 }}
 
-高难度出题要求（必须严格遵守）：
-1. 题目必须基于内容进行深度分析和多层推理，挖掘隐含的逻辑关系和深层含义
-2. 题目长度至少4-5句话，包含复杂的背景设定、多重条件限制和层次化的问题陈述
-3. 绝对禁止任何形式的原文摘录，所有选项必须经过复杂推理和综合分析才能得出
-4. 每个选项都要具有高度迷惑性，基于真实的相关概念但存在细微的逻辑错误或适用范围差异
-5. 正确答案序号从0开始（0=选项A，1=选项B，2=选项C，3=选项D），但答案不能过于明显，需要深入思考才能确定
-6. 解释必须详细分析每个选项的逻辑，说明正确答案的深层原因和其他选项的具体错误所在
-7. 题目必须测试高阶认知能力：批判性思维、创新应用、系统分析、战略评估等
-8. 避免所有简单直接的表述，使用复杂的情境假设、多变量分析、跨领域应用等场景
-9. 选项要体现不同的思维路径和解决方案，每个都有其合理性但只有一个最优
-10. 题目应该让即使理解了内容的人也需要仔细思考和分析才能作答
+{QUESTION_REQUIREMENTS}
+内容：
+{content_text}{content_hint}
 
-**解释格式要求（重要）：**
-- 在解释中必须使用选项字母标识：选项A、选项B、选项C、选项D
-- 禁止在解释中使用数字序号如选项0、选项1、选项2、选项3
-- 正确的解释格式："选项A提供了最全面的解决方案...选项B虽然考虑了X因素，但忽略了Y...选项C的方法过于激进...选项D缺乏实用性..."
 
-严格要求的题目类型（必须选择）：
-- 多维决策分析题：给出复杂的现实场景，要求权衡多个相互冲突的因素做出最优决策
-- 系统性思维题：分析复杂系统中的相互作用关系，预测干预措施的连锁反应
-- 创新应用题：将理论概念创新性地应用到全新的、跨领域的实际问题中
-- 批判性评估题：深入分析某种方法或理论的适用边界、潜在风险和改进方向
-- 策略优化题：在资源约束和多重目标冲突的情况下设计最优策略
-- 因果链分析题：分析复杂因果关系网络中的关键节点和杠杆点
-- 价值判断题：在价值观冲突的情境下进行道德推理和利益权衡
-
-出题示例思路：
-- 不要问"什么是X"，而要问"在Y情况下，如何运用X原理解决Z问题，同时兼顾A、B、C三个约束条件"
-- 不要问"X有什么特点"，而要问"当X方法在特定环境下失效时，应该如何调整策略以达到预期目标"
-- 不要问"X和Y的区别"，而要问"在面临P问题时，选择X还是Y方法更合适，需要考虑哪些深层因素"
+"""
+        return prompt
+    
+    def _build_merged_prompt(self, requests) -> str:
+        """构建合并出题的提示词：各请求的内容分段列出，题目标明所属的内容段"""
+        total = sum(request.num_questions for request in requests)
+        counts = "\n".join(f"- 内容{i}：{request.num_questions} 道" for i, request in enumerate(requests, 1))
+        sections = "\n\n".join(f"【内容{i}】\n{request.content_text}" for i, request in enumerate(requests, 1))
+        prompt = f"""
+以下有 {len(requests)} 段相互独立的内容，请分别为每段内容生成指定数量的高难度、深层思维的选择题（共 {total} 道）。每道题有4个选项，请标明正确答案序号（0-3）、详细解释，以及题目所依据的内容段编号 source。
+{counts}
+每道题只能基于对应的一段内容，不要混用不同段落的内容。
 
-只返回JSON，不要其他文字。确保每道题都需要深度思考和多步推理才能解答。
+请严格按照以下JSON格式返回：
+{{
+    "questions": [
+        {{
+            "source": 1,
+            "question": "题目内容",
+            "options": ["选项A", "选项B", "选项C", "选项D"],
+            "correct_answer": 0,
+            "explanation": "答案解释"
+        }}
+    ]
+}}
 
-内容：
-{content_text}{content_hint}
+{QUESTION_REQUIREMENTS}
+{sections}
 
 
 """
-        
+        return prompt
+    
+    async def _generate_with_qwen_async(self, prompt: str, num_questions: int, permit=None,
+                                        budget: float = 75.0, max_tokens: int = 4000,
+                                        input_tokens: Optional[int] = None, model: str = MODEL_NAME,
+                                        temperature: float = 0.9) -> List[Dict]:
+        """
+        调用AI服务异步生成题目（动态超时：75-300秒）
+        """
         try:
-            # 计算调试信息
-            content_length = len(content_text)
-            prompt_length = len(prompt)
-            system_msg = 'You are a world-class expert in advanced educational assessment, specializing in creating extremely challenging questions that test the highest levels of cognitive ability. Your questions require deep analytical thinking, complex reasoning, strategic decision-making, and synthesis of multiple concepts. You create questions that even experts in the field would need to carefully consider. Focus on scenarios that involve multiple competing priorities, ethical dilemmas, strategic trade-offs, and complex real-world applications. Always respond with valid JSON format. IMPORTANT: In explanations, always refer to options using letters (选项A, 选项B, 选项C, 选项D) never use numbers (选项0, 选项1, 选项2, 选项3).'
-            system_msg_length = len(system_msg)
-            
-            # 估算token数量 (中文约1.5-2字符=1token，英文约4字符=1token)
-            estimated_input_tokens = int(content_length * 0.6 + prompt_length * 0.6 + system_msg_length * 0.25)
-            
             print(f"🔍 调试信息:")
-            print(f"   📄 输入内容长度: {content_length:,} 字符")
-            print(f"   📝 Prompt长度: {prompt_length:,} 字符") 
-            print(f"   🤖 系统消息长度: {system_msg_length:,} 字符")
-            print(f"   🔢 估算输入Token数: {estimated_input_tokens:,} tokens")
-            print(f"   ⚙️  模型参数: temperature={0.9}, max_tokens={4000}")
+            print(f"   📝 Prompt长度: {len(prompt):,} 字符") 
+            print(f"   🔢 输入Token数: {input_tokens:,} tokens（{get_token_counter().backend}）")
+            print(f"   ⚙️  模型参数: model={model}, temperature={temperature}, max_tokens={max_tokens}")
             print(f"   🎯 请求题目数量: {num_questions}")
             
-            # 使用 Qwen API 生成内容
-            response = self.client.chat.completions.create(
-                model="qwen-plus",  # 使用qwen-plus模型
-                messages=[
-                    {'role': 'system', 'content': system_msg},
-                    {'role': 'user', 'content': prompt}
-                ],
-                temperature=0.9,  # 进一步提高创造性
-                max_tokens=4000,  # 增加token限制以支持更复杂的题目
-                timeout=60.0  # 增加到60秒超时，为整体动态超时留出充分缓冲
-            )
+            # 流式调用，边接收边解析题目；失败时在时间预算内重试或切换提供方（见 app/llm_providers.py）
+            parser, usage = get_provider_registry().complete(
+                SYSTEM_MESSAGE, prompt, model, temperature, max_tokens, num_questions, budget, permit)
             
-            response_text = response.choices[0].message.content
+            response_text = parser.text
             
             # 计算响应信息
-            response_length = len(response_text)
-            estimated_output_tokens = int(response_length * 0.6)  # 估算输出token
+            output_tokens = get_token_counter().count(response_text)
             
-            print(f"✅ Qwen API 调用成功")
-            print(f"   📤 返回内容长度: {response_length:,} 字符")
-            print(f"   🔢 估算输出Token数: {estimated_output_tokens:,} tokens")
-            print(f"   📊 总估算Token消耗: {estimated_input_tokens + estimated_output_tokens:,} tokens")
+            print(f"✅ {getattr(permit, 'provider', None) or 'AI服务'} 调用成功")
+            print(f"   📤 返回内容长度: {len(response_text):,} 字符")
+            print(f"   🔢 输出Token数: {output_tokens:,} tokens")
+            print(f"   📊 总Token消耗: {input_tokens + output_tokens:,} tokens")
             
             # 如果API返回usage信息，打印实际token使用量
-            if hasattr(response, 'usage') and response.usage:
-                usage = response.usage
+            if usage:
                 print(f"   ✨ 实际Token使用量:")
                 if hasattr(usage, 'prompt_tokens'):
                     print(f"      - 输入tokens: {usage.prompt_tokens:,}")
@@ -259,31 +196,206 @@ class QuizGenerator:
                     print(f"      - 输出tokens: {usage.completion_tokens:,}")
                 if hasattr(usage, 'total_tokens'):
                     print(f"      - 总计tokens: {usage.total_tokens:,}")
+                    if permit is not None:
+                        permit.record_usage(usage.total_tokens, getattr(usage, 'prompt_tokens', None),
+                                            getattr(usage, 'completion_tokens', None))
             
-            return self._parse_response(response_text)
+            for error in parser.errors:
+                print(f"      ❌ 第 {error['index'] + 1} 道题目无效，跳过: {error['error']}")
+            if parser.truncated:
+                print(f"   ⚠️  输出在JSON结束前中断，保留已完整的 {len(parser.questions)} 道题目")
+            print(f"   📋 有效题目 {len(parser.questions)}/{num_questions} 道")
+            quiz_parser.record_parse(len(parser.questions), len(parser.errors))
+            return parser.questions
             
         except Exception as e:
-            logger.error(f"Qwen API调用失败: {e}")
+            logger.error(f"AI服务调用失败: {e}")
             raise e
     
-    def generate_quiz(self, content_text: str, num_questions: int = 1) -> List[Dict]:
+    def generate_quiz(self, content_text: str, num_questions: int = 1,
+                      latency_slo: Optional[float] = None,
+                      context: Optional[llm_accounting.CallContext] = None) -> List[Dict]:
         """
         根据内容文本生成选择题（动态超时：75-300秒）
-        强制使用Qwen API，不再使用模拟生成器
         
         Args:
             content_text: 源内容文本
             num_questions: 要生成的题目数量
+            latency_slo: 期望的生成耗时（秒），用于选择模型，默认取路由配置
+            context: 调用来源（会话、用户、用途），用于用量记录和会话配额
             
         Returns:
             包含题目信息的字典列表
+            
+        Raises:
+            RateLimitExceeded: 排队等待超过上限（见 app/llm_governor.py）
+            PromptTooLarge: 压缩后的内容仍超出模型上下文窗口（见 app/token_counter.py）
+            TokenQuotaExceeded: 会话的token配额不足（见 app/llm_accounting.py）
+        """
+        # 检查是否有可用的AI服务提供方
+        if not get_provider_registry().providers():
+            raise Exception("AI服务未配置或不可用，无法生成题目。请检查 QWEN_API_KEY 或 LLM_PROVIDERS_CONFIG 配置。")
+        
+        counter = get_token_counter()
+        content_tokens = counter.count(content_text)
+        system_tokens = counter.count(SYSTEM_MESSAGE)
+        # 小请求与同时到达的其他请求合并为一次调用（见 app/quiz_batcher.py）
+        batcher = get_quiz_batcher()
+        if batcher.eligible(content_tokens, num_questions, latency_slo):
+            request = batcher.submit(self, content_text, num_questions, content_tokens, context)
+            if request.questions is not None:
+                if len(request.questions) >= num_questions:
+                    return request.questions
+                # 合并调用中缺少的题目单独补发
+                return self._generate_batch(content_text, num_questions, request.route, system_tokens,
+                                            context, request.questions)
+        
+        # 按内容规模、题目数和延迟目标选择模型
+        route = get_model_router().choose(content_tokens, num_questions, latency_slo)
+        model = route.model
+        print(f"🧭 使用模型 {model}（{route.reason}）")
+        # 题目数超出单次输出上限时拆成多次调用
+        batches = token_counter.question_batches(num_questions, model)
+        if len(batches) > 1:
+            print(f"📦 {num_questions} 道题超出单次输出上限，分 {len(batches)} 次生成: {batches}")
+        
+        # 内容超出摘要预算或上下文窗口时先在本地抽取关键句，缩短提示词
+        max_tokens = token_counter.output_tokens(batches[0], model)
+        window_budget = (token_counter.input_budget(model, max_tokens) - system_tokens
+                         - counter.count(self._build_prompt('', batches[0])))
+        content_text = self._condense(content_text, window_budget)
+        
+        questions = []
+        for batch_size in batches:
+            questions.extend(self._generate_batch(content_text, batch_size, route, system_tokens, context))
+        return questions
+    
+    def _generate_batch(self, content_text: str, batch_size: int, route, system_tokens: int,
+                        context=None, questions: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        生成一批题目；部分题目无效或输出被截断时，只为缺少的题目补发请求
+        （questions 为合并调用中已分到的题目，此时只补发缺少的题目）
+        """
+        counter = get_token_counter()
+        merged = questions is not None
+        questions = list(questions or [])
+        for attempt in range(1 if merged else 0, 1 + FOLLOWUP_ATTEMPTS):
+            missing = batch_size - len(questions)
+            if missing <= 0:
+                break
+            if attempt:
+                print(f"🔁 有效题目 {len(questions)}/{batch_size} 道，补发请求生成缺少的 {missing} 道")
+                quiz_parser.record_parse(followup=True)
+            prompt = self._build_prompt(content_text, missing, [q['question'] for q in questions])
+            input_tokens = system_tokens + counter.count(prompt)
+            max_tokens = token_counter.output_tokens(missing, route.model)
+            try:
+                llm_accounting.check_quota(context, input_tokens + max_tokens)
+                # 超出窗口的请求在发出前拒绝，不浪费一次往返
+                token_counter.check_fits(route.model, input_tokens, max_tokens)
+                
+                # 所有线程/进程共用的限流和并发上限，排队时间不计入调用超时
+                with get_llm_governor().acquire(input_tokens + max_tokens) as permit:
+                    if permit.waited >= 1:
+                        print(f"⏳ 排队等待 {permit.waited:.1f} 秒后开始调用AI服务")
+                    questions.extend(self._generate_with_timeout(
+                        prompt, len(content_text), missing, permit, max_tokens, input_tokens, route,
+                        context, attempt > 0)[:missing])
+            except llm_accounting.TokenQuotaExceeded as e:
+                # 配额只够首次调用时不再补发，已生成的题目照常返回
+                if not attempt or not questions:
+                    raise
+                print(f"⛔ {e}，停止补发，返回已有的 {len(questions)}/{batch_size} 道题目")
+                return questions
+            except Exception as e:
+                # 补发失败时保留已经解析出的有效题目
+                if not attempt or not questions:
+                    raise
+                print(f"⚠️ 补发请求失败，返回已有的 {len(questions)}/{batch_size} 道题目: {e}")
+                return questions
+        return questions
+    
+    def _generate_merged(self, requests) -> None:
+        """
+        把多个小请求合并为一次调用（由 app/quiz_batcher.py 在发起合并的线程中调用）
+
+        分到题目的请求设置 questions 和 route；配额不足的请求设置 error；
+        合并后超出单次调用上限时不设置，由各请求单独调用。
         """
-        # 检查Qwen API是否可用
-        if self.use_mock or not self.client:
-            raise Exception("Qwen API 未配置或不可用，无法生成题目。请检查 QWEN_API_KEY 环境变量配置。")
+        counter = get_token_counter()
+        system_tokens = counter.count(SYSTEM_MESSAGE)
+        # 配额不足的请求单独失败，不影响同批的其他请求
+        pending = []
+        for request in requests:
+            try:
+                llm_accounting.check_quota(request.context, request.content_tokens + token_counter.output_tokens(
+                    request.num_questions, MODEL_NAME))
+                pending.append(request)
+            except llm_accounting.TokenQuotaExceeded as e:
+                request.error = e
+        if len(pending) < 2:
+            return
+        
+        total = sum(request.num_questions for request in pending)
+        route = get_model_router().choose(sum(request.content_tokens for request in pending), total)
+        prompt = self._build_merged_prompt(pending)
+        input_tokens = system_tokens + counter.count(prompt)
+        max_tokens = token_counter.output_tokens(total, route.model)
+        if (len(token_counter.question_batches(total, route.model)) > 1
+                or input_tokens > token_counter.input_budget(route.model, max_tokens)):
+            return
+        
+        print(f"🧺 合并 {len(pending)} 个出题请求为一次调用（共 {total} 道题），使用模型 {route.model}")
+        # token和耗时按各请求的内容和题目数分摊到各自的调用记录
+        context = llm_accounting.BatchContext(
+            [request.context for request in pending],
+            [request.content_tokens + token_counter.OUTPUT_TOKENS_PER_QUESTION * request.num_questions
+             for request in pending])
+        with get_llm_governor().acquire(input_tokens + max_tokens) as permit:
+            if permit.waited >= 1:
+                print(f"⏳ 排队等待 {permit.waited:.1f} 秒后开始调用AI服务")
+            questions = self._generate_with_timeout(
+                prompt, sum(len(request.content_text) for request in pending), total, permit, max_tokens,
+                input_tokens, route, context)
         
-        # 强制使用真实的 Qwen API (动态超时：75-300秒)
-        print("🔄 正在使用 Qwen API 生成高难度题目...")
+        # 按 source 拆分给各请求，未标明或超出数量的题目丢弃
+        for request in pending:
+            request.questions = []
+            request.route = route
+        for question in questions:
+            source = question.pop('source', None)
+            try:
+                index = int(str(source).replace('内容', '').strip()) - 1
+            except ValueError:
+                continue
+            if not 0 <= index < len(pending):
+                continue
+            request = pending[index]
+            if len(request.questions) < request.num_questions:
+                request.questions.append(question)
+    
+    def _condense(self, content_text: str, window_budget: int) -> str:
+        """抽取式压缩内容（见 app/summarizer.py），失败时使用原文"""
+        budget = summarizer.summary_budget()
+        # 摘要预算为0时不主动压缩，但内容超出上下文窗口时仍需压缩
+        budget = min(budget, window_budget) if budget else window_budget
+        try:
+            condensed, report = summarizer.condense(content_text, budget, get_token_counter().count)
+        except Exception as e:
+            print(f"警告：内容压缩失败，使用原文: {e}")
+            return content_text
+        if report['units_kept'] is not None:
+            print(f"✂️ 内容压缩: {report['original_tokens']:,} -> {report['summary_tokens']:,} tokens"
+                  f"（比例 {report['ratio']}，保留 {report['units_kept']}/{report['units_total']} 句）")
+            summarizer.record_report(report)
+        return condensed
+    
+    def _generate_with_timeout(self, prompt: str, content_length: int, num_questions: int, permit,
+                               max_tokens: int, input_tokens: int, route, context=None,
+                               followup: bool = False) -> List[Dict]:
+        """按内容长度动态设置超时并调用AI服务"""
+        # 动态超时：75-300秒
+        print("🔄 正在调用AI服务生成高难度题目...")
         start_time = time.time()
         
         # 使用异步方式处理超时
@@ -292,7 +404,6 @@ class QuizGenerator:
         
         try:
             # 根据内容长度动态调整超时时间
-            content_length = len(content_text)
             if content_length > 100000:
                 timeout_seconds = 300.0  # 巨型内容使用5分钟超时
                 print(f"📄 检测到巨型内容（{content_length}字符），使用300秒超时...")
@@ -317,146 +428,38 @@ class QuizGenerator:
             # 设置动态超时
             result = loop.run_until_complete(
                 asyncio.wait_for(
-                    self._generate_with_qwen_async(content_text, num_questions),
+                    self._generate_with_qwen_async(prompt, num_questions, permit, timeout_seconds,
+                                                   max_tokens, input_tokens, route.model, route.temperature),
                     timeout=timeout_seconds
                 )
             )
             
             elapsed_time = time.time() - start_time
-            print(f"✅ Qwen API 调用成功，耗时: {elapsed_time:.2f}秒")
+            print(f"✅ AI服务调用成功，耗时: {elapsed_time:.2f}秒")
+            # 耗时计入实际响应的模型：切换到其他提供方/模型（或模板兜底）时不能算作路由所选模型的表现
+            get_model_router().record(permit.model or route.model, elapsed_time, num_questions, True)
+            llm_accounting.record_call(context, route.model, elapsed_time, 'success', permit, followup)
             return result
             
         except asyncio.TimeoutError:
             elapsed_time = time.time() - start_time
-            error_msg = f"Qwen API 调用超时（{elapsed_time:.1f}秒），请稍后重试或检查网络连接。"
+            get_model_router().record(route.model, elapsed_time, num_questions, False)
+            llm_accounting.record_call(context, route.model, elapsed_time, 'timeout', permit, followup)
+            error_msg = f"AI服务调用超时（{elapsed_time:.1f}秒），请稍后重试或检查网络连接。"
             print(f"⏰ {error_msg}")
             raise Exception(error_msg)
             
+        except (RateLimitExceeded, token_counter.PromptTooLarge) as e:
+            print(f"⛔ {e}")
+            raise
+            
         except Exception as e:
-            error_msg = f"Qwen API调用失败: {str(e)}"
+            get_model_router().record(route.model, time.time() - start_time, num_questions, False)
+            llm_accounting.record_call(context, route.model, time.time() - start_time, 'error', permit,
+                                       followup, e)
+            error_msg = f"AI服务调用失败: {str(e)}"
             print(f"❌ {error_msg}")
             raise Exception(error_msg)
             
         finally:
             loop.close()
-
-    
-    def _parse_response(self, response_text: str) -> List[Dict]:
-        """解析 Qwen API 返回的响应"""
-        try:
-            print(f"🔍 开始解析API响应...")
-            print(f"   📄 原始响应长度: {len(response_text):,} 字符")
-            
-            # 清理响应文本
-            cleaned_text = response_text.strip()
-            
-            # 尝试提取JSON部分
-            json_match = re.search(r'```json\s*(.*?)\s*```', cleaned_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1).strip()
-                print(f"   ✅ 在markdown代码块中找到JSON")
-            else:
-                # 寻找花括号包围的JSON
-                brace_match = re.search(r'\{.*\}', cleaned_text, re.DOTALL)
-                if brace_match:
-                    json_str = brace_match.group(0)
-                    print(f"   ✅ 在文本中找到JSON对象")
-                else:
-                    json_str = cleaned_text
-                    print(f"   ⚠️  直接使用原始文本作为JSON")
-            
-            print(f"   📝 提取的JSON长度: {len(json_str):,} 字符")
-            
-            # 解析JSON
-            data = json.loads(json_str)
-            print(f"   ✅ JSON解析成功")
-            
-            # 确保返回的是新格式的题目列表
-            if isinstance(data, dict) and 'questions' in data:
-                questions = data['questions']
-                print(f"   📋 发现questions字段，包含 {len(questions)} 道题目")
-            elif isinstance(data, list):
-                questions = data
-                print(f"   📋 直接发现题目列表，包含 {len(questions)} 道题目")
-            else:
-                raise ValueError("响应格式不正确")
-            
-            print(f"   🔍 开始验证和格式化题目...")
-            
-            # 转换为统一格式，符合数据库模型要求
-            result = []
-            for i, q in enumerate(questions):
-                print(f"   📝 处理第 {i+1} 道题目...")
-                if isinstance(q, dict) and 'question' in q:
-                    # 获取选项列表
-                    options = q.get('options', [])
-                    if not isinstance(options, list):
-                        options = [
-                            q.get('option_a', '选项A'),
-                            q.get('option_b', '选项B'),
-                            q.get('option_c', '选项C'),
-                            q.get('option_d', '选项D')
-                        ]
-                    
-                    # 确保有4个选项
-                    while len(options) < 4:
-                        options.append(f"选项{len(options)+1}")
-                    
-                    # 获取正确答案并转换为字母格式
-                    correct_answer_num = q.get('correct_answer', 0)
-                    if isinstance(correct_answer_num, str):
-                        # 如果已经是字母格式，直接使用
-                        correct_answer_letter = correct_answer_num.upper()
-                    else:
-                        # 如果是数字格式，转换为字母
-                        answer_map = {0: 'A', 1: 'B', 2: 'C', 3: 'D'}
-                        correct_answer_letter = answer_map.get(correct_answer_num, 'A')
-                    
-                    formatted_q = {
-                        'question': q.get('question', ''),
-                        'option_a': options[0] if len(options) > 0 else '选项A',
-                        'option_b': options[1] if len(options) > 1 else '选项B',
-                        'option_c': options[2] if len(options) > 2 else '选项C',
-                        'option_d': options[3] if len(options) > 3 else '选项D',
-                        'correct_answer': correct_answer_letter,
-                        'explanation': q.get('explanation', ''),
-                        'difficulty': q.get('difficulty', 'medium'),
-                        'time_estimate': q.get('time_estimate', 20)
-                    }
-                    
-                    # 验证题目内容
-                    question_len = len(formatted_q['question'])
-                    explanation_len = len(formatted_q['explanation'])
-                    
-                    print(f"      - 题目长度: {question_len} 字符")
-                    print(f"      - 选项数量: 4")
-                    print(f"      - 正确答案: {correct_answer_letter}")
-                    print(f"      - 解释长度: {explanation_len} 字符")
-                    
-                    result.append(formatted_q)
-                    print(f"      ✅ 第 {i+1} 道题目处理完成")
-                else:
-                    print(f"      ❌ 第 {i+1} 道题目格式错误，跳过")
-            
-            if not result:
-                raise ValueError("未能解析出有效题目")
-                
-            total_questions = len(result)
-            avg_question_length = sum(len(q['question']) for q in result) / total_questions if total_questions > 0 else 0
-            avg_explanation_length = sum(len(q['explanation']) for q in result) / total_questions if total_questions > 0 else 0
-            
-            print(f"📊 解析完成统计:")
-            print(f"   ✅ 成功解析 {total_questions} 道题目")
-            print(f"   📏 平均题目长度: {avg_question_length:.1f} 字符")
-            print(f"   📝 平均解释长度: {avg_explanation_length:.1f} 字符")
-            
-            return result
-            
-        except json.JSONDecodeError as e:
-            print(f"❌ JSON解析失败: {e}")
-            print(f"原始响应前200字符: {response_text[:200]}...")
-            return []
-        except Exception as e:
-            print(f"❌ 解析AI响应失败: {e}")
-            print(f"原始响应前200字符: {response_text[:200]}...")
-            return []
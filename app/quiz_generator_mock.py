@@ -79,6 +79,7 @@ class MockQuizGenerator:
     def _generate_from_template(self, template: Dict, keywords: Dict, index: int) -> Dict:
         """根据模板和关键词生成题目"""
         quiz = template.copy()
+        quiz["options"] = dict(template["options"])  # 不要改动共用的模板
         
         
         # 替换模板中的占位符
@@ -0,0 +1,186 @@
+"""
+大模型输出的增量解析与题目校验
+
+原来的解析先用正则找出整段JSON再一次性 json.loads，只要有一道题格式有误（或输出被截断），
+整批题目都被丢弃，只能全部重新生成。这里改为逐道题解析：
+
+- IncrementalQuestionParser 按字符跟踪字符串/转义状态和括号层级，流式输出每收到一段就继续扫描，
+  数组中的一个对象一闭合就单独解析并校验，不等待整个响应结束
+- 单个对象解析失败时尝试去掉多余的尾逗号；仍然失败或校验不通过的只丢弃这一道题
+- 输出被截断时，已经完整的题目照常保留
+
+校验规则（validate_question）：题干非空；恰好4个非空选项（options 列表或 option_a..option_d）；
+正确答案为 0-3 或 A-D。通过校验的题目转换为数据库使用的格式（合并出题时保留内容段编号 source）。
+"""
+import json
+import re
+
+from app.backend import get_backend
+from app.llm_resilience import METRICS_KEY
+
+ANSWER_LETTERS = 'ABCD'
+DEFAULT_TIME_ESTIMATE = 20
+
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+
+
+class InvalidQuestion(ValueError):
+    """题目对象不符合要求"""
+
+
+def _answer_letter(value):
+    if isinstance(value, bool):
+        raise InvalidQuestion(f"正确答案无效: {value!r}")
+    if isinstance(value, int) and 0 <= value < 4:
+        return ANSWER_LETTERS[value]
+    if isinstance(value, str):
+        value = value.strip().upper().replace('选项', '')
+        if value in ANSWER_LETTERS and value:
+            return value
+        if value.isdigit() and 0 <= int(value) < 4:
+            return ANSWER_LETTERS[int(value)]
+    raise InvalidQuestion(f"正确答案无效: {value!r}")
+
+
+def validate_question(obj):
+    """
+    校验一道题目并转换为数据库格式
+
+    Raises:
+        InvalidQuestion: 缺少题干、选项不是4个非空字符串、正确答案无效
+    """
+    if not isinstance(obj, dict):
+        raise InvalidQuestion('题目不是JSON对象')
+    question = obj.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise InvalidQuestion('缺少题干')
+
+    options = obj.get('options')
+    if options is None:
+        options = [obj.get(f'option_{letter}') for letter in 'abcd']
+    if not isinstance(options, list) or len(options) != 4:
+        raise InvalidQuestion('选项数量不是4个')
+    if not all(isinstance(option, str) and option.strip() for option in options):
+        raise InvalidQuestion('存在空选项')
+
+    explanation = obj.get('explanation', '')
+    time_estimate = obj.get('time_estimate', DEFAULT_TIME_ESTIMATE)
+    result = {
+        'question': question.strip(),
+        'option_a': options[0].strip(),
+        'option_b': options[1].strip(),
+        'option_c': options[2].strip(),
+        'option_d': options[3].strip(),
+        'correct_answer': _answer_letter(obj.get('correct_answer')),
+        'explanation': explanation if isinstance(explanation, str) else str(explanation),
+        'difficulty': obj.get('difficulty', 'medium'),
+        'time_estimate': time_estimate if isinstance(time_estimate, int) and time_estimate > 0
+        else DEFAULT_TIME_ESTIMATE
+    }
+    if 'source' in obj:
+        result['source'] = obj['source']  # 合并出题时题目所属的内容段（见 app/quiz_batcher.py）
+    return result
+
+
+class IncrementalQuestionParser:
+    """
+    从（可能分段到达、可能夹杂说明文字或被截断的）输出中逐个取出题目对象
+
+    用法：每收到一段文本调用 feed()，返回本段中新完成的有效题目；全部结束后 questions 为所有有效题目，
+    errors 为被丢弃的题目及原因。
+    """
+
+    def __init__(self):
+        self.questions = []
+        self.errors = []
+        self.text = ''
+        self._pos = 0  # 已扫描到的位置
+        self._started = False
+        self._stack = []  # 未闭合的 { 和 [
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None  # 当前题目对象在文本中的起始位置
+        self._object_depth = 0
+
+    def feed(self, chunk):
+        """追加一段输出，返回其中新解析出的有效题目"""
+        if not chunk:
+            return []
+        self.text += chunk
+
+        found = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if not self._started:
+                # 跳过JSON之前的说明文字和 ```json 标记
+                if char not in '{[':
+                    continue
+                self._started = True
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in '{[':
+                # 直接位于数组中的对象视为一道题
+                if char == '{' and self._stack and self._stack[-1] == '[' and self._object_start is None:
+                    self._object_start = pos
+                    self._object_depth = len(self._stack)
+                self._stack.append(char)
+            elif char in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if char == '}' and self._object_start is not None and len(self._stack) == self._object_depth:
+                    question = self._accept(text[self._object_start:pos + 1])
+                    if question is not None:
+                        found.append(question)
+                    self._object_start = None
+        self._pos = len(text)
+        return found
+
+    def _accept(self, raw):
+        try:
+            try:
+                obj = json.loads(raw)
+            except json.JSONDecodeError:
+                obj = json.loads(_TRAILING_COMMA_RE.sub(r'\1', raw))
+            question = validate_question(obj)
+        except (json.JSONDecodeError, InvalidQuestion) as e:
+            self.errors.append({'index': len(self.questions) + len(self.errors), 'error': str(e)})
+            return None
+        self.questions.append(question)
+        return question
+
+    @property
+    def truncated(self):
+        """输出在JSON结束之前中断"""
+        return self._started and bool(self._stack)
+
+
+def parse_questions(text):
+    """一次性解析完整输出，返回 (有效题目, 被丢弃的题目)"""
+    parser = IncrementalQuestionParser()
+    parser.feed(text)
+    return parser.questions, parser.errors
+
+
+def record_parse(valid=0, invalid=0, followup=False):
+    """把解析结果（及补发请求次数）累加到调用指标中"""
+    backend = get_backend()
+    if valid:
+        backend.hincrby(METRICS_KEY, 'parsed_questions', valid)
+    if invalid:
+        backend.hincrby(METRICS_KEY, 'invalid_questions', invalid)
+    if followup:
+        backend.hincrby(METRICS_KEY, 'followup_calls', 1)
+
+
+def parse_metrics():
+    counters = get_backend().hgetall(METRICS_KEY)
+    return {field: counters.get(field, 0) for field in ('parsed_questions', 'invalid_questions', 'followup_calls')}
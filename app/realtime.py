@@ -0,0 +1,270 @@
+"""
+会话实时通道（WebSocket）
+
+每个会话是一个房间：
+- 演讲者/组织者通过WebSocket激活题目，房间内所有客户端立即收到 quiz_activated
+- 听众通过同一连接提交答案、发布讨论，不再为每次操作单独发HTTP请求
+- 选项分布由 app/live_stats.py 增量计数，按最大频率合并后推送给订阅了统计的演讲者
+
+连接地址：/ws/session/<session_id>
+消息均为JSON，客户端发送 {"type": ..., "request_id": ...}，服务端回复同一个 request_id。
+
+多进程部署时，房间事件通过共享状态后端（app/backend.py）的发布/订阅
+转发到所有worker，再由各进程推送给本进程内的连接。
+"""
+import json
+import threading
+from collections import defaultdict
+
+from flask import session as flask_session
+from app import db
+from app.backend import get_backend
+from app.live_stats import live_histogram, HistogramBroadcaster
+from app.models import Session as PQSession, SessionParticipant, Quiz
+
+# 可选导入 - 未安装flask-sock时前端会自动回退为HTTP轮询
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    FLASK_SOCK_AVAILABLE = True
+except ImportError:
+    FLASK_SOCK_AVAILABLE = False
+    Sock = None
+    ConnectionClosed = Exception
+
+ROOM_CHANNEL = 'realtime:room'
+
+sock = Sock() if FLASK_SOCK_AVAILABLE else None
+_app = None
+
+
+class LiveConnection:
+    """一个WebSocket连接，发送操作加锁以便多个线程安全推送"""
+
+    def __init__(self, ws, user_id, role):
+        self.ws = ws
+        self.user_id = user_id
+        self.role = role  # presenter（演讲者/组织者）或 listener
+        self.topics = set()  # 额外订阅的主题，如 stats
+        self._send_lock = threading.Lock()
+
+    def send(self, event):
+        try:
+            with self._send_lock:
+                self.ws.send(json.dumps(event, ensure_ascii=False))
+            return True
+        except Exception:
+            return False
+
+
+class RoomManager:
+    """本进程内的房间成员管理，跨进程广播走共享状态后端"""
+
+    def __init__(self):
+        self._rooms = defaultdict(set)
+        self._lock = threading.Lock()
+        self._subscribed = False
+
+    def join(self, session_id, conn):
+        self._ensure_subscribed()
+        with self._lock:
+            self._rooms[session_id].add(conn)
+
+    def leave(self, session_id, conn):
+        with self._lock:
+            members = self._rooms.get(session_id)
+            if members is not None:
+                members.discard(conn)
+                if not members:
+                    del self._rooms[session_id]
+
+    def member_count(self, session_id):
+        with self._lock:
+            return len(self._rooms.get(session_id, ()))
+
+    def broadcast(self, session_id, event, roles=None, topic=None):
+        """向房间广播事件（所有进程）；指定topic时只推送给订阅了该主题的连接"""
+        message = {'session_id': int(session_id), 'event': event,
+                   'roles': list(roles) if roles else None, 'topic': topic}
+        try:
+            get_backend().publish(ROOM_CHANNEL, message)
+        except Exception as e:
+            print(f"警告：广播房间事件失败: {e}")
+
+    def deliver(self, session_id, event, roles=None, topic=None):
+        """推送给本进程内的房间成员"""
+        with self._lock:
+            members = list(self._rooms.get(session_id, ()))
+        dead = []
+        for conn in members:
+            if roles and conn.role not in roles:
+                continue
+            if topic and topic not in conn.topics:
+                continue
+            if not conn.send(event):
+                dead.append(conn)
+        for conn in dead:
+            self.leave(session_id, conn)
+
+    def _ensure_subscribed(self):
+        if self._subscribed:
+            return
+        with self._lock:
+            if self._subscribed:
+                return
+            self._subscribed = True
+        get_backend().subscribe(ROOM_CHANNEL, self._on_message)
+
+    def _on_message(self, message):
+        if not isinstance(message, dict) or 'session_id' not in message:
+            return
+        self.deliver(message['session_id'], message.get('event'), message.get('roles'), message.get('topic'))
+
+
+room_manager = RoomManager()
+# 选项分布只推送给订阅了 stats 主题的连接（演讲者端）
+stats_broadcaster = HistogramBroadcaster(
+    live_histogram,
+    lambda session_id, event: room_manager.broadcast(session_id, event, topic='stats')
+)
+
+
+def init_app(app):
+    """在 create_app 中调用，注册WebSocket路由"""
+    global _app
+    _app = app
+    if not FLASK_SOCK_AVAILABLE:
+        print("警告：未安装flask-sock，实时通道不可用，前端将使用HTTP轮询")
+        return
+    sock.init_app(app)
+
+
+# ---- 供HTTP接口调用的通知函数（未安装flask-sock时同样安全） ----
+
+def notify_quiz_activated(session_id, quiz_info):
+    """题目被激活/发布"""
+    room_manager.broadcast(session_id, {'type': 'quiz_activated', 'quiz': quiz_info})
+
+
+def notify_answer(session_id, quiz_id, answer, response_id):
+    """有新的答案（已提交到数据库）：累加计数，并标记该题需要广播"""
+    try:
+        live_histogram.record(int(quiz_id), answer, response_id)
+    except Exception as e:
+        print(f"警告：更新题目 {quiz_id} 的实时统计失败: {e}")
+        return
+    stats_broadcaster.mark(int(session_id), int(quiz_id))
+
+
+def notify_discussion(session_id, discussion_info):
+    """有新的讨论消息"""
+    room_manager.broadcast(session_id, {'type': 'discussion', 'discussion': discussion_info})
+
+
+def notify_content_status(session_id, status_info):
+    """上传内容的后台提取状态变化（只推送给演讲者/组织者）"""
+    room_manager.broadcast(session_id, {'type': 'content_status', 'content': status_info}, roles=['presenter'])
+
+
+# ---- WebSocket 处理 ----
+
+def _room_role(pq_session, user_id):
+    """返回用户在房间中的角色，没有权限时返回None"""
+    if pq_session.speaker_id == user_id or pq_session.organizer_id == user_id:
+        return 'presenter'
+    participant = SessionParticipant.query.filter_by(session_id=pq_session.id, user_id=user_id).first()
+    return 'listener' if participant else None
+
+
+def _handle_message(session_id, conn, raw):
+    """处理客户端发来的一条消息，返回要回复的事件"""
+    # 延迟导入，避免与路由模块循环导入
+    from app.routes.quiz import record_answer, create_discussion, activate_quiz_for_user
+
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return {'type': 'error', 'error': '消息格式错误'}
+    if not isinstance(data, dict):
+        return {'type': 'error', 'error': '消息格式错误'}
+
+    msg_type = data.get('type')
+    request_id = data.get('request_id')
+
+    if msg_type == 'ping':
+        return {'type': 'pong', 'request_id': request_id}
+
+    if msg_type == 'subscribe_stats':
+        if conn.role != 'presenter':
+            return {'type': 'error', 'request_id': request_id, 'error': '权限不足'}
+        conn.topics.add('stats')
+        return {'type': 'subscribe_stats_result', 'request_id': request_id, 'status': 200, 'data': {'topic': 'stats'}}
+
+    if msg_type in ('answer', 'discussion', 'activate'):
+        # 只能操作本房间所属会话的题目
+        quiz_id = data.get('quiz_id')
+        quiz_session_id = None
+        if isinstance(quiz_id, int) or (isinstance(quiz_id, str) and quiz_id.isdigit()):
+            quiz_session_id = db.session.query(Quiz.session_id).filter_by(id=int(quiz_id)).scalar()
+        if quiz_session_id is None:
+            return {'type': f'{msg_type}_result', 'request_id': request_id, 'status': 404,
+                    'data': {'error': '题目不存在'}}
+        if quiz_session_id != session_id:
+            return {'type': f'{msg_type}_result', 'request_id': request_id, 'status': 403,
+                    'data': {'error': '题目不属于当前会话'}}
+
+    if msg_type == 'answer':
+        result, status = record_answer(conn.user_id, data.get('quiz_id'), data.get('answer'),
+                                       data.get('answer_duration'))
+    elif msg_type == 'discussion':
+        result, status = create_discussion(data.get('quiz_id'), conn.user_id, (data.get('message') or '').strip())
+    elif msg_type == 'activate':
+        if conn.role != 'presenter':
+            result, status = {'error': '权限不足'}, 403
+        else:
+            result, status = activate_quiz_for_user(data.get('quiz_id'), conn.user_id)
+    else:
+        return {'type': 'error', 'request_id': request_id, 'error': f'未知的消息类型: {msg_type}'}
+
+    return {'type': f'{msg_type}_result', 'request_id': request_id, 'status': status, 'data': result}
+
+
+if FLASK_SOCK_AVAILABLE:
+    @sock.route('/ws/session/<int:session_id>')
+    def session_socket(ws, session_id):
+        """会话房间的WebSocket连接"""
+        user_id = flask_session.get('user_id')
+        if not user_id:
+            ws.close(reason=1008, message='未登录')
+            return
+
+        pq_session = PQSession.query.get(session_id)
+        role = _room_role(pq_session, user_id) if pq_session else None
+        db.session.remove()
+        if role is None:
+            ws.close(reason=1008, message='无权加入该会话')
+            return
+
+        conn = LiveConnection(ws, user_id, role)
+        room_manager.join(session_id, conn)
+        conn.send({'type': 'welcome', 'session_id': session_id, 'role': role})
+
+        try:
+            while True:
+                raw = ws.receive()
+                if raw is None:
+                    break
+                try:
+                    reply = _handle_message(session_id, conn, raw)
+                except Exception as e:
+                    db.session.rollback()
+                    reply = {'type': 'error', 'error': f'处理消息失败: {str(e)}'}
+                finally:
+                    # 长连接期间不占用数据库连接
+                    db.session.remove()
+                if reply:
+                    conn.send(reply)
+        except ConnectionClosed:
+            pass
+        finally:
+            room_manager.leave(session_id, conn)
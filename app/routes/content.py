@@ -2,8 +2,11 @@ from flask import Blueprint, request, jsonify, session, current_app
 from werkzeug.utils import secure_filename
 import os
 from app import db
-from app.models import Content, Session as PQSession
+from sqlalchemy.orm import defer
+from app.models import Content, ContentSegment, Session as PQSession
 from app.routes.auth import require_auth
+from app import extraction_worker
+from app.content_store import save_segments, content_summaries
 
 content_bp = Blueprint('content', __name__)
 
@@ -91,35 +94,30 @@ def upload_content():
             # 保存文件
             file.save(file_path)
             
-            # 处理文件并提取文本
-            file_processor = get_file_processor()
-            if file_processor:
-                extracted_text = file_processor.process_file(file_path, content_type)
-            else:
-                extracted_text = f"[文件上传成功，但文件处理器不可用 - 文件类型: {content_type}]"
-            
-            # 保存到数据库
+            # 先保存记录，文本提取在后台进行
             content = Content(
                 session_id=session_id,
                 content_type=content_type,
                 original_filename=filename,
                 file_path=file_path,
-                extracted_text=extracted_text
+                status='pending'
             )
             
             db.session.add(content)
             db.session.commit()
             
+            extraction_worker.submit(current_app._get_current_object(), content.id)
+            
             return jsonify({
-                'message': '文件上传成功',
+                'message': '文件上传成功，正在后台提取内容',
                 'content': {
                     'id': content.id,
                     'filename': filename,
                     'content_type': content_type,
-                    'text_length': len(extracted_text),
+                    'status': content.status,
                     'upload_time': content.upload_time.isoformat()
                 }
-            })
+            }), 202
             
         except Exception as e:
             db.session.rollback()
@@ -157,11 +155,13 @@ def upload_text():
         content = Content(
             session_id=session_id,
             content_type='text',
-            original_filename='直接输入文本',
-            extracted_text=text_content
+            original_filename='直接输入文本'
         )
         
         db.session.add(content)
+        db.session.flush()
+        from app.file_processor import split_text_segments
+        save_segments(content, split_text_segments(text_content))
         db.session.commit()
         
         return jsonify({
@@ -186,18 +186,26 @@ def get_session_content(session_id):
     if not pq_session:
         return jsonify({'error': '会话不存在'}), 404
     
-    # 获取所有内容
-    contents = Content.query.filter_by(session_id=session_id).order_by(Content.upload_time).all()
+    # 获取所有内容（不加载完整文本，长度和预览从片段表读取）
+    contents = Content.query.options(defer(Content.extracted_text)).filter_by(
+        session_id=session_id
+    ).order_by(Content.upload_time).all()
+    summaries = content_summaries([content.id for content in contents])
     
     content_list = []
     for content in contents:
+        summary = summaries.get(content.id, {})
         content_list.append({
             'id': content.id,
             'content_type': content.content_type,
             'original_filename': content.original_filename,
-            'text_length': len(content.extracted_text) if content.extracted_text else 0,
+            'text_length': summary.get('text_length', 0),
+            'segment_count': summary.get('segment_count', 0),
             'upload_time': content.upload_time.isoformat(),
-            'text_preview': content.extracted_text[:200] + '...' if content.extracted_text and len(content.extracted_text) > 200 else content.extracted_text
+            'text_preview': summary.get('text_preview'),
+            'status': content.status,
+            'stage': content.stage,
+            'error': content.error
         })
     
     return jsonify({
@@ -223,6 +231,56 @@ def get_content(content_id):
         'upload_time': content.upload_time.isoformat()
     })
 
+@content_bp.route('/<int:content_id>/status', methods=['GET'])
+@require_auth
+def get_content_status(content_id):
+    """获取内容的后台提取状态"""
+    content = Content.query.get(content_id)
+    if not content:
+        return jsonify({'error': '内容不存在'}), 404
+    
+    status = extraction_worker.status_info(content)
+    status['text_length'] = content.text_length or 0
+    return jsonify(status)
+
+@content_bp.route('/<int:content_id>/segments', methods=['GET'])
+@require_auth
+def get_content_segments(content_id):
+    """获取内容的片段列表（按页/幻灯片），可用 ?pages=1,2,3 筛选，?include_text=0 只返回元数据"""
+    content = Content.query.options(defer(Content.extracted_text)).get(content_id)
+    if not content:
+        return jsonify({'error': '内容不存在'}), 404
+    
+    include_text = request.args.get('include_text', '1') != '0'
+    query = ContentSegment.query.filter_by(content_id=content_id)
+    pages = request.args.get('pages')
+    if pages:
+        try:
+            query = query.filter(ContentSegment.page_number.in_([int(p) for p in pages.split(',') if p.strip()]))
+        except ValueError:
+            return jsonify({'error': '页码格式错误'}), 400
+    if not include_text:
+        query = query.options(defer(ContentSegment.text))
+    
+    segments = []
+    for segment in query.order_by(ContentSegment.seq):
+        item = {
+            'seq': segment.seq,
+            'page_number': segment.page_number,
+            'source_kind': segment.source_kind,
+            'char_start': segment.char_start,
+            'char_end': segment.char_end
+        }
+        if include_text:
+            item['text'] = segment.text
+        segments.append(item)
+    
+    return jsonify({
+        'content_id': content_id,
+        'segments': segments,
+        'total_segments': len(segments)
+    })
+
 @content_bp.route('/<int:content_id>', methods=['DELETE'])
 @require_auth
 def delete_content(content_id):
@@ -1,12 +1,24 @@
 from flask import Blueprint, request, jsonify, session, current_app
 from app import db
-from app.models import Quiz, QuizResponse, QuizDiscussion, Content, Session as PQSession, Feedback, UserQuizProgress, User, SessionParticipant
+from app.models import Quiz, QuizResponse, QuizDiscussion, QuizDraft, Content, Session as PQSession, Feedback, UserQuizProgress, User, SessionParticipant
 from app.routes.auth import require_auth
+from app.quiz_cache import quiz_cache, invalidate_session_quizzes
+from app.content_store import session_text
+from app.dedup import filter_duplicates
+from app import pregeneration
+from app.llm_governor import get_llm_governor, RateLimitExceeded
+from app.token_counter import PromptTooLarge
+from app.llm_accounting import CallContext, TokenQuotaExceeded
+from app import realtime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import random
 
 quiz_bp = Blueprint('quiz', __name__)
 
+# 多文件上传时同时为多少个文件生成题目
+MAX_PARALLEL_FILES = 4
+
 # 延迟导入测验生成器以避免依赖问题
 _quiz_generator = None
 
@@ -22,6 +34,71 @@ def get_quiz_generator():
             _quiz_generator = False
     return _quiz_generator if _quiz_generator is not False else None
 
+def rate_limited_response(error, **extra):
+    """AI服务排队超时或熔断：返回429/503和预计等待时间"""
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after, **extra})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status
+
+def quota_exceeded_response(error, **extra):
+    """会话的AI出题token配额不足"""
+    return jsonify({'error': str(error), 'used_tokens': error.used, 'token_quota': error.quota, **extra}), error.status
+
+def text_selection(data):
+    """
+    校验出题范围参数（见 content_store.session_text）
+
+    Raises:
+        ValueError: content_ids/pages 不是整数列表、source_kinds 不是字符串列表、max_chars 不是正整数
+    """
+    def int_list(name):
+        value = data.get(name)
+        if value is None:
+            return None
+        if not isinstance(value, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in value):
+            raise ValueError(f'{name} 必须是整数列表')
+        return value
+    
+    source_kinds = data.get('source_kinds')
+    if source_kinds is not None and (
+            not isinstance(source_kinds, list) or not all(isinstance(v, str) for v in source_kinds)):
+        raise ValueError('source_kinds 必须是字符串列表')
+    max_chars = data.get('max_chars')
+    # session_text 把 max_chars 为0视为不限制，这里要求至少为1，避免“0个字符”返回全文
+    if max_chars is not None and (not isinstance(max_chars, int) or isinstance(max_chars, bool) or max_chars < 1):
+        raise ValueError('max_chars 必须是正整数')
+    return {
+        'content_ids': int_list('content_ids'),
+        'pages': int_list('pages'),
+        'source_kinds': source_kinds,
+        'max_chars': max_chars
+    }
+
+@quiz_bp.route('/ai-capacity', methods=['GET'])
+@require_auth
+def get_ai_capacity():
+    """AI出题排队情况和预计等待时间（content_length 为待出题文本长度，num_questions 为题目数）"""
+    if not get_quiz_generator():
+        return jsonify({'error': 'AI服务暂时不可用'}), 503
+    from app.quiz_generator import estimate_tokens
+    content_length = request.args.get('content_length', 10000, type=int)
+    num_questions = request.args.get('num_questions', 1, type=int)
+    return jsonify(get_llm_governor().status(estimate_tokens(max(0, content_length), max(1, num_questions))))
+
+@quiz_bp.route('/ai-metrics', methods=['GET'])
+@require_auth
+def get_ai_metrics():
+    """AI调用的重试、对冲、熔断、提供方健康、请求合并、提示词压缩、模型路由及输出解析指标"""
+    from app.llm_resilience import call_counters
+    from app.quiz_batcher import batch_metrics
+    from app.llm_providers import get_provider_registry
+    from app.summarizer import compression_metrics
+    from app.model_router import get_model_router
+    from app.quiz_parser import parse_metrics
+    return jsonify({'counters': call_counters(), 'providers': get_provider_registry().metrics(),
+                    'batching': batch_metrics(), 'compression': compression_metrics(), 'routing': get_model_router().metrics(),
+                    'parsing': parse_metrics()})
+
 @quiz_bp.route('/generate', methods=['POST'])
 @require_auth
 def generate_quiz():
@@ -45,14 +122,16 @@ def generate_quiz():
         return jsonify({'error': '权限不足'}), 403
     
     try:
-        # 获取会话的所有内容
-        contents = Content.query.filter_by(session_id=session_id).all()
-        
-        if not contents:
+        selection = text_selection(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        if not db.session.query(Content.id).filter_by(session_id=session_id).first():
             return jsonify({'error': '会话暂无内容，无法生成题目'}), 400
         
-        # 合并所有文本内容
-        all_text = '\n\n'.join([content.extracted_text for content in contents if content.extracted_text])
+        # 合并选定的片段文本：可按内容、页码/幻灯片序号、来源类型筛选，不指定时使用全部内容
+        all_text = session_text(session_id, **selection)
         
         if not all_text.strip():
             return jsonify({'error': '没有有效的文本内容'}), 400
@@ -62,11 +141,22 @@ def generate_quiz():
         if not quiz_generator:
             return jsonify({'error': 'AI服务暂时不可用'}), 503
             
-        quiz_data = quiz_generator.generate_quiz(all_text, num_questions)
+        try:
+            quiz_data = quiz_generator.generate_quiz(all_text, num_questions, data.get('latency_slo'),
+                                                     CallContext('generate', session_id, user_id))
+        except RateLimitExceeded as e:
+            return rate_limited_response(e)
+        except TokenQuotaExceeded as e:
+            return quota_exceeded_response(e)
+        except PromptTooLarge as e:
+            return jsonify({'error': str(e)}), 413
         
         if not quiz_data:
             return jsonify({'error': 'AI生成题目失败，请稍后重试'}), 500
         
+        # 与会话已有题目近似重复的题目按 dedup 模式丢弃或标出
+        quiz_data, duplicates = filter_duplicates(session_id, quiz_data, mode=data.get('dedup'))
+        
         # 保存题目到数据库
         saved_quizzes = []
         for quiz_info in quiz_data:
@@ -86,6 +176,7 @@ def generate_quiz():
             saved_quizzes.append(quiz)
         
         db.session.commit()
+        invalidate_session_quizzes(session_id)
         
         # 返回生成的题目
         quiz_list = []
@@ -102,36 +193,42 @@ def generate_quiz():
                 'time_limit': quiz.time_limit,
                 'created_at': quiz.created_at.isoformat()
             })
+        for quiz_info, quiz in zip(quiz_data, quiz_list):
+            if 'duplicate_of' in quiz_info:
+                quiz['duplicate_of'] = quiz_info['duplicate_of']
         
+        message = f'成功生成{len(quiz_list)}道题目'
+        if duplicates:
+            message += f'，{len(duplicates)}道与已有题目重复'
         return jsonify({
-            'message': f'成功生成{len(quiz_list)}道题目',
-            'quizzes': quiz_list
+            'message': message,
+            'quizzes': quiz_list,
+            'duplicates': [
+                {'question': quiz_info['question'], 'duplicate_of': quiz_info['duplicate_of']}
+                for quiz_info in duplicates
+            ]
         })
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'生成题目失败: {str(e)}'}), 500
 
-@quiz_bp.route('/activate', methods=['POST'])
-@require_auth
-def activate_quiz():
-    """激活题目（开始答题）"""
-    data = request.get_json()
+def activate_quiz_for_user(quiz_id, user_id):
+    """
+    激活题目（HTTP接口和WebSocket共用）
     
-    if not data or not data.get('quiz_id'):
-        return jsonify({'error': '缺少题目ID'}), 400
-    
-    quiz_id = data['quiz_id']
+    Returns:
+        (响应数据, HTTP状态码)
+    """
     quiz = Quiz.query.get(quiz_id)
     
     if not quiz:
-        return jsonify({'error': '题目不存在'}), 404
+        return {'error': '题目不存在'}, 404
     
     # 验证权限
     pq_session = PQSession.query.get(quiz.session_id)
-    user_id = session['user_id']
     if pq_session.speaker_id != user_id and pq_session.organizer_id != user_id:
-        return jsonify({'error': '权限不足'}), 403
+        return {'error': '权限不足'}, 403
     
     try:
         # 先关闭该会话的其他活跃题目
@@ -140,24 +237,40 @@ def activate_quiz():
         # 激活当前题目
         quiz.is_active = True
         db.session.commit()
+        invalidate_session_quizzes(quiz.session_id)
         
-        return jsonify({
+        quiz_info = {
+            'id': quiz.id,
+            'question': quiz.question,
+            'option_a': quiz.option_a,
+            'option_b': quiz.option_b,
+            'option_c': quiz.option_c,
+            'option_d': quiz.option_d,
+            'time_limit': quiz.time_limit,
+            'is_active': quiz.is_active
+        }
+        realtime.notify_quiz_activated(quiz.session_id, quiz_info)
+        
+        return {
             'message': '题目已激活',
-            'quiz': {
-                'id': quiz.id,
-                'question': quiz.question,
-                'option_a': quiz.option_a,
-                'option_b': quiz.option_b,
-                'option_c': quiz.option_c,
-                'option_d': quiz.option_d,
-                'time_limit': quiz.time_limit,
-                'is_active': quiz.is_active
-            }
-        })
+            'quiz': quiz_info
+        }, 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': f'激活题目失败: {str(e)}'}), 500
+        return {'error': f'激活题目失败: {str(e)}'}, 500
+
+@quiz_bp.route('/activate', methods=['POST'])
+@require_auth
+def activate_quiz():
+    """激活题目（开始答题）"""
+    data = request.get_json()
+    
+    if not data or not data.get('quiz_id'):
+        return jsonify({'error': '缺少题目ID'}), 400
+    
+    result, status = activate_quiz_for_user(data['quiz_id'], session['user_id'])
+    return jsonify(result), status
 
 @quiz_bp.route('/skip/<int:quiz_id>', methods=['POST'])
 @require_auth
@@ -165,7 +278,7 @@ def skip_quiz(quiz_id):
     """跳过当前题目到下一题"""
     try:
         user_id = session['user_id']
-        quiz = Quiz.query.get(quiz_id)
+        quiz, _, session_quizzes = quiz_cache.get_quiz(quiz_id)
         if not quiz:
             return jsonify({'success': False, 'error': '题目不存在'}), 404
         
@@ -175,6 +288,7 @@ def skip_quiz(quiz_id):
             user_id=user_id
         ).first()
         
+        skipped_response_id = None
         if not existing_response:
             # 创建一个"未答题"的记录，用特殊答案"X"标识
             timeout_response = QuizResponse(
@@ -185,30 +299,33 @@ def skip_quiz(quiz_id):
                 answer_duration=20.0  # 默认20秒（超时时间）
             )
             db.session.add(timeout_response)
+            db.session.flush()
+            skipped_response_id = timeout_response.id
         
         # 获取用户进度
         user_progress = UserQuizProgress.query.filter_by(
             user_id=user_id,
-            session_id=quiz.session_id
+            session_id=quiz['session_id']
         ).first()
         
         if not user_progress:
             return jsonify({'success': False, 'error': '进度记录不存在'}), 404
         
-        # 获取该会话的所有题目
-        all_quizzes = Quiz.query.filter_by(session_id=quiz.session_id).order_by(Quiz.created_at.asc()).all()
-        
         # 推进到下一题
-        if user_progress.current_quiz_index < len(all_quizzes) - 1:
+        if user_progress.current_quiz_index < len(session_quizzes) - 1:
             user_progress.current_quiz_index += 1
             user_progress.last_activity = datetime.utcnow()
             db.session.commit()
+            if skipped_response_id:
+                realtime.notify_answer(quiz['session_id'], quiz_id, 'X', skipped_response_id)
             return jsonify({'success': True, 'message': '已跳过到下一题'})
         else:
             # 最后一题，标记为完成
             user_progress.is_completed = True
             user_progress.last_activity = datetime.utcnow()
             db.session.commit()
+            if skipped_response_id:
+                realtime.notify_answer(quiz['session_id'], quiz_id, 'X', skipped_response_id)
             return jsonify({'success': True, 'message': '已完成所有题目', 'completed': True})
             
     except Exception as e:
@@ -248,26 +365,25 @@ def get_user_completion_status(session_id):
             'error': f'获取完成状态失败: {str(e)}'
         }), 500
 
-@quiz_bp.route('/answer', methods=['POST'])
-@require_auth
-def submit_answer():
-    """提交答案"""
-    data = request.get_json()
-    
-    if not data or not data.get('quiz_id') or not data.get('answer'):
-        return jsonify({'error': '缺少题目ID或答案'}), 400
-    
-    quiz_id = data['quiz_id']
-    answer = data['answer'].upper()
-    user_id = session['user_id']
-    answer_duration = data.get('answer_duration')  # 答题用时（秒）
+def record_answer(user_id, quiz_id, answer, answer_duration=None):
+    """
+    保存听众的答案并推进答题进度（HTTP接口和WebSocket共用）
     
+    Returns:
+        (响应数据, HTTP状态码)
+    """
+    answer = (answer or '').upper()
     if answer not in ['A', 'B', 'C', 'D']:
-        return jsonify({'error': '答案格式错误'}), 400
+        return {'error': '答案格式错误'}, 400
     
-    quiz = Quiz.query.get(quiz_id)
+    try:
+        quiz_id = int(quiz_id)
+    except (TypeError, ValueError):
+        return {'error': '题目ID格式错误'}, 400
+    
+    quiz, current_index, session_quizzes = quiz_cache.get_quiz(quiz_id)
     if not quiz:
-        return jsonify({'error': '题目不存在'}), 404
+        return {'error': '题目不存在'}, 404
     
     # 检查用户是否已经回答过这道题
     existing_response = QuizResponse.query.filter_by(
@@ -277,21 +393,21 @@ def submit_answer():
     
     if existing_response:
         # 返回已回答的结果信息，而不是简单的错误
-        return jsonify({
+        return {
             'error': '您已经回答过这道题',
             'already_answered': True,
             'quiz': {
-                'id': quiz.id,
-                'question': quiz.question,
-                'explanation': quiz.explanation
+                'id': quiz['id'],
+                'question': quiz['question'],
+                'explanation': quiz['explanation']
             },
             'user_answer': existing_response.answer,
-            'correct_answer': quiz.correct_answer,
+            'correct_answer': quiz['correct_answer'],
             'is_correct': existing_response.is_correct
-        }), 200  # 改为200状态码，但包含already_answered标志
+        }, 200  # 改为200状态码，但包含already_answered标志
     
     # 检查答案是否正确
-    is_correct = answer == quiz.correct_answer.upper()
+    is_correct = answer == quiz['correct_answer'].upper()
     
     try:
         # 保存答题记录
@@ -304,37 +420,32 @@ def submit_answer():
         )
         
         db.session.add(response)
+        db.session.flush()
+        response_id = response.id
         db.session.commit()
         
         # 更新用户进度
         user_progress = UserQuizProgress.query.filter_by(
             user_id=user_id,
-            session_id=quiz.session_id
+            session_id=quiz['session_id']
         ).first()
         
         if not user_progress:
             # 如果没有进度记录，创建一个
             user_progress = UserQuizProgress(
                 user_id=user_id,
-                session_id=quiz.session_id,
+                session_id=quiz['session_id'],
                 current_quiz_index=0,
                 is_completed=False
             )
             db.session.add(user_progress)
         
-        # 获取该会话的所有题目，按创建时间排序
-        all_quizzes = Quiz.query.filter_by(session_id=quiz.session_id).order_by(Quiz.created_at.asc()).all()
-        
-        # 找到当前题目的位置
-        current_index = -1
-        for i, q in enumerate(all_quizzes):
-            if q.id == quiz_id:
-                current_index = i
-                break
+        # 当前题目在会话题目序列中的位置（来自缓存）
+        next_quiz_activated = False
         
         # 更新用户进度
         if current_index >= 0:
-            if current_index < len(all_quizzes) - 1:
+            if current_index < len(session_quizzes) - 1:
                 # 还有下一题，推进进度
                 user_progress.current_quiz_index = current_index + 1
                 user_progress.last_activity = datetime.utcnow()
@@ -350,13 +461,13 @@ def submit_answer():
         result = {
             'success': True,
             'is_correct': is_correct,
-            'correct_answer': quiz.correct_answer,
-            'explanation': quiz.explanation,
+            'correct_answer': quiz['correct_answer'],
+            'explanation': quiz['explanation'],
             'user_answer': answer,
             'quiz': {
-                'id': quiz.id,
-                'question': quiz.question,
-                'explanation': quiz.explanation
+                'id': quiz['id'],
+                'question': quiz['question'],
+                'explanation': quiz['explanation']
             }
         }
         
@@ -369,11 +480,30 @@ def submit_answer():
             result['all_quizzes_completed'] = True
             result['message'] = '恭喜！您已完成所有题目'
         
-        return jsonify(result)
+        realtime.notify_answer(quiz['session_id'], quiz_id, answer, response_id)
+        
+        return result, 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': f'保存答案失败: {str(e)}'}), 500
+        return {'error': f'保存答案失败: {str(e)}'}, 500
+
+@quiz_bp.route('/answer', methods=['POST'])
+@require_auth
+def submit_answer():
+    """提交答案"""
+    data = request.get_json()
+    
+    if not data or not data.get('quiz_id') or not data.get('answer'):
+        return jsonify({'error': '缺少题目ID或答案'}), 400
+    
+    result, status = record_answer(
+        session['user_id'],
+        data['quiz_id'],
+        data['answer'],
+        data.get('answer_duration')  # 答题用时（秒）
+    )
+    return jsonify(result), status
 
 @quiz_bp.route('/current/<int:session_id>', methods=['GET'])
 def get_current_quiz(session_id):
@@ -388,8 +518,8 @@ def get_current_quiz(session_id):
         
         user_id = session['user_id']
         
-        # 获取会话的所有题目，按创建时间排序
-        all_quizzes = Quiz.query.filter_by(session_id=session_id).order_by(Quiz.created_at.asc()).all()
+        # 获取会话的所有题目，按创建时间排序（来自缓存）
+        all_quizzes = quiz_cache.get_session_quizzes(session_id).quizzes
         
         if not all_quizzes:
             return jsonify({
@@ -438,7 +568,7 @@ def get_current_quiz(session_id):
         
         # 检查是否已经回答过这道题
         existing_response = QuizResponse.query.filter_by(
-            quiz_id=current_quiz.id,
+            quiz_id=current_quiz['id'],
             user_id=user_id
         ).first()
         
@@ -464,14 +594,14 @@ def get_current_quiz(session_id):
         
         # 返回当前题目
         quiz_data = {
-            'id': current_quiz.id,
-            'question': current_quiz.question,
-            'option_a': current_quiz.option_a,
-            'option_b': current_quiz.option_b,
-            'option_c': current_quiz.option_c,
-            'option_d': current_quiz.option_d,
-            'time_limit': current_quiz.time_limit,
-            'created_at': current_quiz.created_at.isoformat(),
+            'id': current_quiz['id'],
+            'question': current_quiz['question'],
+            'option_a': current_quiz['option_a'],
+            'option_b': current_quiz['option_b'],
+            'option_c': current_quiz['option_c'],
+            'option_d': current_quiz['option_d'],
+            'time_limit': current_quiz['time_limit'],
+            'created_at': current_quiz['created_at'].isoformat(),
             'has_answered': has_answered,
             'quiz_number': user_progress.current_quiz_index + 1,
             'total_quizzes': len(all_quizzes)
@@ -904,10 +1034,11 @@ def generate_ai_quizzes():
         # 处理文件并生成题目
         try:
             from app.file_processor import FileProcessor
-            from app.quiz_generator import QuizGenerator
             
             file_processor = FileProcessor()
-            quiz_generator = QuizGenerator()
+            quiz_generator = get_quiz_generator()
+            if not quiz_generator:
+                return jsonify({'error': 'AI服务暂时不可用'}), 503
             
             # 直接从内存中的文件提取文本
             file_content = file.read()
@@ -923,11 +1054,23 @@ def generate_ai_quizzes():
                 return jsonify({'error': '文件内容太少，无法生成题目'}), 400
             
             # 使用AI生成5道选择题
-            generated_quizzes = quiz_generator.generate_quiz(text_content, num_questions=5)
+            try:
+                generated_quizzes = quiz_generator.generate_quiz(
+                    text_content, num_questions=5, context=CallContext('upload', session_id, user_id))
+            except RateLimitExceeded as e:
+                return rate_limited_response(e)
+            except TokenQuotaExceeded as e:
+                return quota_exceeded_response(e)
             
             if not generated_quizzes:
                 return jsonify({'error': 'AI生成题目失败，请检查文件内容'}), 500
             
+            generated_quizzes, duplicates = filter_duplicates(session_id, generated_quizzes,
+                                                              mode=request.form.get('dedup'))
+            if not generated_quizzes:
+                return jsonify({'message': '生成的题目均与已有题目重复', 'count': 0,
+                                'duplicate_count': len(duplicates)})
+            
             # 保存题目到数据库
             created_count = 0
             for quiz_data in generated_quizzes:
@@ -955,10 +1098,12 @@ def generate_ai_quizzes():
                 return jsonify({'error': '保存题目失败'}), 500
             
             db.session.commit()
+            invalidate_session_quizzes(session_id)
             
             return jsonify({
                 'message': f'成功生成{created_count}道题目', 
-                'count': created_count
+                'count': created_count,
+                'duplicate_count': len(duplicates)
             })
             
         except ImportError as e:
@@ -1007,7 +1152,6 @@ def upload_multiple_files_and_generate_quiz():
         
         try:
             from app.file_processor import FileProcessor
-            from app.quiz_generator import QuizGenerator
             
             file_processor = FileProcessor()
             
@@ -1089,20 +1233,35 @@ def upload_multiple_files_and_generate_quiz():
             print(f"📋 题目分配: 每文件{questions_per_file}题，剩余{remaining_questions}题")
             
             # 为每个文件分别生成题目
-            quiz_generator = QuizGenerator()
+            quiz_generator = get_quiz_generator()
+            if not quiz_generator:
+                return jsonify({'success': False, 'message': 'AI服务暂时不可用'}), 503
             all_generated_quizzes = []
+            rate_limited = None
+            quota_exceeded = None
             
-            for i, file_info in enumerate(all_file_contents):
-                # 计算当前文件应生成的题目数
-                current_questions = questions_per_file
-                if i < remaining_questions:  # 剩余题目分配给前几个文件
-                    current_questions += 1
-                
-                print(f"🤖 为文件 '{file_info['filename']}' 生成 {current_questions} 道题目...")
-                
+            # 剩余题目分配给前几个文件
+            file_question_counts = [questions_per_file + (1 if i < remaining_questions else 0)
+                                    for i in range(total_files)]
+            
+            # 各文件同时生成，内容较短的文件的请求会合并为一次调用（见 app/quiz_batcher.py）
+            app = current_app._get_current_object()
+            context = CallContext('upload', session_id, user_id)
+            
+            def generate_for_file(file_info, current_questions):
+                with app.app_context():
+                    return quiz_generator.generate_quiz(
+                        file_info['content'], num_questions=current_questions, context=context)
+            
+            with ThreadPoolExecutor(max_workers=min(total_files, MAX_PARALLEL_FILES)) as executor:
+                futures = []
+                for file_info, current_questions in zip(all_file_contents, file_question_counts):
+                    print(f"🤖 为文件 '{file_info['filename']}' 生成 {current_questions} 道题目...")
+                    futures.append(executor.submit(generate_for_file, file_info, current_questions))
+            
+            for file_info, future in zip(all_file_contents, futures):
                 try:
-                    # 为当前文件生成题目
-                    file_quizzes = quiz_generator.generate_quiz(file_info['content'], num_questions=current_questions)
+                    file_quizzes = future.result()
                     
                     if file_quizzes:
                         # 给每道题添加来源文件信息
@@ -1119,16 +1278,36 @@ def upload_multiple_files_and_generate_quiz():
                         print(f"   ❌ 题目生成失败")
                         failed_files.append(f"{file_info['filename']} (AI生成失败)")
                         
+                except RateLimitExceeded as e:
+                    print(f"   ⏳ {e}")
+                    rate_limited = e
+                    failed_files.append(f"{file_info['filename']} (AI服务繁忙)")
+                    continue
+                except TokenQuotaExceeded as e:
+                    print(f"   ⛔ {e}")
+                    quota_exceeded = e
+                    failed_files.append(f"{file_info['filename']} (token配额已用完)")
+                    continue
                 except Exception as e:
                     print(f"   ❌ 题目生成错误: {e}")
                     failed_files.append(f"{file_info['filename']} (AI生成错误: {str(e)})")
                     continue
             
             if not all_generated_quizzes:
+                if rate_limited:
+                    return rate_limited_response(rate_limited, success=False, message=str(rate_limited))
+                if quota_exceeded:
+                    return quota_exceeded_response(quota_exceeded, success=False, message=str(quota_exceeded))
                 return jsonify({'success': False, 'message': 'AI生成题目失败，请检查文件内容或稍后重试'}), 500
             
+            # 各文件分别出题时容易重复：与会话已有题目及同批其他文件的题目比较
+            all_generated_quizzes, duplicates = filter_duplicates(
+                session_id, all_generated_quizzes, mode=request.form.get('dedup'))
+            
             # 构建响应消息
             message = f'成功基于{len(processed_files)}个文件生成{len(all_generated_quizzes)}道题目'
+            if duplicates:
+                message += f'，{len(duplicates)}道近似重复'
             if failed_files:
                 message += f'，{len(failed_files)}个文件处理失败'
             
@@ -1143,6 +1322,7 @@ def upload_multiple_files_and_generate_quiz():
                 'questions': all_generated_quizzes,
                 'processed_files': processed_files,
                 'failed_files': failed_files,
+                'duplicate_count': len(duplicates),
                 'file_info': {
                     'total_files': len(files),
                     'processed_count': len(processed_files),
@@ -1195,10 +1375,11 @@ def upload_and_generate_quiz():
         # 处理文件并生成题目
         try:
             from app.file_processor import FileProcessor
-            from app.quiz_generator import QuizGenerator
             
             file_processor = FileProcessor()
-            quiz_generator = QuizGenerator()
+            quiz_generator = get_quiz_generator()
+            if not quiz_generator:
+                return jsonify({'success': False, 'message': 'AI服务暂时不可用'}), 503
             
             # 直接从内存中的文件提取文本
             file_content = file.read()
@@ -1230,7 +1411,12 @@ def upload_and_generate_quiz():
             print(f"开始使用AI生成 {num_questions} 道题目...")
             
             # 使用AI生成题目
-            generated_quizzes = quiz_generator.generate_quiz(text_content, num_questions=num_questions)
+            try:
+                generated_quizzes = quiz_generator.generate_quiz(
+                    text_content, num_questions=num_questions,
+                    context=CallContext('upload', user_id=session.get('user_id')))
+            except RateLimitExceeded as e:
+                return rate_limited_response(e, success=False, message=str(e))
             
             if not generated_quizzes:
                 return jsonify({'success': False, 'message': 'AI生成题目失败，请检查文件内容或稍后重试'}), 500
@@ -1291,6 +1477,8 @@ def auto_activate_next_quiz(session_id):
             first_quiz = all_quizzes[0]
             first_quiz.is_active = True
             db.session.commit()
+            invalidate_session_quizzes(session_id)
+            realtime.notify_quiz_activated(session_id, {'id': first_quiz.id})
             
             return jsonify({
                 'success': True,
@@ -1316,6 +1504,8 @@ def auto_activate_next_quiz(session_id):
         current_active_quiz.is_active = False
         next_quiz.is_active = True
         db.session.commit()
+        invalidate_session_quizzes(session_id)
+        realtime.notify_quiz_activated(session_id, {'id': next_quiz.id})
         
         return jsonify({
             'success': True,
@@ -1333,15 +1523,15 @@ def auto_activate_next_quiz(session_id):
 @quiz_bp.route('/send-to-audience', methods=['POST'])
 @require_auth
 def send_quiz_to_audience():
-    """发送题目给听众"""
+    """发送题目给听众（quiz 为题目内容，或 draft_id 为预生成的候选题）"""
     try:
         data = request.get_json()
         
-        if not data or not data.get('session_id') or not data.get('quiz'):
+        if not data or not data.get('session_id') or not (data.get('quiz') or data.get('draft_id')):
             return jsonify({'success': False, 'message': '缺少必要参数'}), 400
         
         session_id = data['session_id']
-        quiz_data = data['quiz']
+        quiz_data = data.get('quiz')
         
         # 验证会话存在且用户有权限
         pq_session = PQSession.query.get(session_id)
@@ -1354,24 +1544,33 @@ def send_quiz_to_audience():
         
         # 保存题目到数据库
         try:
-            quiz = Quiz(
-                session_id=session_id,
-                question=quiz_data['question'],
-                option_a=quiz_data['option_a'],
-                option_b=quiz_data['option_b'],
-                option_c=quiz_data['option_c'],
-                option_d=quiz_data['option_d'],
-                correct_answer=quiz_data['correct_answer'],
-                explanation=quiz_data.get('explanation', ''),
-                time_limit=quiz_data.get('time_estimate', 30),
-                is_active=True  # 立即激活
-            )
-            
             # 先关闭该会话的其他活跃题目
             Quiz.query.filter_by(session_id=session_id, is_active=True).update({'is_active': False})
             
-            db.session.add(quiz)
+            if data.get('draft_id'):
+                # 预生成的候选题无需再调用AI，直接发布
+                quiz = pregeneration.publish_draft(data['draft_id'], session_id)
+                if quiz is None:
+                    db.session.rollback()
+                    return jsonify({'success': False, 'message': '候选题不存在或已被使用'}), 409
+            else:
+                quiz = Quiz(
+                    session_id=session_id,
+                    question=quiz_data['question'],
+                    option_a=quiz_data['option_a'],
+                    option_b=quiz_data['option_b'],
+                    option_c=quiz_data['option_c'],
+                    option_d=quiz_data['option_d'],
+                    correct_answer=quiz_data['correct_answer'],
+                    explanation=quiz_data.get('explanation', ''),
+                    time_limit=quiz_data.get('time_estimate', 30),
+                    is_active=True  # 立即激活
+                )
+                db.session.add(quiz)
+            
             db.session.commit()
+            invalidate_session_quizzes(session_id)
+            realtime.notify_quiz_activated(session_id, {'id': quiz.id})
             
             return jsonify({
                 'success': True,
@@ -1388,6 +1587,43 @@ def send_quiz_to_audience():
         print(f"发送题目错误: {e}")
         return jsonify({'success': False, 'message': '系统错误'}), 500
 
+@quiz_bp.route('/drafts/<int:session_id>', methods=['GET'])
+@require_auth
+def get_quiz_drafts(session_id):
+    """会话中待发布的预生成候选题"""
+    pq_session = PQSession.query.get(session_id)
+    if not pq_session:
+        return jsonify({'error': '会话不存在'}), 404
+    
+    user_id = session['user_id']
+    if pq_session.speaker_id != user_id and pq_session.organizer_id != user_id:
+        return jsonify({'error': '权限不足'}), 403
+    
+    return jsonify({
+        'drafts': [pregeneration.draft_info(draft) for draft in pregeneration.ready_drafts(session_id)],
+        'quiz_interval': pq_session.quiz_interval,
+        **pregeneration.spend_info(session_id)
+    })
+
+@quiz_bp.route('/drafts/<int:draft_id>', methods=['DELETE'])
+@require_auth
+def discard_quiz_draft(draft_id):
+    """丢弃一道候选题，调度线程会在下次检查时补充"""
+    draft = QuizDraft.query.get(draft_id)
+    if not draft:
+        return jsonify({'error': '候选题不存在'}), 404
+    
+    pq_session = PQSession.query.get(draft.session_id)
+    user_id = session['user_id']
+    if pq_session.speaker_id != user_id and pq_session.organizer_id != user_id:
+        return jsonify({'error': '权限不足'}), 403
+    
+    if draft.status != 'ready':
+        return jsonify({'error': '候选题已被使用'}), 409
+    draft.status = 'discarded'
+    db.session.commit()
+    return jsonify({'message': '候选题已丢弃'})
+
 @quiz_bp.route('/send-all-to-audience', methods=['POST'])
 @require_auth
 def send_all_quizzes_to_audience():
@@ -1435,6 +1671,8 @@ def send_all_quizzes_to_audience():
                 saved_count += 1
             
             db.session.commit()
+            invalidate_session_quizzes(session_id)
+            realtime.notify_quiz_activated(session_id, {'count': saved_count})
             
             return jsonify({
                 'success': True,
@@ -1713,40 +1951,57 @@ def get_discussions(quiz_id):
         current_app.logger.error(f"获取讨论失败: {str(e)}")
         return jsonify({'error': '获取讨论失败，请稍后重试'}), 500
 
-@quiz_bp.route('/<int:quiz_id>/discussions', methods=['POST'])
-@require_auth
-def post_discussion(quiz_id):
-    """发布讨论消息"""
-    data = request.get_json()
-    if not data or not data.get('message'):
-        return jsonify({'error': '缺少消息内容'}), 400
+def create_discussion(quiz_id, user_id, message):
+    """
+    发布讨论消息（HTTP接口和WebSocket共用）
+    
+    Returns:
+        (响应数据, HTTP状态码)
+    """
+    if not message:
+        return {'error': '缺少消息内容'}, 400
     
     quiz = Quiz.query.get(quiz_id)
     if not quiz:
-        return jsonify({'error': '题目不存在'}), 404
+        return {'error': '题目不存在'}, 404
     
     discussion = QuizDiscussion(
         quiz_id=quiz_id,
-        user_id=session['user_id'],
-        message=data['message']
+        user_id=user_id,
+        message=message
     )
     
     db.session.add(discussion)
     db.session.commit()
     
     # 返回新创建的讨论信息
-    user = User.query.get(session['user_id'])
-    return jsonify({
+    user = User.query.get(user_id)
+    discussion_info = {
+        'id': discussion.id,
+        'quiz_id': quiz_id,
+        'user_id': discussion.user_id,
+        'username': user.username if user else '未知用户',
+        'message': discussion.message,
+        'created_at': discussion.created_at.isoformat()
+    }
+    realtime.notify_discussion(quiz.session_id, discussion_info)
+    
+    return {
         'success': True,
         'message': '讨论发布成功',
-        'discussion': {
-            'id': discussion.id,
-            'user_id': discussion.user_id,
-            'username': user.username if user else '未知用户',
-            'message': discussion.message,
-            'created_at': discussion.created_at.isoformat()
-        }
-    })
+        'discussion': discussion_info
+    }, 200
+
+@quiz_bp.route('/<int:quiz_id>/discussions', methods=['POST'])
+@require_auth
+def post_discussion(quiz_id):
+    """发布讨论消息"""
+    data = request.get_json()
+    if not data or not data.get('message'):
+        return jsonify({'error': '缺少消息内容'}), 400
+    
+    result, status = create_discussion(quiz_id, session['user_id'], data['message'])
+    return jsonify(result), status
 
 @quiz_bp.route('/session/<int:session_id>/discussions', methods=['GET'])
 @require_auth
@@ -1971,6 +2226,7 @@ def create_quiz():
         
         db.session.add(quiz)
         db.session.commit()
+        invalidate_session_quizzes(quiz.session_id)
         
         return jsonify({
             'message': '题目创建成功',
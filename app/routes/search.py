@@ -0,0 +1,59 @@
+from flask import Blueprint, request, jsonify, session
+from app import db
+from app.models import Session as PQSession
+from app.routes.auth import require_auth
+from app import search as search_index
+
+search_bp = Blueprint('search', __name__)
+
+MAX_LIMIT = 100
+
+@search_bp.route('', methods=['GET'])
+@require_auth
+def search():
+    """
+    全文检索内容片段、题目和讨论
+
+    参数：
+        q: 查询文本（必填）
+        session_id: 只检索该会话，默认检索当前用户组织/主讲的全部会话
+        types: 逗号分隔的类型（segment, content, quiz, discussion），默认全部
+        limit: 返回条数，默认20，最多100
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': '缺少查询内容'}), 400
+
+    user_id = session['user_id']
+    user_role = session.get('user_role')
+    if user_role == 'organizer':
+        scope = PQSession.query.filter_by(organizer_id=user_id)
+    elif user_role == 'speaker':
+        scope = PQSession.query.filter_by(speaker_id=user_id)
+    else:
+        return jsonify({'error': '权限不足'}), 403
+    session_ids = [sid for (sid,) in scope.with_entities(PQSession.id)]
+
+    session_id = request.args.get('session_id', type=int)
+    if session_id is not None:
+        if session_id not in session_ids:
+            return jsonify({'error': '权限不足'}), 403
+        session_ids = [session_id]
+
+    types = [t.strip() for t in request.args.get('types', '').split(',') if t.strip()]
+    unknown = [t for t in types if t not in search_index.KINDS]
+    if unknown:
+        return jsonify({'error': f'不支持的类型: {", ".join(unknown)}'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_LIMIT)
+
+    try:
+        results = search_index.search(query, session_ids, kinds=types, limit=limit)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'检索失败: {str(e)}'}), 500
+
+    return jsonify({
+        'query': query,
+        'results': results,
+        'total': len(results)
+    })
@@ -1,9 +1,14 @@
 from flask import Blueprint, request, jsonify, session
+from sqlalchemy.exc import IntegrityError
 from app import db
 from app.models import Session as PQSession, SessionParticipant, User, UserRole
 from app.routes.auth import require_auth
+from app.invite_codes import invite_code_pool
 from datetime import datetime
 
+# 多个进程同时取到同一个邀请码时的最大重试次数
+INVITE_CODE_RETRIES = 5
+
 session_bp = Blueprint('session', __name__)
 
 @session_bp.route('/create', methods=['POST'])
@@ -25,20 +30,29 @@ def create_session():
         return jsonify({'error': '演讲者不存在'}), 404
     
     try:
-        # 生成唯一邀请码
-        invite_code = PQSession.generate_unique_invite_code()
+        for attempt in range(INVITE_CODE_RETRIES):
+            # 从邀请码池取码，唯一约束冲突时（其他进程用掉了同一个码）换一个重试
+            invite_code = PQSession.generate_unique_invite_code()
+            
+            pq_session = PQSession(
+                title=data['title'],
+                description=data.get('description', ''),
+                organizer_id=session['user_id'],
+                speaker_id=data['speaker_id'],
+                invite_code=invite_code,
+                quiz_interval=10  # 默认10分钟，由演讲者控制出题时机
+            )
+            
+            db.session.add(pq_session)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == INVITE_CODE_RETRIES - 1:
+                    raise
         
-        pq_session = PQSession(
-            title=data['title'],
-            description=data.get('description', ''),
-            organizer_id=session['user_id'],
-            speaker_id=data['speaker_id'],
-            invite_code=invite_code,
-            quiz_interval=10  # 默认10分钟，由演讲者控制出题时机
-        )
-        
-        db.session.add(pq_session)
-        db.session.commit()
+        invite_code_pool.register(pq_session.invite_code, pq_session.id)
         
         return jsonify({
             'message': '会话创建成功',
@@ -200,29 +214,21 @@ def join_session_by_code():
     if len(invite_code) != 6 or not invite_code.isdigit():
         return jsonify({'error': '邀请码格式错误，应为6位数字'}), 400
     
-    # 查找对应的会话
-    pq_session = PQSession.query.filter_by(invite_code=invite_code).first()
+    # 查找对应的会话（进程内索引，未命中时回退到数据库）
+    session_id = invite_code_pool.lookup(invite_code)
+    pq_session = PQSession.query.get(session_id) if session_id is not None else None
     if not pq_session:
         return jsonify({'error': '邀请码不存在'}), 404
     
-    # 检查是否已经参与
-    existing_participant = SessionParticipant.query.filter_by(
-        session_id=pq_session.id, 
-        user_id=user_id
-    ).first()
-    
-    if existing_participant:
-        return jsonify({
-            'message': '您已经参与了该会话',
-            'session': {
-                'id': pq_session.id,
-                'title': pq_session.title,
-                'description': pq_session.description,
-                'invite_code': pq_session.invite_code,
-                'is_active': pq_session.is_active
-            }
-        })
+    session_info = {
+        'id': pq_session.id,
+        'title': pq_session.title,
+        'description': pq_session.description,
+        'invite_code': pq_session.invite_code,
+        'is_active': pq_session.is_active
+    }
     
+    # 直接插入，已经参与时由 (session_id, user_id) 唯一约束拒绝，省去一次查询
     try:
         participant = SessionParticipant(
             session_id=pq_session.id,
@@ -234,15 +240,15 @@ def join_session_by_code():
         
         return jsonify({
             'message': '成功加入会话',
-            'session': {
-                'id': pq_session.id,
-                'title': pq_session.title,
-                'description': pq_session.description,
-                'invite_code': pq_session.invite_code,
-                'is_active': pq_session.is_active
-            }
+            'session': session_info
         })
         
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({
+            'message': '您已经参与了该会话',
+            'session': session_info
+        })
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'加入会话失败: {str(e)}'}), 500
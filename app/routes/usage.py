@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta
+
+from flask import Blueprint, request, jsonify, session
+from app import db
+from app.models import LLMCallRecord, Session as PQSession, User
+from app.routes.auth import require_auth, require_role
+from app import llm_accounting
+
+usage_bp = Blueprint('usage', __name__)
+
+MAX_DAYS = 366
+
+def _since_filter():
+    """days 参数：只统计最近若干天的调用，默认全部"""
+    days = request.args.get('days', type=int)
+    if not days:
+        return []
+    return [LLMCallRecord.created_at >= datetime.utcnow() - timedelta(days=min(days, MAX_DAYS))]
+
+def _quota_info(session_id):
+    quota = llm_accounting.session_quota(session_id)
+    used = llm_accounting.session_usage(session_id)
+    return {
+        'token_quota': quota or None,
+        'used_tokens': used,
+        'remaining_tokens': max(0, quota - used) if quota else None
+    }
+
+def _by_provider(filters):
+    """按提供方汇总（早于提供方记录的调用归为 unknown）"""
+    return {provider or 'unknown': summary
+            for provider, summary in llm_accounting.aggregate(filters, LLMCallRecord.provider).items()}
+
+@usage_bp.route('/sessions/<int:session_id>', methods=['GET'])
+@require_auth
+def get_session_usage(session_id):
+    """会话的AI出题用量：按模型、用户、用途、结果汇总（组织者和演讲者可查看）"""
+    pq_session = PQSession.query.get(session_id)
+    if not pq_session:
+        return jsonify({'error': '会话不存在'}), 404
+    
+    user_id = session['user_id']
+    if pq_session.speaker_id != user_id and pq_session.organizer_id != user_id:
+        return jsonify({'error': '权限不足'}), 403
+    
+    filters = [LLMCallRecord.session_id == session_id] + _since_filter()
+    by_user = llm_accounting.aggregate(filters, LLMCallRecord.user_id)
+    names = dict(db.session.query(User.id, User.nickname).filter(User.id.in_([uid for uid in by_user if uid])))
+    
+    return jsonify({
+        'session_id': session_id,
+        **_quota_info(session_id),
+        'totals': llm_accounting.aggregate(filters),
+        'by_provider': _by_provider(filters),
+        'by_model': llm_accounting.aggregate(filters, LLMCallRecord.model),
+        'by_purpose': llm_accounting.aggregate(filters, LLMCallRecord.purpose),
+        'by_outcome': llm_accounting.aggregate(filters, LLMCallRecord.outcome),
+        'by_user': [
+            {'user_id': uid, 'nickname': names.get(uid), **summary}
+            for uid, summary in by_user.items()
+        ]
+    })
+
+@usage_bp.route('/summary', methods=['GET'])
+@require_role('organizer')
+def get_usage_summary():
+    """当前组织者所有会话的AI出题用量"""
+    sessions = PQSession.query.with_entities(PQSession.id, PQSession.title).filter_by(
+        organizer_id=session['user_id']).all()
+    session_ids = [sid for sid, _ in sessions]
+    filters = [LLMCallRecord.session_id.in_(session_ids)] + _since_filter()
+    by_session = llm_accounting.aggregate(filters, LLMCallRecord.session_id)
+    
+    return jsonify({
+        'totals': llm_accounting.aggregate(filters),
+        'by_provider': _by_provider(filters),
+        'by_model': llm_accounting.aggregate(filters, LLMCallRecord.model),
+        'sessions': [
+            {'session_id': sid, 'title': title, **_quota_info(sid),
+             **by_session.get(sid, llm_accounting.empty_summary())}
+            for sid, title in sessions
+        ]
+    })
+
+@usage_bp.route('/sessions/<int:session_id>/quota', methods=['PUT'])
+@require_role('organizer')
+def set_session_quota(session_id):
+    """设置会话的token配额（token_quota 为空时恢复默认配额，0 表示不限制）"""
+    pq_session = PQSession.query.get(session_id)
+    if not pq_session:
+        return jsonify({'error': '会话不存在'}), 404
+    if pq_session.organizer_id != session['user_id']:
+        return jsonify({'error': '权限不足'}), 403
+    
+    data = request.get_json() or {}
+    if 'token_quota' not in data:
+        return jsonify({'error': '缺少 token_quota'}), 400
+    quota = data['token_quota']
+    if quota is not None and (not isinstance(quota, int) or isinstance(quota, bool) or quota < 0):
+        return jsonify({'error': 'token_quota 必须是非负整数或 null'}), 400
+    
+    try:
+        pq_session.llm_token_quota = quota
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'设置配额失败: {str(e)}'}), 500
+    
+    return jsonify({'message': '配额已更新', 'session_id': session_id, **_quota_info(session_id)})
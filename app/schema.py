@@ -0,0 +1,53 @@
+"""
+数据库结构升级
+
+项目没有使用迁移工具，db.create_all() 只会创建缺失的表，不会给已有的表加列。
+这里记录后来新增的列，启动时（create_all 之后）检查并补上，旧数据库无需手动处理。
+需要根据已有数据计算的新列也在这里补算一次（如内容的文本长度和预览）。
+"""
+from sqlalchemy import inspect, text
+
+# (表名, 列名, 列定义)
+ADDED_COLUMNS = [
+    ('contents', 'status', "VARCHAR(20) NOT NULL DEFAULT 'ready'"),
+    ('contents', 'stage', 'VARCHAR(20)'),
+    ('contents', 'error', 'TEXT'),
+    ('contents', 'text_length', 'INTEGER'),
+    ('contents', 'text_preview', 'VARCHAR(210)'),
+    ('sessions', 'llm_token_quota', 'INTEGER'),
+    ('llm_call_records', 'provider', 'VARCHAR(50)'),
+    ('llm_call_records', 'batch_size', 'INTEGER NOT NULL DEFAULT 1'),
+]
+
+
+def upgrade_schema(db):
+    """为已有的表补上新增的列，需要在应用上下文中调用"""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    columns = {}
+    with db.engine.begin() as connection:
+        for table, column, definition in ADDED_COLUMNS:
+            if table not in existing_tables:
+                continue
+            if table not in columns:
+                columns[table] = {c['name'] for c in inspector.get_columns(table)}
+            if column not in columns[table]:
+                connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+                columns[table].add(column)
+                print(f"数据库升级：{table} 表新增列 {column}")
+    if 'contents' in existing_tables:
+        backfill_text_summaries(db)
+
+
+def backfill_text_summaries(db, batch_size=100):
+    """为长度/预览列出现之前写入的内容补算一次"""
+    from app.models import Content
+
+    content_ids = [content_id for (content_id,) in db.session.query(Content.id).filter(
+        Content.text_length.is_(None))]
+    for start in range(0, len(content_ids), batch_size):
+        for content in Content.query.filter(Content.id.in_(content_ids[start:start + batch_size])):
+            content.extracted_text = content.extracted_text  # 触发 Content 的长度/预览更新
+        db.session.commit()
+    if content_ids:
+        print(f"数据库升级：补算 {len(content_ids)} 条内容的文本长度和预览")
@@ -0,0 +1,418 @@
+"""
+全文检索
+
+对内容片段（ContentSegment.text）、题目（Quiz.question + explanation）和讨论
+（QuizDiscussion.message）建立全文索引，供演讲者查找概念出自哪份资料、
+组织者检索历史题目。
+
+- SQLite 且支持 FTS5 时使用 FTS5 虚拟表，按 bm25 排序；
+  其他数据库（或 SEARCH_BACKEND=table）使用普通表 + LIKE 匹配，在 Python 中按词频排序
+- 中文没有空格分词，写入索引前把连续的汉字切成重叠的二元组（"机器学习" -> 机器 器学 学习），
+  查询时做同样的切分；单个汉字的查询按前缀匹配
+- 索引只保存切分后的词和会话ID，不重复存储原文；摘要片段从原表读取命中的少量记录生成
+- 通过 ORM 事件在插入、修改、删除时同步维护索引，与业务写入在同一事务中提交；
+  启动时若索引为空则从已有数据重建
+
+索引行ID = 记录ID * 4 + 类型编号，删除时按行ID定位，无需扫描。
+
+环境变量：
+    SEARCH_BACKEND=auto   auto|fts5|table
+"""
+import html
+import math
+import os
+import re
+import threading
+
+from sqlalchemy import bindparam, event, select, text
+
+from app import db
+from app.models import Content, ContentSegment, Quiz, QuizDiscussion
+
+KINDS = {'segment': 0, 'quiz': 1, 'discussion': 2, 'content': 3}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+KIND_SLOTS = 4
+
+# 摘要片段长度及命中词之前保留的字符数
+SNIPPET_CHARS = 120
+SNIPPET_LEAD = 30
+# 普通表后端最多取出的候选记录数
+TABLE_CANDIDATES = 500
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TERM_RE = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+
+def _terms(value):
+    """把文本切成词：连续汉字为一个词，其余按单词切分，统一小写"""
+    return _TERM_RE.findall(value.lower()) if value else []
+
+
+def _tokens(term):
+    """一个词对应的索引词：汉字切成二元组，其余原样"""
+    if _CJK_RE.match(term) and len(term) > 1:
+        return [term[i:i + 2] for i in range(len(term) - 1)]
+    return [term]
+
+
+def index_tokens(value):
+    """索引中保存的文本：空格分隔的索引词"""
+    return ' '.join(token for term in _terms(value) for token in _tokens(term))
+
+
+def query_tokens(query):
+    """
+    查询词列表
+
+    Returns:
+        [(索引词, 是否前缀匹配)]，单个汉字按前缀匹配包含它的二元组
+    """
+    tokens = []
+    for term in _terms(query):
+        prefix = len(term) == 1 and bool(_CJK_RE.match(term))
+        for token in _tokens(term):
+            if (token, prefix) not in tokens:
+                tokens.append((token, prefix))
+    return tokens
+
+
+def _rowid(kind, ref_id):
+    return ref_id * KIND_SLOTS + KINDS[kind]
+
+
+def snippet(value, query):
+    """截取包含第一个命中词的片段，命中词用 <mark> 标出（其余内容已做HTML转义）"""
+    value = value or ''
+    terms = sorted(set(_terms(query)), key=len, reverse=True)
+    lowered = value.lower()
+    positions = [lowered.find(term) for term in terms]
+    positions = [pos for pos in positions if pos >= 0]
+    start = max(0, min(positions) - SNIPPET_LEAD) if positions else 0
+    end = start + SNIPPET_CHARS
+    excerpt = value[start:end]
+
+    parts = []
+    if terms:
+        pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+        last = 0
+        for match in pattern.finditer(excerpt):
+            parts.append(html.escape(excerpt[last:match.start()]))
+            parts.append(f'<mark>{html.escape(match.group())}</mark>')
+            last = match.end()
+        parts.append(html.escape(excerpt[last:]))
+    else:
+        parts.append(html.escape(excerpt))
+
+    return ('...' if start > 0 else '') + ''.join(parts) + ('...' if end < len(value) else '')
+
+
+class Fts5SearchIndex:
+    """SQLite FTS5 索引"""
+
+    name = 'fts5'
+
+    def create(self, connection):
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_index "
+            "USING fts5(body, session_id UNINDEXED, tokenize='unicode61')"
+        ))
+
+    def is_empty(self, connection):
+        return connection.execute(text('SELECT rowid FROM search_index LIMIT 1')).first() is None
+
+    def put(self, connection, rowid, session_id, body):
+        self.remove(connection, [rowid])
+        connection.execute(
+            text('INSERT INTO search_index (rowid, body, session_id) VALUES (:rowid, :body, :session_id)'),
+            {'rowid': rowid, 'body': body, 'session_id': session_id}
+        )
+
+    def remove(self, connection, rowids):
+        if rowids:
+            connection.execute(
+                text('DELETE FROM search_index WHERE rowid IN :rowids').bindparams(
+                    bindparam('rowids', expanding=True)),
+                {'rowids': list(rowids)}
+            )
+
+    def search(self, connection, tokens, session_ids, kind_codes, limit):
+        match = ' '.join(f'"{token}"' + ('*' if prefix else '') for token, prefix in tokens)
+        sql = ('SELECT rowid, session_id, bm25(search_index) AS score FROM search_index '
+               'WHERE search_index MATCH :match AND session_id IN :session_ids')
+        params = {'match': match, 'session_ids': list(session_ids), 'limit': limit}
+        binds = [bindparam('session_ids', expanding=True)]
+        if kind_codes:
+            sql += ' AND rowid % 4 IN :kinds'
+            params['kinds'] = list(kind_codes)
+            binds.append(bindparam('kinds', expanding=True))
+        sql += ' ORDER BY score LIMIT :limit'
+        rows = connection.execute(text(sql).bindparams(*binds), params)
+        # bm25 越小越相关，取反后越大越相关
+        return [(rowid, session_id, -score) for rowid, session_id, score in rows]
+
+
+class TableSearchIndex:
+    """普通表索引，用于没有 FTS5 的数据库"""
+
+    name = 'table'
+
+    def create(self, connection):
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS search_documents ('
+            'id BIGINT PRIMARY KEY, session_id INTEGER NOT NULL, body TEXT NOT NULL)'
+        ))
+        connection.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_search_documents_session_id ON search_documents (session_id)'
+        ))
+
+    def is_empty(self, connection):
+        return connection.execute(text('SELECT id FROM search_documents LIMIT 1')).first() is None
+
+    def put(self, connection, rowid, session_id, body):
+        self.remove(connection, [rowid])
+        connection.execute(
+            text('INSERT INTO search_documents (id, session_id, body) VALUES (:rowid, :session_id, :body)'),
+            {'rowid': rowid, 'body': body, 'session_id': session_id}
+        )
+
+    def remove(self, connection, rowids):
+        if rowids:
+            connection.execute(
+                text('DELETE FROM search_documents WHERE id IN :rowids').bindparams(
+                    bindparam('rowids', expanding=True)),
+                {'rowids': list(rowids)}
+            )
+
+    def search(self, connection, tokens, session_ids, kind_codes, limit):
+        sql = 'SELECT id, session_id, body FROM search_documents WHERE session_id IN :session_ids'
+        params = {'session_ids': list(session_ids), 'limit': TABLE_CANDIDATES}
+        binds = [bindparam('session_ids', expanding=True)]
+        for i, (token, _) in enumerate(tokens):
+            escaped = token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            sql += f" AND body LIKE :t{i} ESCAPE '\\'"
+            params[f't{i}'] = f'%{escaped}%'
+        if kind_codes:
+            sql += ' AND id % 4 IN :kinds'
+            params['kinds'] = list(kind_codes)
+            binds.append(bindparam('kinds', expanding=True))
+        sql += ' LIMIT :limit'
+
+        hits = []
+        for rowid, session_id, body in connection.execute(text(sql).bindparams(*binds), params):
+            frequency = sum(body.count(token) for token, _ in tokens)
+            hits.append((rowid, session_id, frequency / (1 + math.log1p(len(body)))))
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        return hits[:limit]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _fts5_supported(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        return bool(connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+    except Exception:
+        return False
+
+
+def get_search_index(connection):
+    """获取索引后端（首次调用时按数据库类型选择并建表）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                name = os.getenv('SEARCH_BACKEND', 'auto').lower()
+                if name != 'table' and _fts5_supported(connection):
+                    index = Fts5SearchIndex()
+                else:
+                    if name == 'fts5':
+                        print("警告：当前数据库不支持 FTS5，全文检索改用普通表索引")
+                    index = TableSearchIndex()
+                index.create(connection)
+                _index = index
+    return _index
+
+
+def _index_document(connection, kind, ref_id, session_id, *values):
+    body = index_tokens('\n'.join(value for value in values if value))
+    index = get_search_index(connection)
+    if body:
+        index.put(connection, _rowid(kind, ref_id), session_id, body)
+    else:
+        index.remove(connection, [_rowid(kind, ref_id)])
+
+
+def _remove_document(connection, kind, ref_id):
+    get_search_index(connection).remove(connection, [_rowid(kind, ref_id)])
+
+
+def remove_content_segments(content_id):
+    """
+    删除某个内容所有片段的索引（在当前会话的事务中执行）
+
+    批量 delete() 不会触发 ORM 事件，批量删除片段前需要调用这里。
+    """
+    connection = db.session.connection()
+    ids = [segment_id for (segment_id,) in
+           db.session.query(ContentSegment.id).filter_by(content_id=content_id)]
+    get_search_index(connection).remove(connection, [_rowid('segment', i) for i in ids])
+
+
+def _safely(handler):
+    """索引维护失败不影响业务写入"""
+    def wrapper(mapper, connection, target):
+        try:
+            handler(connection, target)
+        except Exception as e:
+            print(f"警告：更新全文索引失败: {e}")
+    wrapper.__name__ = handler.__name__
+    return wrapper
+
+
+@_safely
+def _index_segment(connection, segment):
+    session_id = connection.execute(
+        select(Content.session_id).where(Content.id == segment.content_id)).scalar()
+    _index_document(connection, 'segment', segment.id, session_id, segment.text)
+
+
+@_safely
+def _index_quiz(connection, quiz):
+    _index_document(connection, 'quiz', quiz.id, quiz.session_id, quiz.question, quiz.explanation)
+
+
+@_safely
+def _index_discussion(connection, discussion):
+    session_id = connection.execute(
+        select(Quiz.session_id).where(Quiz.id == discussion.quiz_id)).scalar()
+    _index_document(connection, 'discussion', discussion.id, session_id, discussion.message)
+
+
+def _remover(kind):
+    @_safely
+    def remove(connection, target):
+        _remove_document(connection, kind, target.id)
+    return remove
+
+
+event.listen(ContentSegment, 'after_insert', _index_segment)
+event.listen(ContentSegment, 'after_update', _index_segment)
+event.listen(ContentSegment, 'after_delete', _remover('segment'))
+event.listen(Quiz, 'after_insert', _index_quiz)
+event.listen(Quiz, 'after_update', _index_quiz)
+event.listen(Quiz, 'after_delete', _remover('quiz'))
+event.listen(QuizDiscussion, 'after_insert', _index_discussion)
+event.listen(QuizDiscussion, 'after_update', _index_discussion)
+event.listen(QuizDiscussion, 'after_delete', _remover('discussion'))
+# 没有片段的旧内容以整段文本建索引
+event.listen(Content, 'after_delete', _remover('content'))
+
+
+def init_search_index(db):
+    """启动时调用：建立索引表，索引为空时从已有数据重建，需要在应用上下文中调用"""
+    with db.engine.begin() as connection:
+        index = get_search_index(connection)
+        if not index.is_empty(connection):
+            return
+        count = 0
+        rows = connection.execute(
+            select(ContentSegment.id, Content.session_id, ContentSegment.text)
+            .join(Content, Content.id == ContentSegment.content_id))
+        for segment_id, session_id, value in rows:
+            _index_document(connection, 'segment', segment_id, session_id, value)
+            count += 1
+        has_segments = select(ContentSegment.id).where(ContentSegment.content_id == Content.id).exists()
+        rows = connection.execute(
+            select(Content.id, Content.session_id, Content.extracted_text)
+            .where(Content.extracted_text.isnot(None), ~has_segments))
+        for content_id, session_id, value in rows:
+            _index_document(connection, 'content', content_id, session_id, value)
+            count += 1
+        for quiz_id, session_id, question, explanation in connection.execute(
+                select(Quiz.id, Quiz.session_id, Quiz.question, Quiz.explanation)):
+            _index_document(connection, 'quiz', quiz_id, session_id, question, explanation)
+            count += 1
+        rows = connection.execute(
+            select(QuizDiscussion.id, Quiz.session_id, QuizDiscussion.message)
+            .join(Quiz, Quiz.id == QuizDiscussion.quiz_id))
+        for discussion_id, session_id, message in rows:
+            _index_document(connection, 'discussion', discussion_id, session_id, message)
+            count += 1
+        if count:
+            print(f"全文索引（{index.name}）已重建，共 {count} 条记录")
+
+
+def _load_documents(hits):
+    """按类型批量读取命中记录的原文和元数据"""
+    ids = {}
+    for rowid, _, _ in hits:
+        ids.setdefault(KIND_NAMES[rowid % KIND_SLOTS], []).append(rowid // KIND_SLOTS)
+
+    documents = {}
+    if 'segment' in ids:
+        rows = db.session.query(
+            ContentSegment.id, ContentSegment.content_id, ContentSegment.page_number,
+            ContentSegment.source_kind, ContentSegment.text, Content.original_filename
+        ).join(Content, Content.id == ContentSegment.content_id).filter(ContentSegment.id.in_(ids['segment']))
+        for segment_id, content_id, page_number, source_kind, value, filename in rows:
+            documents[_rowid('segment', segment_id)] = (value, {
+                'content_id': content_id, 'filename': filename,
+                'page_number': page_number, 'source_kind': source_kind
+            })
+    if 'content' in ids:
+        rows = db.session.query(Content.id, Content.extracted_text, Content.original_filename).filter(
+            Content.id.in_(ids['content']))
+        for content_id, value, filename in rows:
+            documents[_rowid('content', content_id)] = (value, {'content_id': content_id, 'filename': filename})
+    if 'quiz' in ids:
+        rows = db.session.query(Quiz.id, Quiz.question, Quiz.explanation).filter(Quiz.id.in_(ids['quiz']))
+        for quiz_id, question, explanation in rows:
+            value = question + ('\n' + explanation if explanation else '')
+            documents[_rowid('quiz', quiz_id)] = (value, {'quiz_id': quiz_id, 'question': question})
+    if 'discussion' in ids:
+        rows = db.session.query(QuizDiscussion.id, QuizDiscussion.quiz_id, QuizDiscussion.message).filter(
+            QuizDiscussion.id.in_(ids['discussion']))
+        for discussion_id, quiz_id, message in rows:
+            documents[_rowid('discussion', discussion_id)] = (message, {'quiz_id': quiz_id})
+    return documents
+
+
+def search(query, session_ids, kinds=None, limit=20):
+    """
+    在指定会话范围内检索
+
+    Args:
+        query: 查询文本，多个词之间为"与"关系
+        session_ids: 允许检索的会话ID
+        kinds: 只检索这些类型（segment, content, quiz, discussion），默认全部
+
+    Returns:
+        按相关度排序的结果列表，每项包含 type, id, session_id, score, snippet 及对应类型的元数据
+    """
+    tokens = query_tokens(query or '')
+    if not tokens or not session_ids:
+        return []
+    kind_codes = [KINDS[kind] for kind in kinds or [] if kind in KINDS]
+
+    connection = db.session.connection()
+    hits = get_search_index(connection).search(connection, tokens, session_ids, kind_codes, limit)
+    documents = _load_documents(hits)
+
+    results = []
+    for rowid, session_id, score in hits:
+        if rowid not in documents:
+            continue  # 索引与原表不一致（如记录已被批量删除），跳过
+        value, metadata = documents[rowid]
+        results.append({
+            'type': KIND_NAMES[rowid % KIND_SLOTS],
+            'id': rowid // KIND_SLOTS,
+            'session_id': session_id,
+            'score': round(score, 4),
+            'snippet': snippet(value, query),
+            **metadata
+        })
+    return results
@@ -32,6 +32,9 @@ function startSmartQuizChecking() {
         clearInterval(quizCheckInterval);
     }
     
+    // 实时通道已连接时，新题目会被推送过来，轮询只作为兜底
+    const frequency = isLiveSocketOpen() ? Math.max(quizCheckFrequency, 30000) : quizCheckFrequency;
+    
     // 开始智能检查
     quizCheckInterval = setInterval(() => {
         // 如果正在答题且计时器正在运行，跳过这次检查
@@ -43,7 +46,130 @@ function startSmartQuizChecking() {
         if (currentSessionId) {
             checkCurrentQuiz();
         }
-    }, quizCheckFrequency);
+    }, frequency);
+}
+
+// ==================== 实时通道（WebSocket） ====================
+let liveSocket = null;
+let liveSocketSessionId = null;
+let liveRequestSeq = 0;
+const livePendingRequests = new Map();
+
+function isLiveSocketOpen() {
+    return liveSocket !== null && liveSocket.readyState === WebSocket.OPEN;
+}
+
+function connectLiveSocket(sessionId) {
+    disconnectLiveSocket();
+    if (!sessionId || !window.WebSocket) return;
+    
+    liveSocketSessionId = sessionId;
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${window.location.host}/ws/session/${sessionId}`);
+    liveSocket = socket;
+    
+    socket.onopen = () => {
+        log(`实时通道已连接（会话 ${sessionId}）`);
+        startSmartQuizChecking();
+    };
+    
+    socket.onmessage = (event) => {
+        let message;
+        try {
+            message = JSON.parse(event.data);
+        } catch (e) {
+            return;
+        }
+        handleLiveMessage(message);
+    };
+    
+    socket.onclose = () => {
+        if (liveSocket !== socket) return;
+        liveSocket = null;
+        // 未完成的请求交给HTTP重试
+        livePendingRequests.forEach(pending => pending.reject(new Error('实时通道已断开')));
+        livePendingRequests.clear();
+        startSmartQuizChecking();
+        // 仍在同一会话中则稍后重连
+        setTimeout(() => {
+            if (currentSessionId && currentSessionId == liveSocketSessionId && liveSocket === null) {
+                connectLiveSocket(currentSessionId);
+            }
+        }, 5000);
+    };
+}
+
+function disconnectLiveSocket() {
+    if (liveSocket) {
+        const socket = liveSocket;
+        liveSocket = null;
+        socket.close();
+    }
+    liveSocketSessionId = null;
+}
+
+function handleLiveMessage(message) {
+    // 请求的回复
+    if (message.request_id && livePendingRequests.has(message.request_id)) {
+        const pending = livePendingRequests.get(message.request_id);
+        livePendingRequests.delete(message.request_id);
+        pending.resolve({ ok: message.status >= 200 && message.status < 300, data: message.data || {} });
+        return;
+    }
+    
+    switch (message.type) {
+        case 'quiz_activated':
+            // 演讲者发布了新题目，不打断正在答的题
+            if (!(isAnsweringQuiz && quizTimer !== null)) {
+                checkCurrentQuiz();
+            }
+            break;
+        case 'discussion':
+        case 'stats': {
+            // 正在查看的题目讨论有更新时刷新
+            const quizId = message.type === 'discussion' ? message.discussion.quiz_id : message.quiz_id;
+            const detail = document.getElementById('quizDiscussionDetail');
+            const input = document.getElementById(`discussionInput_${quizId}`);
+            if (detail && detail.style.display !== 'none' && input && !input.value) {
+                showQuizDiscussion(quizId);
+            }
+            break;
+        }
+    }
+}
+
+// 通过实时通道发送请求，通道不可用或已断开时回退为HTTP请求；返回 { ok, data }
+async function sendLiveRequest(type, payload, httpUrl) {
+    if (isLiveSocketOpen()) {
+        try {
+            return await new Promise((resolve, reject) => {
+                const requestId = `r${++liveRequestSeq}`;
+                livePendingRequests.set(requestId, { resolve, reject });
+                liveSocket.send(JSON.stringify({ type: type, request_id: requestId, ...payload }));
+                setTimeout(() => {
+                    if (livePendingRequests.has(requestId)) {
+                        livePendingRequests.delete(requestId);
+                        const error = new Error('实时通道请求超时');
+                        error.liveTimeout = true;
+                        reject(error);
+                    }
+                }, 10000);
+            });
+        } catch (error) {
+            // 超时时服务端可能已经处理了请求，不再用HTTP重发，避免重复提交；只有通道断开时才回退
+            if (error.liveTimeout) throw error;
+            console.warn('实时通道请求失败，改用HTTP:', error.message);
+        }
+    }
+    
+    const response = await fetch(httpUrl, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(payload)
+    });
+    return { ok: response.ok, data: await response.json() };
 }
 
 function adjustCheckFrequency(isActive) {
@@ -106,6 +232,9 @@ async function loadSavedSession() {
                     
                     // 检查当前题目
                     checkCurrentQuiz();
+                    
+                    // 连接实时通道
+                    connectLiveSocket(activeSession.id);
                 }
             }
         }
@@ -556,21 +685,13 @@ async function submitAnswer() {
     }
     
     try {
-        const response = await fetch('/api/quiz/answer', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                quiz_id: currentQuizId,
-                answer: answer,
-                answer_duration: answerDuration
-            })
-        });
-        
-        const data = await response.json();
+        const { ok, data } = await sendLiveRequest('answer', {
+            quiz_id: currentQuizId,
+            answer: answer,
+            answer_duration: answerDuration
+        }, '/api/quiz/answer');
         
-        if (response.ok) {
+        if (ok) {
             if (data.already_answered) {
                 // 处理已回答的情况
                 showMessage('您已经回答过这道题', 'warning');
@@ -1453,24 +1574,19 @@ async function postQuizDiscussion(quizId) {
     }
     
     try {
-        const response = await fetch(`/api/quiz/${quizId}/discussions`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ message: message })
-        });
+        const { ok, data } = await sendLiveRequest('discussion', {
+            quiz_id: quizId,
+            message: message
+        }, `/api/quiz/${quizId}/discussions`);
         
-        if (response.ok) {
-            const data = await response.json();
+        if (ok) {
             input.value = '';
             showMessage('讨论发布成功', 'success');
             
             // 重新加载讨论内容
             showQuizDiscussion(quizId);
         } else {
-            const errorData = await response.json();
-            showMessage(errorData.error || '发布失败', 'error');
+            showMessage(data.error || '发布失败', 'error');
         }
     } catch (error) {
         console.error('发布讨论失败:', error);
@@ -1820,6 +1936,9 @@ function selectSession(sessionId, sessionTitle) {
     // 开始检查当前题目
     checkCurrentQuiz();
     
+    // 连接实时通道
+    connectLiveSocket(sessionId);
+    
     showMessage(`已进入会话: ${sessionTitle}`, 'success');
 }
 
@@ -1886,6 +2005,7 @@ function disableNavigation() {
 function leaveCurrentSession() {
     currentSessionId = null;
     currentQuizId = null;
+    disconnectLiveSocket();
     
     // 隐藏当前会话信息
     document.getElementById('currentSessionInfo').style.display = 'none';
@@ -287,8 +287,9 @@ async function handleFileUpload(file) {
         const data = await response.json();
         
         if (response.ok) {
-            showMessage('文件上传成功', 'success');
+            showMessage('文件上传成功，正在后台提取内容', 'success');
             loadSessionContent(currentSessionId);
+            pollContentStatus(data.content.id);
         } else {
             showMessage(data.error || '上传失败', 'error');
         }
@@ -359,6 +360,11 @@ function displayUploadedContent(contents) {
         return;
     }
     
+    // 仍在后台处理的内容继续跟踪状态
+    contents
+        .filter(content => content.status === 'pending' || content.status === 'processing')
+        .forEach(content => pollContentStatus(content.id));
+    
     container.innerHTML = contents.map(content => `
         <div class="card mb-2">
             <div class="card-body d-flex justify-content-between align-items-center">
@@ -366,7 +372,7 @@ function displayUploadedContent(contents) {
                     <strong>${content.original_filename}</strong>
                     <small class="text-muted d-block">
                         类型: ${content.content_type} | 
-                        文本长度: ${content.text_length} |
+                        ${formatContentStatus(content)} |
                         上传时间: ${new Date(content.upload_time).toLocaleString()}
                     </small>
                 </div>
@@ -378,6 +384,54 @@ function displayUploadedContent(contents) {
     `).join('');
 }
 
+// 内容提取状态显示
+const CONTENT_STAGE_LABELS = { parse: '解析文件', ocr: '识别图片文字', transcribe: '语音转写' };
+
+function formatContentStatus(content) {
+    switch (content.status) {
+        case 'pending':
+            return '<span class="text-warning">等待处理</span>';
+        case 'processing':
+            return `<span class="text-warning">处理中：${CONTENT_STAGE_LABELS[content.stage] || content.stage || ''}</span>`;
+        case 'failed':
+            return `<span class="text-danger" title="${content.error || ''}">处理失败</span>`;
+        default:
+            return `文本长度: ${content.text_length}`;
+    }
+}
+
+// 轮询单个内容的提取状态，完成后刷新列表（实时通道可用时也会收到 content_status 推送）
+const pollingContents = new Set();
+
+async function pollContentStatus(contentId) {
+    if (pollingContents.has(contentId)) return;
+    pollingContents.add(contentId);
+    let lastStage = null;
+    try {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            const response = await fetch(`/api/content/${contentId}/status`);
+            if (!response.ok) break;
+            const status = await response.json();
+            if (status.status === 'ready' || status.status === 'failed') {
+                if (status.status === 'failed') {
+                    showMessage(`内容处理失败: ${status.error || '未知错误'}`, 'error');
+                }
+                if (currentSessionId) loadSessionContent(currentSessionId);
+                break;
+            }
+            if (status.stage !== lastStage) {
+                lastStage = status.stage;
+                if (currentSessionId) loadSessionContent(currentSessionId);
+            }
+        }
+    } catch (error) {
+        console.error('获取内容处理状态失败:', error);
+    } finally {
+        pollingContents.delete(contentId);
+    }
+}
+
 // 生成题目
 async function generateQuizzes() {
     const sessionId = document.getElementById('quizSessionSelect').value;
@@ -1307,6 +1361,11 @@ async function loadPublishedQuizzes(sessionId) {
     const container = document.getElementById('publishedQuizzes');
     const countBadge = document.getElementById('publishedQuizCount');
     
+    // 连接该会话的实时通道，答题统计和讨论会被推送过来
+    if (liveSocketSessionId != sessionId) {
+        connectLiveSocket(sessionId);
+    }
+    
     try {
         // 显示加载状态
         container.innerHTML = `
@@ -1374,6 +1433,10 @@ function displayPublishedQuizzes(quizzes) {
                         <small class="text-muted">创建时间: ${new Date(quiz.created_at).toLocaleString()}</small>
                     </div>
                     <div>
+                        ${quiz.is_active ? '' : `
+                        <button class="btn btn-sm btn-outline-success me-2" onclick="activateQuizLive(${quiz.id})">
+                            <i class="fas fa-play me-1"></i>激活
+                        </button>`}
                         <button class="btn btn-sm btn-outline-info me-2" onclick="toggleQuizDetails(${quiz.id})">
                             <i class="fas fa-chart-bar me-1"></i>统计
                         </button>
@@ -1422,7 +1485,7 @@ function displayPublishedQuizzes(quizzes) {
                             <div class="col-md-4 text-end">
                                 <div class="d-flex justify-content-end">
                                     <div class="me-3 text-center">
-                                        <div class="fw-bold text-primary">${quiz.statistics.total_responses}</div>
+                                        <div class="fw-bold text-primary live-total-${quiz.id}">${quiz.statistics.total_responses}</div>
                                         <small class="text-muted">回答人数</small>
                                     </div>
                                     <div class="text-center">
@@ -1453,12 +1516,12 @@ function displayPublishedQuizzes(quizzes) {
                                                 <span class="option-badge ${isCorrect ? 'bg-success' : 'bg-secondary'} me-2">${option}</span>
                                                 <div class="flex-grow-1">
                                                     <div class="d-flex justify-content-between align-items-center mb-1">
-                                                        <small>${count}人</small>
-                                                        <small>${percentage.toFixed(1)}%</small>
+                                                        <small id="liveCount-${quiz.id}-${option}">${count}人</small>
+                                                        <small id="livePct-${quiz.id}-${option}">${percentage.toFixed(1)}%</small>
                                                     </div>
                                                     <div class="progress" style="height: 8px;">
                                                         <div class="progress-bar ${isCorrect ? 'bg-success' : 'bg-secondary'}" 
-                                                             style="width: ${percentage}%"></div>
+                                                             id="liveBar-${quiz.id}-${option}" style="width: ${percentage}%"></div>
                                                     </div>
                                                 </div>
                                             </div>
@@ -1472,7 +1535,7 @@ function displayPublishedQuizzes(quizzes) {
                                 <div class="col-6">
                                     <div class="card bg-light">
                                         <div class="card-body p-3">
-                                            <h5 class="text-primary mb-1">${quiz.statistics.total_responses}</h5>
+                                            <h5 class="text-primary mb-1 live-total-${quiz.id}">${quiz.statistics.total_responses}</h5>
                                             <small class="text-muted">总回答数</small>
                                         </div>
                                     </div>
@@ -1608,18 +1671,12 @@ async function postDiscussion(quizId) {
     }
     
     try {
-        const response = await fetch(`/api/quiz/${quizId}/discussions`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                message: message
-            })
-        });
+        const { ok, data } = await sendLiveRequest('discussion', {
+            quiz_id: quizId,
+            message: message
+        }, `/api/quiz/${quizId}/discussions`);
         
-        if (response.ok) {
-            const data = await response.json();
+        if (ok) {
             input.value = '';
             showMessage('评论发布成功', 'success');
             
@@ -1638,8 +1695,7 @@ async function postDiscussion(quizId) {
                 }
             }
         } else {
-            const error = await response.json();
-            showMessage(error.error || '发布评论失败', 'error');
+            showMessage(data.error || '发布评论失败', 'error');
         }
     } catch (error) {
         console.error('发布讨论错误:', error);
@@ -1653,3 +1709,160 @@ function handleDiscussionKeyPress(event, quizId) {
         postDiscussion(quizId);
     }
 }
+
+// ==================== 实时通道（WebSocket） ====================
+let liveSocket = null;
+let liveSocketSessionId = null;
+let liveRequestSeq = 0;
+const livePendingRequests = new Map();
+
+function isLiveSocketOpen() {
+    return liveSocket !== null && liveSocket.readyState === WebSocket.OPEN;
+}
+
+function connectLiveSocket(sessionId) {
+    if (liveSocket) {
+        const oldSocket = liveSocket;
+        liveSocket = null;
+        oldSocket.close();
+    }
+    if (!sessionId || !window.WebSocket) return;
+    
+    liveSocketSessionId = sessionId;
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${window.location.host}/ws/session/${sessionId}`);
+    liveSocket = socket;
+    
+    // 订阅实时选项分布（服务端按固定最大频率合并推送）
+    socket.onopen = () => {
+        socket.send(JSON.stringify({ type: 'subscribe_stats' }));
+    };
+    
+    socket.onmessage = (event) => {
+        let message;
+        try {
+            message = JSON.parse(event.data);
+        } catch (e) {
+            return;
+        }
+        handleLiveMessage(message);
+    };
+    
+    socket.onclose = () => {
+        if (liveSocket !== socket) return;
+        liveSocket = null;
+        livePendingRequests.forEach(pending => pending.reject(new Error('实时通道已断开')));
+        livePendingRequests.clear();
+        // 稍后重连同一会话
+        setTimeout(() => {
+            if (liveSocket === null && liveSocketSessionId === sessionId) {
+                connectLiveSocket(sessionId);
+            }
+        }, 5000);
+    };
+}
+
+function handleLiveMessage(message) {
+    // 请求的回复
+    if (message.request_id && livePendingRequests.has(message.request_id)) {
+        const pending = livePendingRequests.get(message.request_id);
+        livePendingRequests.delete(message.request_id);
+        pending.resolve({ ok: message.status >= 200 && message.status < 300, data: message.data || {} });
+        return;
+    }
+    
+    switch (message.type) {
+        case 'stats':
+            applyLiveStats(message);
+            break;
+        case 'content_status':
+            if (currentSessionId) {
+                loadSessionContent(currentSessionId);
+            }
+            break;
+        case 'discussion': {
+            const quizId = message.discussion.quiz_id;
+            const panel = document.getElementById(`quizDiscussion-${quizId}`);
+            if (panel && panel.style.display !== 'none') {
+                loadQuizDiscussions(quizId);
+            }
+            break;
+        }
+        case 'quiz_activated':
+            if (liveSocketSessionId) {
+                loadPublishedQuizzes(liveSocketSessionId);
+            }
+            break;
+    }
+}
+
+// 用推送的选项分布更新统计显示
+function applyLiveStats(message) {
+    // total_responses 包含未答题记录，与 /published 返回的统计口径（及百分比分母）一致
+    const total = message.total_responses;
+    document.querySelectorAll(`.live-total-${message.quiz_id}`).forEach(el => {
+        el.textContent = total;
+    });
+    ['A', 'B', 'C', 'D'].forEach(option => {
+        const count = message.option_distribution[option] || 0;
+        const percentage = total > 0 ? count / total * 100 : 0;
+        const countEl = document.getElementById(`liveCount-${message.quiz_id}-${option}`);
+        const pctEl = document.getElementById(`livePct-${message.quiz_id}-${option}`);
+        const barEl = document.getElementById(`liveBar-${message.quiz_id}-${option}`);
+        if (countEl) countEl.textContent = `${count}人`;
+        if (pctEl) pctEl.textContent = `${percentage.toFixed(1)}%`;
+        if (barEl) barEl.style.width = `${percentage}%`;
+    });
+}
+
+// 通过实时通道发送请求，通道不可用或已断开时回退为HTTP请求；返回 { ok, data }
+async function sendLiveRequest(type, payload, httpUrl) {
+    if (isLiveSocketOpen()) {
+        try {
+            return await new Promise((resolve, reject) => {
+                const requestId = `r${++liveRequestSeq}`;
+                livePendingRequests.set(requestId, { resolve, reject });
+                liveSocket.send(JSON.stringify({ type: type, request_id: requestId, ...payload }));
+                setTimeout(() => {
+                    if (livePendingRequests.has(requestId)) {
+                        livePendingRequests.delete(requestId);
+                        const error = new Error('实时通道请求超时');
+                        error.liveTimeout = true;
+                        reject(error);
+                    }
+                }, 10000);
+            });
+        } catch (error) {
+            // 超时时服务端可能已经处理了请求，不再用HTTP重发，避免重复提交；只有通道断开时才回退
+            if (error.liveTimeout) throw error;
+            console.warn('实时通道请求失败，改用HTTP:', error.message);
+        }
+    }
+    
+    const response = await fetch(httpUrl, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(payload)
+    });
+    return { ok: response.ok, data: await response.json() };
+}
+
+// 激活题目（通过实时通道推送给听众）
+async function activateQuizLive(quizId) {
+    try {
+        const { ok, data } = await sendLiveRequest('activate', { quiz_id: quizId }, '/api/quiz/activate');
+        if (ok) {
+            showMessage('题目已激活', 'success');
+            if (liveSocketSessionId) {
+                loadPublishedQuizzes(liveSocketSessionId);
+            }
+        } else {
+            showMessage(data.error || '激活题目失败', 'error');
+        }
+    } catch (error) {
+        console.error('激活题目错误:', error);
+        showMessage('网络错误，请稍后重试', 'error');
+    }
+}
@@ -0,0 +1,165 @@
+"""
+出题前的抽取式压缩
+
+提示词原来携带完整的内容文本，输入token占了调用耗时和费用的大头。这里在构建提示词之前，
+在本地（仅CPU）对内容做一次抽取式摘要：
+
+- 按换行和句末标点切成句子（过长的无标点文本按固定长度切块）
+- 每个句子用哈希后的 TF-IDF 向量表示（中文按二元组切词，与全文检索一致），
+  以余弦相似度建图做 TextRank；句子很多时改用与全文中心向量的相似度，避免 n×n 矩阵过大
+- 按得分从高到低挑选句子，装入token预算后按原文顺序拼接
+
+内容本身没有超出预算时原样返回。压缩比写入调用指标（见 /api/quiz/ai-metrics）。
+
+环境变量：
+    SUMMARY_TOKEN_BUDGET=12000   内容部分的token预算，0 表示不压缩
+"""
+import os
+import re
+import zlib
+
+from app.backend import get_backend
+from app.llm_resilience import METRICS_KEY
+from app.optional_deps import load
+from app.search import index_tokens
+
+HASH_DIM = 1024
+DAMPING = 0.85
+MAX_ITERATIONS = 50
+TOLERANCE = 1e-6
+# 句子数超过该值时不再构建相似度矩阵
+TEXTRANK_MAX_UNITS = 2000
+MIN_UNIT_CHARS = 8
+MAX_UNIT_CHARS = 300
+
+_SENTENCE_END_RE = re.compile(r'(?<=[。！？!?；;])|(?<=\.)\s+')
+
+
+def summary_budget():
+    return int(os.getenv('SUMMARY_TOKEN_BUDGET', 12000))
+
+
+def _rough_tokens(text):
+    return int(len(text) * 0.6) + 1
+
+
+def split_units(text):
+    """把文本切成句子，过短的并入前一句，过长的按固定长度切开"""
+    units = []
+    for line in text.splitlines():
+        for sentence in _SENTENCE_END_RE.split(line):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if units and len(sentence) < MIN_UNIT_CHARS:
+                units[-1] += sentence
+                continue
+            for start in range(0, len(sentence), MAX_UNIT_CHARS):
+                units.append(sentence[start:start + MAX_UNIT_CHARS])
+    return units
+
+
+def _tfidf_vectors(units):
+    """哈希 TF-IDF 向量（行已归一化）"""
+    np = load('numpy')  # 需要压缩内容时才导入
+    tf = np.zeros((len(units), HASH_DIM), dtype=np.float32)
+    for row, unit in enumerate(units):
+        for token in index_tokens(unit).split():
+            tf[row, zlib.crc32(token.encode('utf-8')) % HASH_DIM] += 1
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log((1 + len(units)) / (1 + df)) + 1
+    vectors = tf * idf.astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def salience_scores(units):
+    """句子的重要性得分"""
+    np = load('numpy')
+    vectors = _tfidf_vectors(units)
+    if len(units) > TEXTRANK_MAX_UNITS:
+        return vectors @ vectors.mean(axis=0)
+
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, 0)
+    row_sums = similarity.sum(axis=1, keepdims=True)
+    transition = np.divide(similarity, row_sums, out=np.zeros_like(similarity), where=row_sums > 0)
+    n = len(units)
+    scores = np.full(n, 1.0 / n, dtype=np.float32)
+    for _ in range(MAX_ITERATIONS):
+        updated = (1 - DAMPING) / n + DAMPING * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < TOLERANCE:
+            return updated
+        scores = updated
+    return scores
+
+
+def condense(text, token_budget=None, count_tokens=None):
+    """
+    把文本压缩到token预算以内
+
+    Args:
+        token_budget: 预算，默认取 SUMMARY_TOKEN_BUDGET；0 或 None 表示不压缩
+        count_tokens: 计算token数的函数，默认按字符数估算
+
+    Returns:
+        (压缩后的文本, 报告)，报告包含原始/压缩后的字符数和token数、压缩比、保留句子数
+    """
+    token_budget = summary_budget() if token_budget is None else token_budget
+    count_tokens = count_tokens or _rough_tokens
+    original_tokens = count_tokens(text)
+    report = {
+        'original_chars': len(text),
+        'original_tokens': original_tokens,
+        'summary_chars': len(text),
+        'summary_tokens': original_tokens,
+        'ratio': 1.0,
+        'units_kept': None,
+        'units_total': None
+    }
+    if not token_budget or original_tokens <= token_budget:
+        return text, report
+
+    units = split_units(text)
+    if len(units) < 2:
+        return text, report
+    costs = [count_tokens(unit) for unit in units]
+
+    selected = []
+    used = 0
+    for index in (-salience_scores(units)).argsort(kind='stable'):
+        if used + costs[index] <= token_budget:
+            selected.append(index)
+            used += costs[index]
+    summary = '\n'.join(units[i] for i in sorted(selected))
+
+    summary_tokens = count_tokens(summary)
+    report.update(
+        summary_chars=len(summary),
+        summary_tokens=summary_tokens,
+        ratio=round(summary_tokens / original_tokens, 3) if original_tokens else 1.0,
+        units_kept=len(selected),
+        units_total=len(units)
+    )
+    return summary, report
+
+
+def record_report(report):
+    """把一次压缩的token数累加到调用指标中"""
+    backend = get_backend()
+    backend.hincrby(METRICS_KEY, 'condensed_calls', 1)
+    backend.hincrby(METRICS_KEY, 'condensed_original_tokens', report['original_tokens'])
+    backend.hincrby(METRICS_KEY, 'condensed_summary_tokens', report['summary_tokens'])
+
+
+def compression_metrics():
+    counters = get_backend().hgetall(METRICS_KEY)
+    original = counters.get('condensed_original_tokens', 0)
+    summary = counters.get('condensed_summary_tokens', 0)
+    return {
+        'token_budget': summary_budget(),
+        'condensed_calls': counters.get('condensed_calls', 0),
+        'original_tokens': original,
+        'summary_tokens': summary,
+        'ratio': round(summary / original, 3) if original else None
+    }
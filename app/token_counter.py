@@ -0,0 +1,140 @@
+"""
+token计数与提示词预算
+
+原来按 字符数 × 0.6 估算token，max_tokens 固定为4000：内容过长时请求被服务商拒绝，
+题目多时输出被截断成不完整的JSON。这里用离线分词器计数，并按模型的上下文长度分配预算：
+
+- 优先使用 Qwen 的 tokenizer.json（tokenizers 包，默认读取 instance/tokenizer.json，
+  部署时下载一次即可，见 SETUP.md），计数与服务端一致
+- 否则在设置了 TIKTOKEN_CACHE_DIR（编码文件已缓存）时使用 tiktoken，不联网下载
+- 都不可用时按字符类别估算（汉字约0.7 token/字，其他约0.3 token/字符）
+- 计数越不准，预算时为上下文窗口预留的余量越大（见 SAFETY_MARGINS）
+- 短文本的计数结果做LRU缓存（摘要时每个句子都要计数）
+
+max_tokens 按题目数量计算；单次调用装不下的题目数拆成多次调用；
+内容超出上下文窗口时由调用方压缩，仍然超出则在发请求前抛出 PromptTooLarge。
+
+环境变量：
+    TOKENIZER_PATH=instance/tokenizer.json   本地 tokenizer.json 路径
+    TIKTOKEN_CACHE_DIR=             tiktoken 编码文件缓存目录
+    TIKTOKEN_ENCODING=cl100k_base
+"""
+import os
+import re
+import threading
+from functools import lru_cache
+
+from app.optional_deps import is_available, load
+
+# 模型: (上下文窗口, 最大输出token数)
+MODEL_LIMITS = {
+    'qwen-plus': (131072, 8192),
+    'qwen-turbo': (131072, 8192),
+    'qwen-max': (32768, 8192),
+    'qwen-long': (1000000, 8192),
+}
+DEFAULT_LIMITS = (32768, 4096)
+# 各计数方式预留的上下文窗口比例：tiktoken 的词表与 Qwen 不同，按字符估算误差更大
+SAFETY_MARGINS = {
+    'tokenizers': 0.05,
+    'tiktoken': 0.15,
+    'heuristic': 0.25,
+}
+DEFAULT_TOKENIZER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                      'instance', 'tokenizer.json')
+
+# 每道题（题干4-5句、4个选项、详细解释）的输出token数，及JSON外壳
+OUTPUT_TOKENS_PER_QUESTION = 700
+OUTPUT_TOKENS_BASE = 300
+
+CACHE_MAX_CHARS = 2000
+
+_CJK_RE = re.compile('[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3000-\u303f\uff00-\uffef]')
+
+
+class PromptTooLarge(ValueError):
+    """压缩后的提示词仍超出模型的上下文窗口"""
+
+
+def model_limits(model):
+    return MODEL_LIMITS.get(model, DEFAULT_LIMITS)
+
+
+def output_tokens(num_questions, model):
+    """num_questions 道题需要的 max_tokens（不超过模型的输出上限）"""
+    return min(model_limits(model)[1], OUTPUT_TOKENS_BASE + OUTPUT_TOKENS_PER_QUESTION * num_questions)
+
+
+def question_batches(num_questions, model):
+    """单次调用输出装不下时，把题目数拆成尽量均匀的几批"""
+    per_call = max(1, (model_limits(model)[1] - OUTPUT_TOKENS_BASE) // OUTPUT_TOKENS_PER_QUESTION)
+    calls = max(1, -(-num_questions // per_call))
+    base, extra = divmod(num_questions, calls)
+    return [base + (1 if i < extra else 0) for i in range(calls)]
+
+
+def input_budget(model, max_tokens):
+    """扣除输出和安全余量（按当前计数方式）后可用于输入的token数"""
+    window = model_limits(model)[0]
+    margin = SAFETY_MARGINS[get_token_counter().backend]
+    return int(window * (1 - margin)) - max_tokens
+
+
+def check_fits(model, input_tokens, max_tokens):
+    budget = input_budget(model, max_tokens)
+    if input_tokens > budget:
+        raise PromptTooLarge(f"提示词约 {input_tokens:,} tokens，超出模型 {model} 的可用输入 {budget:,} tokens")
+
+
+class TokenCounter:
+    """离线token计数器"""
+
+    def __init__(self):
+        self.backend, self._encode = self._load_backend()
+        self._cached_count = lru_cache(maxsize=8192)(self._count)
+        print(f"token计数使用: {self.backend}")
+
+    @staticmethod
+    def _load_backend():
+        path = os.getenv('TOKENIZER_PATH') or DEFAULT_TOKENIZER_PATH
+        if os.path.isfile(path) and is_available('tokenizers'):
+            try:
+                tokenizer = load('tokenizers').Tokenizer.from_file(path)
+                return 'tokenizers', lambda text: tokenizer.encode(text, add_special_tokens=False).ids
+            except Exception as e:
+                print(f"警告：加载分词器 {path} 失败: {e}")
+        if os.getenv('TIKTOKEN_CACHE_DIR') and is_available('tiktoken'):
+            try:
+                encoding = load('tiktoken').get_encoding(os.getenv('TIKTOKEN_ENCODING', 'cl100k_base'))
+                return 'tiktoken', lambda text: encoding.encode(text, disallowed_special=())
+            except Exception as e:
+                print(f"警告：加载 tiktoken 编码失败: {e}")
+        print(f"警告：未找到分词器 {path}（或未安装 tokenizers），token数按字符估算，预算时预留更多余量")
+        return 'heuristic', None
+
+    def _count(self, text):
+        if self._encode is not None:
+            return len(self._encode(text))
+        cjk = len(_CJK_RE.findall(text))
+        return int(cjk * 0.7 + (len(text) - cjk) * 0.3) + 1
+
+    def count(self, text):
+        if not text:
+            return 0
+        if len(text) <= CACHE_MAX_CHARS:
+            return self._cached_count(text)
+        return self._count(text)
+
+
+_counter = None
+_counter_lock = threading.Lock()
+
+
+def get_token_counter():
+    """获取token计数器（延迟初始化）"""
+    global _counter
+    if _counter is None:
+        with _counter_lock:
+            if _counter is None:
+                _counter = TokenCounter()
+    return _counter
@@ -0,0 +1,256 @@
+"""
+分段并行语音转写
+
+原来的做法把整个音频解码进内存、导出一个完整的WAV，再一次性交给
+recognize_google，长录音会占用大量内存，而且在线接口对长音频直接失败。
+这里改为：
+
+- 非PCM WAV的文件先由 ffmpeg 一次性转码为 16kHz 单声道PCM临时文件（流式转码，不占用内存），
+  再用 wave 模块按时间窗口顺序读取帧，内存占用与窗口大小成正比，每个窗口只读取自身的数据
+- 在窗口内按静音切分，合并为不超过 TRANSCRIBE_MAX_CHUNK 秒的片段
+- 片段通过线程池并发识别，结果按时间顺序拼接并带上时间戳
+- 识别后端可插拔：google（在线）、vosk（离线）、whisper（离线，faster-whisper）
+
+环境变量：
+    TRANSCRIBE_BACKEND=auto      auto|google|vosk|whisper，auto 优先使用可用的离线后端
+    TRANSCRIBE_WORKERS=4         并发识别的片段数
+    TRANSCRIBE_MAX_CHUNK=30      单个片段的最大时长（秒）
+    TRANSCRIBE_WINDOW=300        每次读取的窗口时长（秒）
+    VOSK_MODEL_PATH=             vosk 模型目录
+    WHISPER_MODEL=small          faster-whisper 模型名称或目录
+"""
+import os
+import json
+import subprocess
+import tempfile
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from app.optional_deps import is_available, load
+
+# 可选依赖 - 各识别后端在首次使用时才导入
+PYDUB_AVAILABLE = is_available('pydub')
+SPEECH_RECOGNITION_AVAILABLE = is_available('speech_recognition')
+VOSK_AVAILABLE = is_available('vosk')
+WHISPER_AVAILABLE = is_available('faster_whisper')
+
+SAMPLE_RATE = 16000
+MAX_WORKERS = int(os.getenv('TRANSCRIBE_WORKERS', 4))
+MAX_CHUNK_SECONDS = float(os.getenv('TRANSCRIBE_MAX_CHUNK', 30))
+WINDOW_SECONDS = float(os.getenv('TRANSCRIBE_WINDOW', 300))
+# 静音检测参数
+MIN_SILENCE_MS = 500
+SILENCE_OFFSET_DB = 16
+
+
+class GoogleRecognizer:
+    """Google 在线语音识别（speech_recognition），先识别中文，失败再识别英文"""
+
+    name = 'google'
+
+    @staticmethod
+    def available():
+        return SPEECH_RECOGNITION_AVAILABLE
+
+    def __init__(self):
+        self.sr = load('speech_recognition')
+        self.recognizer = self.sr.Recognizer()
+
+    def transcribe(self, segment):
+        sr = self.sr
+        audio_data = sr.AudioData(segment.raw_data, segment.frame_rate, segment.sample_width)
+        for language in ('zh-CN', 'en-US'):
+            try:
+                return self.recognizer.recognize_google(audio_data, language=language)
+            except sr.UnknownValueError:
+                continue
+        return ''
+
+
+class VoskRecognizer:
+    """Vosk 离线识别，模型在进程内共享"""
+
+    name = 'vosk'
+
+    @staticmethod
+    def available():
+        model_path = os.getenv('VOSK_MODEL_PATH')
+        return VOSK_AVAILABLE and bool(model_path) and os.path.isdir(model_path)
+
+    def __init__(self):
+        self.vosk = load('vosk')
+        self.vosk.SetLogLevel(-1)
+        self.model = self.vosk.Model(os.getenv('VOSK_MODEL_PATH'))
+
+    def transcribe(self, segment):
+        recognizer = self.vosk.KaldiRecognizer(self.model, segment.frame_rate)
+        recognizer.AcceptWaveform(segment.raw_data)
+        return json.loads(recognizer.FinalResult()).get('text', '')
+
+
+class WhisperRecognizer:
+    """faster-whisper 离线识别（CPU int8），模型本身使用多线程，调用串行执行"""
+
+    name = 'whisper'
+
+    @staticmethod
+    def available():
+        return WHISPER_AVAILABLE
+
+    def __init__(self):
+        self.model = load('faster_whisper').WhisperModel(os.getenv('WHISPER_MODEL', 'small'), device='cpu', compute_type='int8')
+        self._lock = threading.Lock()
+
+    def transcribe(self, segment):
+        np = load('numpy')
+        samples = np.frombuffer(segment.raw_data, dtype=np.int16).astype(np.float32) / 32768.0
+        with self._lock:
+            parts, _ = self.model.transcribe(samples, vad_filter=False)
+            return ''.join(part.text for part in parts).strip()
+
+
+RECOGNIZERS = {
+    'google': GoogleRecognizer,
+    'vosk': VoskRecognizer,
+    'whisper': WhisperRecognizer,
+}
+# auto 模式下的优先顺序：先离线后在线
+AUTO_ORDER = ('vosk', 'whisper', 'google')
+
+_recognizers = {}
+_recognizer_lock = threading.Lock()
+
+
+def get_recognizer(name=None):
+    """按名称获取识别后端（进程内缓存），没有可用后端时返回None"""
+    name = (name or os.getenv('TRANSCRIBE_BACKEND', 'auto')).lower()
+    candidates = AUTO_ORDER if name == 'auto' else (name,)
+    for candidate in candidates:
+        recognizer_class = RECOGNIZERS.get(candidate)
+        if recognizer_class is None or not recognizer_class.available():
+            continue
+        with _recognizer_lock:
+            if candidate not in _recognizers:
+                try:
+                    _recognizers[candidate] = recognizer_class()
+                except Exception as e:
+                    print(f"警告：语音识别后端 {candidate} 初始化失败: {e}")
+                    continue
+            return _recognizers[candidate]
+    return None
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes:02d}:{seconds:02d}'
+
+
+def _split_on_silence(window, max_chunk_ms):
+    """把窗口内的有声区间合并为不超过 max_chunk_ms 的片段，返回 [(开始ms, 结束ms)]"""
+    detect_nonsilent = load('pydub.silence').detect_nonsilent
+    ranges = detect_nonsilent(window, min_silence_len=MIN_SILENCE_MS,
+                              silence_thresh=window.dBFS - SILENCE_OFFSET_DB, seek_step=10)
+    chunks = []
+    for start, end in ranges:
+        # 超长的连续有声区间直接硬切
+        while end - start > max_chunk_ms:
+            chunks.append((start, start + max_chunk_ms))
+            start += max_chunk_ms
+        if chunks and end - chunks[-1][0] <= max_chunk_ms:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+def _open_pcm(file_path):
+    """
+    打开可以按帧读取的PCM WAV
+
+    Returns:
+        (wave读取对象, 临时文件路径)；原文件本身是PCM WAV时临时文件路径为None
+    """
+    try:
+        return wave.open(file_path, 'rb'), None
+    except (wave.Error, EOFError):
+        pass  # 不是WAV，或是wave模块不支持的编码（浮点、压缩等）
+
+    fd, temp_path = tempfile.mkstemp(suffix='.wav')
+    os.close(fd)
+    try:
+        ffmpeg = load('pydub.utils').get_encoder_name()
+        subprocess.run([ffmpeg, '-nostdin', '-v', 'error', '-y', '-i', file_path,
+                        '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-acodec', 'pcm_s16le', temp_path],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        return wave.open(temp_path, 'rb'), temp_path
+    except subprocess.CalledProcessError as e:
+        os.unlink(temp_path)
+        raise RuntimeError(f"音频转码失败: {e.stderr.decode(errors='replace').strip()}")
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+
+def _iter_chunks(file_path, max_chunk_seconds, window_seconds):
+    """按窗口读取并切分，逐个产出 (开始秒, 片段)"""
+    AudioSegment = load('pydub').AudioSegment
+    reader, temp_path = _open_pcm(file_path)
+    try:
+        frame_rate = reader.getframerate()
+        sample_width = reader.getsampwidth()
+        channels = reader.getnchannels()
+        window_frames = max(1, int(window_seconds * frame_rate))
+        position = 0
+        while True:
+            data = reader.readframes(window_frames)
+            if not data:
+                break
+            offset = position / frame_rate
+            position += len(data) // (sample_width * channels)
+            window = AudioSegment(data=data, sample_width=sample_width, frame_rate=frame_rate, channels=channels)
+            window = window.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+            if window.dBFS == float('-inf'):
+                continue  # 整段静音
+            for start_ms, end_ms in _split_on_silence(window, int(max_chunk_seconds * 1000)):
+                yield offset + start_ms / 1000, window[start_ms:end_ms]
+    finally:
+        reader.close()
+        if temp_path:
+            os.unlink(temp_path)
+
+
+def transcribe_segments(file_path, backend=None, max_workers=MAX_WORKERS,
+                        max_chunk_seconds=MAX_CHUNK_SECONDS, window_seconds=WINDOW_SECONDS):
+    """
+    转写音频文件
+
+    Returns:
+        按时间顺序的 [(开始秒, 文本), ...]，没有识别出文字的片段不包含在内
+    """
+    if not PYDUB_AVAILABLE:
+        raise RuntimeError("未安装pydub，无法处理音频")
+    recognizer = get_recognizer(backend)
+    if recognizer is None:
+        raise RuntimeError("没有可用的语音识别后端")
+
+    def work(start, segment):
+        try:
+            return start, recognizer.transcribe(segment)
+        except Exception as e:
+            print(f"识别 {format_timestamp(start)} 处的音频片段失败: {e}")
+            return start, ''
+
+    results = []
+    pending = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for start, segment in _iter_chunks(file_path, max_chunk_seconds, window_seconds):
+            pending.append(executor.submit(work, start, segment))
+            # 限制排队中的片段数，避免整段录音的片段同时驻留内存
+            if len(pending) >= max_workers * 2:
+                results.append(pending.pop(0).result())
+        results.extend(future.result() for future in pending)
+
+    results.sort(key=lambda item: item[0])
+    return [(start, text) for start, text in results if text]
@@ -0,0 +1,43 @@
+"""
+Gunicorn 配置（生产环境多进程部署）
+
+常用环境变量：
+    WEB_CONCURRENCY   worker进程数（默认 CPU核数*2+1）
+    WEB_THREADS       每个worker的线程数（默认 4）
+    BIND              监听地址（默认 0.0.0.0:5000）
+    STATE_BACKEND     多进程时请设置为 redis，并配置 REDIS_URL
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# 每个WebSocket连接会占用一个线程，现场听众较多时请相应调大 WEB_THREADS
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+# AI出题最长可能需要300秒
+timeout = int(os.getenv('WORKER_TIMEOUT', 330))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def on_starting(server):
+    """主进程启动时建表一次，避免多个worker并发执行create_all"""
+    from app import create_app, db, extraction_worker
+    from app.schema import upgrade_schema
+    from app.search import init_search_index
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        upgrade_schema(db)
+        init_search_index(db)
+        # worker尚未启动，此时仍为pending/processing的记录都是上次退出时中断的
+        extraction_worker.mark_interrupted()
+
+    if workers > 1 and os.getenv('STATE_BACKEND', 'memory').lower() != 'redis':
+        server.log.warning(
+            "当前使用进程内状态后端，%d 个worker之间不会共享缓存失效、实时广播和限流状态；"
+            "请设置 STATE_BACKEND=redis 和 REDIS_URL", workers
+        )
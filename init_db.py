@@ -2,6 +2,8 @@
 初始化数据库和创建示例数据
 """
 from app import create_app, db
+from app.schema import upgrade_schema
+from app.search import init_search_index
 from app.models import User, UserRole
 from werkzeug.security import generate_password_hash
 
@@ -12,6 +14,8 @@ def init_database():
     with app.app_context():
         # 创建所有表
         db.create_all()
+        upgrade_schema(db)
+        init_search_index(db)
         
         # 检查是否已有用户数据
         if User.query.count() == 0:
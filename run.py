@@ -1,4 +1,7 @@
-from app import create_app, db
+import os
+from app import create_app, db, extraction_worker
+from app.schema import upgrade_schema
+from app.search import init_search_index
 from app.models import User, Session, Content, Quiz, QuizResponse, QuizDiscussion, Feedback, SessionParticipant
 
 app = create_app()
@@ -7,8 +10,16 @@ if __name__ == '__main__':
     print("正在初始化数据库...")
     with app.app_context():
         db.create_all()
+        upgrade_schema(db)
+        init_search_index(db)
+        extraction_worker.mark_interrupted()
         print("数据库初始化完成")
     
+    host = os.getenv('FLASK_HOST', '0.0.0.0')
+    port = int(os.getenv('FLASK_PORT', 5000))
+    debug = os.getenv('FLASK_DEBUG', 'True').lower() in ('1', 'true', 'yes')
+    
     print("启动 PopQuiz Flask 应用...")
-    print("访问地址: http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    print(f"访问地址: http://localhost:{port}")
+    print("提示：这是单进程开发服务器，生产环境请使用 gunicorn -c gunicorn.conf.py wsgi:app")
+    app.run(debug=debug, host=host, port=port)
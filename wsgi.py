@@ -0,0 +1,9 @@
+"""
+生产环境WSGI入口
+
+使用多worker进程启动：
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import create_app
+
+app = create_app()